@@ -0,0 +1,436 @@
+"""
+asyncio counterparts of the core API code (python 3.7 or newer).
+Pooled connections are closed when their loop shuts down its async
+generators, which 'asyncio.run' does. Requests the environment sets a
+proxy for go through urllib in the loop's default executor.
+Copyright (c) 2010-2013, Anthony Garcia <anthony@lagg.me>
+Distributed under the ISC License (see LICENSE)
+"""
+
+import asyncio
+import functools
+import io
+import socket
+import time
+import weakref
+import zlib
+from . import api
+
+
+class _host(object):
+    """ Connection bookkeeping for a single host on a single event loop """
+
+    def __init__(self):
+        self.idle = []
+        self.busy = 0
+        self.cond = asyncio.Condition()
+
+
+class connection_pool(object):
+    """ Non-blocking version of 'api.connection_pool'. Connections
+    are bound to the event loop they were opened on, so pools are
+    kept per loop. """
+
+    redirect_limit = 10
+
+    def __init__(self, max_connections=10, idle_timeout=30):
+        self._max_connections = max_connections
+        self._idle_timeout = idle_timeout
+        self._loops = weakref.WeakKeyDictionary()
+        self._keepers = weakref.WeakKeyDictionary()
+        self._stats = {"requests": 0, "created": 0, "reused": 0,
+                       "discarded": 0, "waits": 0}
+
+    @property
+    def max_connections(self):
+        return self._max_connections
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    async def _keeper(self, hosts):
+        """ Parked for as long as the loop runs, finalized along with the
+        loop's other async generators on shutdown """
+        try:
+            yield
+        finally:
+            await self._close_hosts(hosts)
+
+    async def _close_hosts(self, hosts):
+        writers = []
+        for host in hosts.values():
+            for reader, writer, last_used in host.idle:
+                writer.close()
+                writers.append(writer)
+                self._stats["discarded"] += 1
+            host.idle = []
+
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _hosts(self):
+        loop = asyncio.get_running_loop()
+        hosts = self._loops.get(loop)
+
+        if hosts is None:
+            hosts = self._loops[loop] = {}
+            # The loop only holds its async generators weakly
+            keeper = self._keepers[loop] = self._keeper(hosts)
+            await keeper.__anext__()
+
+        return hosts
+
+    async def _host(self, hostkey):
+        hosts = await self._hosts()
+
+        if hostkey not in hosts:
+            hosts[hostkey] = _host()
+
+        return hosts[hostkey]
+
+    async def _connect(self, hostkey, timeout, timings=None):
+        scheme, hostname, port = hostkey
+        start = time.time()
+        conn = await asyncio.wait_for(asyncio.open_connection(hostname, port,
+                                                              ssl=(scheme == "https") or None),
+                                      timeout)
+
+        # Resolving happens inside open_connection, so it's counted in here
+        if timings is not None:
+            timings["connect"] = time.time() - start
+
+        return conn
+
+    async def _acquire(self, hostkey, timeout, timings):
+        host = await self._host(hostkey)
+        deadline = None
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        async with host.cond:
+            while True:
+                now = time.time()
+
+                while host.idle:
+                    reader, writer, last_used = host.idle.pop()
+                    if now - last_used < self._idle_timeout and not reader.at_eof():
+                        host.busy += 1
+                        self._stats["reused"] += 1
+                        return (reader, writer), True
+                    writer.close()
+                    self._stats["discarded"] += 1
+
+                if self._max_connections is None or host.busy < self._max_connections:
+                    host.busy += 1
+                    self._stats["created"] += 1
+                    break
+
+                # Waiting for a slot counts against the request's timeout too
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise api.HTTPTimeoutError("Timed out waiting for a connection to " +
+                                                   hostkey[1])
+
+                self._stats["waits"] += 1
+                try:
+                    await asyncio.wait_for(host.cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    # A release may have woken this waiter just as it gave up, pass it on
+                    host.cond.notify()
+                    raise api.HTTPTimeoutError("Timed out waiting for a connection to " +
+                                               hostkey[1])
+
+        try:
+            return (await self._connect(hostkey, timeout, timings)), False
+        except:
+            await self._release(hostkey, None, False)
+            raise
+
+    async def _release(self, hostkey, conn, reusable):
+        host = await self._host(hostkey)
+
+        async with host.cond:
+            host.busy -= 1
+
+            if reusable:
+                host.idle.append(conn + (time.time(),))
+            elif conn:
+                conn[1].close()
+                self._stats["discarded"] += 1
+
+            host.cond.notify()
+
+    async def _exchange(self, conn, path, headers, timings):
+        reader, writer = conn
+        lines = ["GET {0} HTTP/1.1".format(path)]
+        lines += ["{0}: {1}".format(k, v) for k, v in headers.items()]
+
+        start = time.time()
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        status = await reader.readline()
+        if not status:
+            raise ConnectionResetError("Server closed the connection")
+        timings["ttfb"] = time.time() - start
+
+        version, code, reason = (status.decode("latin-1").strip().split(' ', 2) + [''])[:3]
+        code = int(code)
+
+        head = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            k, sep, v = line.decode("latin-1").partition(':')
+            head[k.strip().lower()] = v.strip()
+
+        connection = head.get("connection", '').lower()
+        if version == "HTTP/1.0":
+            keepalive = connection == "keep-alive"
+        else:
+            keepalive = connection != "close"
+
+        if code == 204 or code == 304:
+            body = b''
+        elif "chunked" in head.get("transfer-encoding", '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers
+                    while (await reader.readline()).strip():
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        elif "content-length" in head:
+            body = await reader.readexactly(int(head["content-length"]))
+        else:
+            body = await reader.read()
+            keepalive = False
+
+        timings["body"] = time.time() - start - timings["ttfb"]
+
+        return code, reason, head, body, keepalive
+
+    async def _request(self, url, headers, timeout):
+        parts = api.urlsplit(url)
+        scheme = parts.scheme or "http"
+
+        try:
+            port = parts.port
+        except ValueError:
+            port = None
+            parts = None
+
+        if not parts or not parts.hostname:
+            raise api.HTTPError("Invalid URL: " + url)
+
+        hostkey = (scheme, parts.hostname, port or (443 if scheme == "https" else 80))
+        path = parts.path or '/'
+
+        if parts.query:
+            path += '?' + parts.query
+
+        head = {"Host": parts.netloc}
+        head.update(headers)
+
+        timings = {}
+        conn, reused = await self._acquire(hostkey, timeout, timings)
+        reusable = False
+
+        try:
+            try:
+                res = await asyncio.wait_for(self._exchange(conn, path, head, timings), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+
+                # The server hung up on an idle keep-alive connection
+                conn[1].close()
+                conn = await self._connect(hostkey, timeout, timings)
+                res = await asyncio.wait_for(self._exchange(conn, path, head, timings), timeout)
+
+            code, reason, rhead, body, reusable = res
+        finally:
+            await self._release(hostkey, conn, reusable)
+
+        self._stats["requests"] += 1
+
+        return api.http_response(code, reason, rhead, io.BytesIO(body), timings=timings)
+
+    def _urllib_open(self, url, headers, timeout):
+        """ Blocking fetch through urllib, meant to run in an executor """
+        resp = api.urllib_transport().open(url, headers, timeout)
+        body = resp._read_raw()
+        resp._finish(True)
+
+        return api.http_response(resp.code, resp.reason, resp.headers,
+                                 io.BytesIO(body), timings=resp.timings)
+
+    async def open(self, url, headers, timeout):
+        for i in range(self.redirect_limit + 1):
+            if api._proxied(url):
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self._urllib_open, url, headers, timeout))
+
+            resp = await self._request(url, headers, timeout)
+            location = resp.headers.get("location")
+
+            if resp.code not in api.connection_pool._redirect_codes or not location:
+                return resp
+
+            url = api.urljoin(url, location)
+
+        raise api.HTTPError("Too many redirects")
+
+    async def close(self):
+        """ Close the idle connections of the running loop and wait
+        for them to go away """
+        await self._close_hosts(await self._hosts())
+
+    def clear(self):
+        """ Close all idle connections """
+        for hosts in list(self._loops.values()):
+            for host in hosts.values():
+                for reader, writer, last_used in host.idle:
+                    writer.close()
+                    self._stats["discarded"] += 1
+                host.idle = []
+
+    def stats(self):
+        """ Returns a dict of pool counters along with the amount of
+        idle and busy connections, in total and per host """
+        stats = dict(self._stats)
+        hosts = {}
+
+        for loophosts in list(self._loops.values()):
+            for hostkey, host in loophosts.items():
+                hoststats = hosts.setdefault("{0}://{1}:{2}".format(*hostkey),
+                                             {"idle": 0, "busy": 0})
+                hoststats["idle"] += len(host.idle)
+                hoststats["busy"] += host.busy
+
+        stats["idle"] = sum([h["idle"] for h in hosts.values()])
+        stats["busy"] = sum([h["busy"] for h in hosts.values()])
+        stats["hosts"] = hosts
+
+        return stats
+
+
+async def _cache_io(downloader, func, *args):
+    """ Calls 'func' that goes through the downloader's cache, in the
+    loop's default executor if the cache can block on its disk tier.
+    Caches other than 'api.response_cache' are assumed to. """
+    store = downloader._cache_store()
+
+    if not store or (isinstance(store, api.response_cache) and store.path is None):
+        return func(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+async def _fetch(downloader):
+    conn = api.async_transport.get()
+    info = downloader._request_started()
+    req = None
+
+    try:
+        try:
+            req = await conn.open(downloader.url, downloader._build_headers(),
+                                  downloader._timeout)
+            body = req.read()
+            info["bytes"] = len(body)
+        except (asyncio.TimeoutError, socket.timeout):
+            raise api.HTTPTimeoutError("Server took too long to respond")
+        except (OSError, ValueError, asyncio.IncompleteReadError, zlib.error) as E:
+            raise api.HTTPError("Server read error: {0}".format(E))
+
+        body = await _cache_io(downloader, downloader._handle_response, req, body)
+    except api.HTTPError as E:
+        downloader._request_finished(info, req, E)
+        raise
+
+    downloader._request_finished(info, req)
+
+    return body
+
+
+async def _download(downloader):
+    attempt = 0
+    while True:
+        wait = downloader._rate_delay()
+        if wait:
+            await asyncio.sleep(wait)
+
+        try:
+            return await _fetch(downloader)
+        except api.HTTPError as E:
+            delay = downloader._retry_delay(attempt, E)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+# Tasks of in flight downloads per loop, see 'api.coalescing'
+_flights = weakref.WeakKeyDictionary()
+
+
+async def _flight(downloader):
+    body = await _download(downloader)
+    return body, downloader._last_modified
+
+
+def _landed(flights, key, flight):
+    del flights[key]
+
+    if not flight.cancelled():
+        # Everyone waiting might have been cancelled, don't warn about it
+        flight.exception()
+
+
+async def download(downloader):
+    """ Fetches the URL of an 'api.http_downloader' without blocking,
+    caching, rate limiting, retries, coalescing and error mapping work
+    the same way 'download' does """
+    cached = await _cache_io(downloader, downloader._cached_body)
+    if cached is not None:
+        return cached
+
+    if not api.coalescing.get():
+        return await _download(downloader)
+
+    loop = asyncio.get_running_loop()
+    flights = _flights.setdefault(loop, {})
+    key = downloader._flight_key()
+    flight = flights.get(key)
+
+    if flight:
+        downloader._coalesced()
+    else:
+        # Runs on its own so cancelling whoever started it leaves the others be
+        flight = flights[key] = loop.create_task(_flight(downloader))
+        flight.add_done_callback(functools.partial(_landed, flights, key))
+
+    body, downloader._last_modified = await asyncio.shield(flight)
+    return body
+
+
+async def call(result, value=None):
+    """ Awaitable version of 'api.method_result.call' """
+    result._apply(await download(result._downloader))
+
+    if value is None:
+        return result
+    else:
+        return value
@@ -5,21 +5,39 @@ Distributed under the ISC License (see LICENSE)
 """
 
 import os
+import io
+import re
 import json
+import codecs
+import hashlib
+import random
 import socket
 import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from email.utils import parsedate_tz, mktime_tz
 
 # Python 2 <-> 3 glue
 try:
-    from urllib.request import urlopen
+    from collections import OrderedDict as odict
+except ImportError:
+    odict = dict
+
+try:
+    from urllib.request import urlopen, getproxies, proxy_bypass
     from urllib.request import Request as urlrequest
-    from urllib.parse import urlencode
+    from urllib.parse import urlencode, urlsplit, urlunsplit, urljoin, parse_qsl
     from urllib import error as urlerror
+    import http.client as httplib
 except ImportError:
     from urllib2 import urlopen
     from urllib2 import Request as urlrequest
-    from urllib import urlencode
+    from urllib import urlencode, getproxies, proxy_bypass
+    from urlparse import urlsplit, urlunsplit, urljoin, parse_qsl
     import urllib2 as urlerror
+    import httplib
 
 
 class SteamError(Exception):
@@ -38,8 +56,14 @@ class APIKeyMissingError(APIError):
 
 
 class HTTPError(APIError):
-    """ Raised for other HTTP codes or results """
-    pass
+    """ Raised for other HTTP codes or results. 'code' is the HTTP status
+    if there was one and 'retry_after' the seconds the server asked us to
+    wait before trying again """
+
+    def __init__(self, msg, code=None, retry_after=None):
+        super(HTTPError, self).__init__(msg)
+        self.code = code
+        self.retry_after = retry_after
 
 
 class HTTPStale(HTTPError):
@@ -94,23 +118,200 @@ class socket_timeout(object):
         return cls.__timeout
 
 
+class compression(object):
+    """ Global switch for asking servers for gzip/deflate compressed
+    responses, on by default """
+    __enabled = True
+
+    @classmethod
+    def set(cls, value):
+        cls.__enabled = bool(value)
+
+    @classmethod
+    def get(cls):
+        return cls.__enabled
+
+
+class hooks(object):
+    """ Global registry of instrumentation callbacks. Each one is called
+    as hook(event, info) where event is one of "request_start",
+    "request_end", "cache", "coalesced" or "decode" and info a dict
+    describing it. Exceptions raised by hooks are ignored. """
+    __hooks = []
+
+    @classmethod
+    def add(cls, hook):
+        cls.__hooks = cls.__hooks + [hook]
+
+    @classmethod
+    def remove(cls, hook):
+        cls.__hooks = [h for h in cls.__hooks if h is not hook]
+
+    @classmethod
+    def get(cls):
+        return cls.__hooks
+
+    @classmethod
+    def fire(cls, event, info):
+        for hook in cls.__hooks:
+            try:
+                hook(event, info)
+            except Exception:
+                # Instrumentation should never break a request
+                pass
+
+
+def endpoint(url):
+    """ Returns the "interface.method" name of a WebAPI URL, or the host
+    name for everything else (community pages and such) """
+    parts = urlsplit(url)
+    path = parts.path.strip('/').split('/')
+
+    if parts.hostname == "api.steampowered.com" and len(path) >= 2:
+        return path[0] + '.' + path[1]
+    else:
+        return parts.hostname
+
+
+class latency_histogram(object):
+    """ Cumulative histogram with Prometheus style upper bounds (seconds) """
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        if buckets:
+            self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """ Returns a dict with "buckets" (a list of (upper bound,
+        cumulative count) tuples ending in "+Inf"), "sum" and "count" """
+        total = 0
+        buckets = []
+
+        for bound, count in zip(self.buckets + ("+Inf",), self._counts):
+            total += count
+            buckets.append((bound, total))
+
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class metrics(object):
+    """ Hook aggregating counters and latency histograms per endpoint
+    (see 'endpoint'). Register an instance with 'hooks.add' and read it
+    through 'snapshot', e.g. from a Prometheus or StatsD exporter. """
+
+    def __init__(self, buckets=None):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _endpoint(self, name):
+        stats = self._endpoints.get(name)
+
+        if not stats:
+            stats = {"requests": 0, "errors": 0, "bytes": 0, "status": {},
+                     "cache": {}, "in_flight": 0, "coalesced": 0}
+            for timer in ("latency", "dns", "connect", "ttfb", "body", "decode"):
+                stats[timer] = latency_histogram(self._buckets)
+            self._endpoints[name] = stats
+
+        return stats
+
+    def __call__(self, event, info):
+        with self._lock:
+            stats = self._endpoint(info["endpoint"])
+
+            if event == "request_start":
+                stats["in_flight"] += 1
+            elif event == "request_end":
+                stats["in_flight"] -= 1
+                stats["requests"] += 1
+                stats["bytes"] += info.get("bytes") or 0
+
+                if info.get("error"):
+                    stats["errors"] += 1
+
+                status = info.get("status")
+                if status is not None:
+                    stats["status"][status] = stats["status"].get(status, 0) + 1
+
+                stats["latency"].observe(info["elapsed"])
+                for phase, value in info.get("timings", {}).items():
+                    if phase in stats:
+                        stats[phase].observe(value)
+            elif event == "cache":
+                result = info["result"]
+                stats["cache"][result] = stats["cache"].get(result, 0) + 1
+            elif event == "coalesced":
+                stats["coalesced"] += 1
+            elif event == "decode":
+                stats["decode"].observe(info["elapsed"])
+
+    def snapshot(self):
+        """ Returns a dict of endpoint names to their counters, with
+        histograms as returned by 'latency_histogram.snapshot' """
+        snapshot = {}
+
+        with self._lock:
+            for name, stats in self._endpoints.items():
+                snapshot[name] = dict([(k, v.snapshot() if isinstance(v, latency_histogram) else
+                                        (dict(v) if isinstance(v, dict) else v))
+                                       for k, v in stats.items()])
+
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
 class _interface_method(object):
     def __init__(self, iface, name):
         self._iface = iface
         self._name = name
 
-    def __call__(self, method="GET", version=1, timeout=None, since=None,
-                 aggressive=False, **kwargs):
+    def _build_url(self, version, kwargs):
         kwargs.setdefault("format", "json")
         kwargs.setdefault("key", key.get())
-        url = "http://api.steampowered.com/{0}/{1}/v{2}?{3}".format(self._iface,
+
+        return "http://api.steampowered.com/{0}/{1}/v{2}?{3}".format(self._iface,
                                                                     self._name,
                                                                     version,
                                                                     urlencode(kwargs))
 
+    def __call__(self, method="GET", version=1, timeout=None, since=None,
+                 aggressive=False, **kwargs):
+        url = self._build_url(version, kwargs)
+
         return method_result(url, last_modified=since, timeout=timeout, aggressive=aggressive)
 
 
+def _aio():
+    """ Imports 'aio', which is written for python 3.7 or newer """
+    if sys.version_info < (3, 7):
+        raise RuntimeError("Awaitable calls need python 3.7 or newer, running {0}.{1}"
+                           .format(*sys.version_info[:2]))
+
+    from . import aio
+    return aio
+
+
+class _async_interface_method(_interface_method):
+    def __call__(self, method="GET", version=1, timeout=None, since=None,
+                 aggressive=False, **kwargs):
+        url = self._build_url(version, kwargs)
+
+        return method_result(url, last_modified=since, timeout=timeout).call_async()
+
+
 class interface(object):
     def __init__(self, iface):
         self._iface = iface
@@ -119,58 +320,1109 @@ class interface(object):
         return _interface_method(self._iface, name)
 
 
+class async_interface(interface):
+    """ Same as 'interface' but methods return awaitables resolving to
+    a fetched 'method_result' instead, requires python 3.7 or newer """
+
+    def __init__(self, iface):
+        _aio()
+        super(async_interface, self).__init__(iface)
+
+    def __getattr__(self, name):
+        return _async_interface_method(self._iface, name)
+
+
+class _deflate_decoder(object):
+    """ 'deflate' is supposed to be zlib wrapped, but some servers send
+    raw deflate streams instead """
+
+    def __init__(self):
+        self._obj = None
+
+    def decompress(self, data):
+        if self._obj is None and data:
+            self._obj = zlib.decompressobj(zlib.MAX_WBITS)
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        return self._obj.decompress(data) if self._obj else b''
+
+    def flush(self):
+        return self._obj.flush() if self._obj else b''
+
+
+class http_response(object):
+    """ Response handed back by a transport. The body is read through
+    'read' like a file object, once it has been consumed (or the response
+    closed) the underlying connection is handed back to its owner.
+    gzip and deflate content encodings are decoded as the body comes in.
+    'timings' holds whichever of the dns, connect and ttfb phases (in
+    seconds) the transport was able to measure. """
+
+    _chunk_size = 64 * 1024
+
+    def __init__(self, code, reason, headers, body, release=None, timings=None):
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.timings = timings or {}
+        self._body = body
+        self._release = release
+        self._decoder = None
+        self._buffer = b''
+
+        encoding = headers.get("content-encoding", '').strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._decoder = _deflate_decoder()
+
+    def _finish(self, complete):
+        body, self._body = self._body, None
+        release, self._release = self._release, None
+
+        if release:
+            release(complete)
+        elif body is not None:
+            body.close()
+
+    def _read_raw(self, size=-1):
+        if self._body is None:
+            return b''
+
+        if size is None or size < 0:
+            data = self._body.read()
+            self._finish(True)
+        else:
+            data = self._body.read(size)
+            isclosed = getattr(self._body, "isclosed", None)
+            if not data or (isclosed and isclosed()):
+                self._finish(True)
+
+        return data
+
+    def _decode(self, size):
+        """ Feeds the decoder until 'size' decoded bytes are buffered
+        or the body runs out """
+        decoder = self._decoder
+
+        while decoder and (size < 0 or len(self._buffer) < size):
+            raw = self._read_raw(-1 if size < 0 else max(size, self._chunk_size))
+            self._buffer += decoder.decompress(raw)
+
+            if self._body is None:
+                self._buffer += decoder.flush()
+                self._decoder = decoder = None
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+
+        if not self._decoder and not self._buffer:
+            return self._read_raw(size)
+
+        self._decode(size)
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
+
+    def close(self):
+        self._finish(False)
+
+
+class urllib_transport(object):
+    """ Opens a new connection for every request through urllib. This is
+    how steamodd always fetched data and is kept around for setups relying
+    on urllib handlers (proxies and such) """
+
+    def open(self, url, headers, timeout):
+        start = time.time()
+
+        try:
+            req = urlopen(urlrequest(url, headers=headers), timeout=timeout)
+            code = req.code
+            reason = getattr(req, "msg", '')
+        except urlerror.HTTPError as E:
+            req = E
+            code = E.getcode()
+            # More portability hax (no reason property in 2.6?)
+            try:
+                reason = E.reason
+            except AttributeError:
+                reason = "Connection error"
+
+        head = dict([(k.lower(), v) for k, v in req.info().items()])
+
+        return http_response(code, reason, head, req, timings={"ttfb": time.time() - start})
+
+
+def _timed_connector(timings):
+    """ Stands in for socket.create_connection, recording how long name
+    resolution and connecting took in 'timings' """
+
+    def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          source_address=None):
+        host, port = address
+        start = time.time()
+        addrs = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        timings["dns"] = time.time() - start
+
+        start = time.time()
+        error = socket.error("No addresses found for " + str(host))
+        for family, socktype, proto, canonname, sockaddr in addrs:
+            try:
+                sock = socket.create_connection(sockaddr[:2], timeout, source_address)
+                timings["connect"] = time.time() - start
+                return sock
+            except socket.error as E:
+                error = E
+
+        raise error
+
+    return create_connection
+
+
+def _send_request(conn, path, headers):
+    """ Sends a GET over 'conn', not being able to connect or send is
+    raised as a timeout like urllib's URLError always was """
+    try:
+        conn.request("GET", path, headers=headers)
+    except socket.timeout:
+        raise
+    except socket.error as E:
+        raise HTTPTimeoutError("Couldn't connect to server: {0}".format(E))
+
+
+def _proxied(url):
+    """ Whether the environment configures a proxy for 'url' """
+    parts = urlsplit(url)
+    proxies = getproxies()
+
+    return (parts.scheme in proxies and
+            not (parts.hostname and proxy_bypass(parts.hostname)))
+
+
+class connection_pool(object):
+    """ Keeps a per-host pool of persistent HTTP/1.1 connections.
+    max_connections caps the amount of connections open to a single
+    host, further requests wait for one to be released. Idle connections
+    older than idle_timeout seconds are closed instead of reused.
+    Requests that the environment sets a proxy for (http_proxy and
+    such) go through urllib instead. """
+
+    redirect_limit = 10
+    _redirect_codes = (301, 302, 303, 307, 308)
+
+    def __init__(self, max_connections=10, idle_timeout=30):
+        self._max_connections = max_connections
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Condition()
+        self._idle = {}
+        self._busy = {}
+        self._stats = {"requests": 0, "created": 0, "reused": 0,
+                       "discarded": 0, "waits": 0}
+
+    @property
+    def max_connections(self):
+        return self._max_connections
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    def _acquire(self, hostkey, timeout):
+        scheme, host, port = hostkey
+        deadline = None
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self._lock:
+            while True:
+                idle = self._idle.get(hostkey, [])
+                now = time.time()
+
+                # Most recently used first, the rest is older still if it's expired
+                while idle:
+                    conn, last_used = idle.pop()
+                    if now - last_used < self._idle_timeout:
+                        self._busy[hostkey] = self._busy.get(hostkey, 0) + 1
+                        self._stats["reused"] += 1
+                        return conn, True
+                    conn.close()
+                    self._stats["discarded"] += 1
+
+                busy = self._busy.get(hostkey, 0)
+                if self._max_connections is None or busy < self._max_connections:
+                    self._busy[hostkey] = busy + 1
+                    self._stats["created"] += 1
+                    break
+
+                # Waiting for a slot counts against the request's timeout too
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise HTTPTimeoutError("Timed out waiting for a connection to " + host)
+
+                self._stats["waits"] += 1
+                self._lock.wait(remaining)
+
+        try:
+            if scheme == "https":
+                conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+            else:
+                conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        except (TypeError, ValueError, httplib.HTTPException, socket.error) as E:
+            # Give the slot back, or the next request waits on it forever
+            self._release(hostkey, None, False)
+            raise HTTPError("Couldn't open a connection to {0}: {1}".format(host, E))
+
+        return conn, False
+
+    def _release(self, hostkey, conn, reusable):
+        with self._lock:
+            self._busy[hostkey] -= 1
+
+            if reusable:
+                self._idle.setdefault(hostkey, []).append((conn, time.time()))
+            elif conn:
+                conn.close()
+                self._stats["discarded"] += 1
+
+            self._lock.notify()
+
+    def _request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+
+        try:
+            port = parts.port
+        except ValueError:
+            port = None
+            parts = None
+
+        if not parts or not parts.hostname:
+            raise HTTPError("Invalid URL: " + url)
+
+        hostkey = (scheme, parts.hostname, port or (443 if scheme == "https" else 80))
+        path = parts.path or '/'
+
+        if parts.query:
+            path += '?' + parts.query
+
+        conn, reused = self._acquire(hostkey, timeout)
+        timings = {}
+        start = time.time()
+
+        try:
+            conn.timeout = timeout
+            conn._create_connection = _timed_connector(timings)
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+
+            try:
+                _send_request(conn, path, headers)
+                resp = conn.getresponse()
+            except socket.timeout:
+                raise
+            except (httplib.HTTPException, socket.error, HTTPTimeoutError):
+                if not reused:
+                    raise
+
+                # The server hung up on an idle keep-alive connection,
+                # close it so the request goes out on a fresh one
+                conn.close()
+                _send_request(conn, path, headers)
+                resp = conn.getresponse()
+        except BaseException:
+            # Interrupts too, or the slot would be gone for good
+            self._release(hostkey, conn, False)
+            raise
+
+        timings["ttfb"] = time.time() - start - timings.get("dns", 0) - timings.get("connect", 0)
+
+        with self._lock:
+            self._stats["requests"] += 1
+
+        def release(complete):
+            if not complete:
+                resp.close()
+            self._release(hostkey, conn, complete and not resp.will_close)
+
+        head = dict([(k.lower(), v) for k, v in resp.getheaders()])
+
+        return http_response(resp.status, resp.reason, head, resp, release, timings)
+
+    def open(self, url, headers, timeout):
+        for i in range(self.redirect_limit + 1):
+            if _proxied(url):
+                return urllib_transport().open(url, headers, timeout)
+
+            resp = self._request(url, headers, timeout)
+            location = resp.headers.get("location")
+
+            if resp.code not in self._redirect_codes or not location:
+                return resp
+
+            resp.read()
+            url = urljoin(url, location)
+
+        raise HTTPError("Too many redirects")
+
+    def clear(self):
+        """ Close all idle connections """
+        with self._lock:
+            for conns in self._idle.values():
+                for conn, last_used in conns:
+                    conn.close()
+                    self._stats["discarded"] += 1
+            self._idle = {}
+
+    def stats(self):
+        """ Returns a dict of pool counters along with the amount of
+        idle and busy connections, in total and per host """
+        with self._lock:
+            stats = dict(self._stats)
+            hosts = {}
+
+            for hostkey in set(self._idle.keys()) | set(self._busy.keys()):
+                hosts["{0}://{1}:{2}".format(*hostkey)] = {
+                        "idle": len(self._idle.get(hostkey, [])),
+                        "busy": self._busy.get(hostkey, 0)
+                        }
+
+            stats["idle"] = sum([h["idle"] for h in hosts.values()])
+            stats["busy"] = sum([h["busy"] for h in hosts.values()])
+            stats["hosts"] = hosts
+
+        return stats
+
+
+class transport(object):
+    """ Global transport used by http_downloader, can be overridden by
+    transports passed to ctor. Set it to a 'urllib_transport' to get a new
+    connection per request """
+    __transport = connection_pool()
+
+    @classmethod
+    def set(cls, value):
+        cls.__transport = value
+
+    @classmethod
+    def get(cls):
+        return cls.__transport
+
+
+class async_transport(object):
+    """ Global transport used by awaitable downloads, defaults to an
+    'aio.connection_pool' created on first use """
+    __transport = None
+
+    @classmethod
+    def set(cls, value):
+        cls.__transport = value
+
+    @classmethod
+    def get(cls):
+        if not cls.__transport:
+            cls.__transport = _aio().connection_pool()
+
+        return cls.__transport
+
+
+def _atomic_write(path, write):
+    """ Calls 'write' with a temp file next to 'path' that then replaces
+    it, so readers never see a partly written file. The temp file is
+    removed if anything fails along the way. """
+    tmpname = "{0}.{1}.{2}.tmp".format(path, os.getpid(),
+                                       threading.current_thread().ident)
+
+    try:
+        with open(tmpname, "wb") as f:
+            write(f)
+        getattr(os, "replace", os.rename)(tmpname, path)
+    except:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+        raise
+
+
+class _cache_entry(object):
+    def __init__(self, body, last_modified=None, etag=None, stored=None):
+        self.body = body
+        self.last_modified = last_modified
+        self.etag = etag
+        self.stored = stored or time.time()
+
+
+class response_cache(object):
+    """ Stores response bodies along with their Last-Modified and ETag
+    headers so that downloads can be revalidated instead of repeated.
+    Entries younger than ttl seconds are served without asking the server
+    at all. A size-bounded LRU memory tier sits in front of an optional
+    disk tier in 'path' which survives restarts. On disk an entry's
+    mtime is when it was stored and its atime when it was last used. """
+
+    # Disk eviction trims down to this fraction of max_disk, so that a
+    # full cache doesn't rescan its directory on every write
+    _disk_low_water = 0.9
+
+    # Names of the files the disk tier writes, an entry's being the SHA-1
+    # of its key and a temp file that name followed by pid, thread and
+    # ".tmp" (see _atomic_write). Anything else in 'path' isn't touched.
+    _entry_name = re.compile(r"[0-9a-f]{40}$")
+    _temp_name = re.compile(r"[0-9a-f]{40}\.\d+\.\d+\.tmp$")
+
+    def __init__(self, path=None, ttl=300, max_memory=32 * 1024 * 1024,
+                 max_disk=512 * 1024 * 1024):
+        self._path = path
+        self._ttl = ttl
+        self._max_memory = max_memory
+        self._max_disk = max_disk
+        self._memory = odict()
+        self._memory_size = 0
+        # Size of the disk tier, None until the directory was scanned
+        self._disk_size = None
+        self._lock = threading.Lock()
+
+        if path and not os.path.isdir(path):
+            os.makedirs(path)
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @property
+    def path(self):
+        """ Directory of the disk tier, None if there's none """
+        return self._path
+
+    @staticmethod
+    def canonical_url(url):
+        """ Returns the cache key for a URL: sorted query args without the
+        API key, so that changing keys doesn't invalidate anything """
+        parts = urlsplit(url)
+        query = sorted([(k, v) for k, v in parse_qsl(parts.query, True) if k != "key"])
+
+        return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path,
+                           urlencode(query), ''))
+
+    def _filename(self, key):
+        return os.path.join(self._path, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _remember(self, key, entry):
+        size = len(entry.body)
+
+        if size > self._max_memory:
+            return
+
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old:
+                self._memory_size -= len(old.body)
+
+            self._memory[key] = entry
+            self._memory_size += size
+
+            while self._memory_size > self._max_memory:
+                oldkey, old = self._memory.popitem(last=False)
+                self._memory_size -= len(old.body)
+
+    def _read_disk(self, key):
+        if not self._path:
+            return None
+
+        filename = self._filename(key)
+
+        try:
+            with open(filename, "rb") as f:
+                meta = json.loads(f.readline().decode("utf-8"))
+                body = f.read()
+                stored = os.fstat(f.fileno()).st_mtime
+            # Mark it as recently used for eviction
+            os.utime(filename, (time.time(), stored))
+        except (IOError, OSError, ValueError):
+            return None
+
+        if meta.get("url") != key:
+            return None
+
+        return _cache_entry(body, meta.get("last_modified"), meta.get("etag"), stored)
+
+    def _write_disk(self, key, entry):
+        if not self._path:
+            return
+
+        meta = json.dumps({"url": key, "last_modified": entry.last_modified,
+                           "etag": entry.etag})
+
+        meta = meta.encode("utf-8") + b"\n"
+        filename = self._filename(key)
+
+        def write(f):
+            f.write(meta)
+            f.write(entry.body)
+
+        try:
+            old = os.path.getsize(filename)
+        except OSError:
+            old = 0
+
+        try:
+            _atomic_write(filename, write)
+            os.utime(filename, (entry.stored, entry.stored))
+        except (IOError, OSError):
+            return
+
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += len(meta) + len(entry.body) - old
+            full = self._disk_size is None or self._disk_size > self._max_disk
+
+        if full:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """ Scans the disk tier, removing the least recently used entries
+        if it grew past max_disk """
+        files = []
+        total = 0
+
+        for name in os.listdir(self._path):
+            if not self._entry_name.match(name):
+                continue
+            filename = os.path.join(self._path, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            files.append((st.st_atime, st.st_size, filename))
+            total += st.st_size
+
+        if total > self._max_disk:
+            files.sort()
+            for atime, size, filename in files:
+                if total <= self._max_disk * self._disk_low_water:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                total -= size
+
+        with self._lock:
+            self._disk_size = total
+
+    def get(self, url):
+        """ Returns the stored entry for url or None """
+        key = self.canonical_url(url)
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                del self._memory[key]
+                self._memory[key] = entry
+                return entry
+
+        entry = self._read_disk(key)
+        if entry:
+            self._remember(key, entry)
+
+        return entry
+
+    def fresh(self, entry):
+        """ True if entry can be served without revalidating it """
+        return (time.time() - entry.stored) < self._ttl
+
+    def set(self, url, body, last_modified=None, etag=None):
+        key = self.canonical_url(url)
+        entry = _cache_entry(body, last_modified, etag)
+
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+        return entry
+
+    def touch(self, url, entry):
+        """ Called when the server confirmed entry is still current. Only
+        its stored time changes, the body isn't written again. """
+        key = self.canonical_url(url)
+        entry = _cache_entry(entry.body, entry.last_modified, entry.etag)
+
+        self._remember(key, entry)
+
+        if self._path:
+            try:
+                os.utime(self._filename(key), (entry.stored, entry.stored))
+            except OSError:
+                # Evicted from disk in the meantime
+                self._write_disk(key, entry)
+
+        return entry
+
+    def clear(self):
+        """ Drops every entry. Of the files in 'path' only the cache's own
+        entries and leftover temp files are removed. """
+        with self._lock:
+            self._memory = odict()
+            self._memory_size = 0
+            self._disk_size = None
+
+        if self._path:
+            for name in os.listdir(self._path):
+                if not (self._entry_name.match(name) or self._temp_name.match(name)):
+                    continue
+                try:
+                    os.remove(os.path.join(self._path, name))
+                except OSError:
+                    pass
+
+
+class cache(object):
+    """ Global response cache used by http_downloader, disabled (None)
+    by default. Downloaders given an explicit last_modified don't use it. """
+    __cache = None
+
+    @classmethod
+    def set(cls, value):
+        cls.__cache = value
+
+    @classmethod
+    def get(cls):
+        return cls.__cache
+
+
+class rate_limiter(object):
+    """ Token bucket limiting requests to 'rate' per second with bursts of
+    up to 'burst' requests. overrides maps WebAPI interface names to
+    (rate, burst) tuples, those interfaces get a bucket of their own. """
+
+    def __init__(self, rate=10, burst=None, overrides=None):
+        self._rate = float(rate)
+        self._burst = burst or max(1, int(rate))
+        self._overrides = overrides or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, url):
+        iface = urlsplit(url).path.strip('/').split('/')[0]
+
+        if iface in self._overrides:
+            rate, burst = self._overrides[iface]
+            return iface, float(rate), burst
+        else:
+            return None, self._rate, self._burst
+
+    def _refill(self, key, rate, burst, now):
+        tokens, last = self._buckets.get(key, (burst, now))
+        return min(burst, tokens + (now - last) * rate)
+
+    def reserve(self, url):
+        """ Takes a token for a request to url and returns the amount of
+        seconds to wait before sending it """
+        key, rate, burst = self._bucket(url)
+
+        with self._lock:
+            now = time.time()
+            tokens = self._refill(key, rate, burst, now) - 1
+            self._buckets[key] = (tokens, now)
+
+        return max(0.0, -tokens / rate)
+
+    def throttle(self, url, seconds):
+        """ Drains the bucket used for url so that nothing else goes out
+        through it for the next 'seconds' """
+        key, rate, burst = self._bucket(url)
+
+        with self._lock:
+            now = time.time()
+            tokens = min(self._refill(key, rate, burst, now), -seconds * rate)
+            self._buckets[key] = (tokens, now)
+
+
+class rate_limit(object):
+    """ Global rate limiter shared by every download, blocking or not.
+    None (no limit) by default """
+    __limiter = None
+
+    @classmethod
+    def set(cls, value):
+        cls.__limiter = value
+
+    @classmethod
+    def get(cls):
+        return cls.__limiter
+
+
+class retry_policy(object):
+    """ Retries timeouts and the given HTTP status codes up to 'attempts'
+    times, waiting 'backoff' seconds doubled on each attempt (capped at
+    max_backoff) with random jitter. A Retry-After from the server is
+    always honoured. """
+
+    def __init__(self, attempts=3, backoff=0.5, max_backoff=30,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def delay(self, attempt, error):
+        """ Returns the seconds to wait before retrying after 'error' on
+        the given attempt (starting at 0) or None to give up """
+        if attempt >= self.attempts:
+            return None
+
+        if not isinstance(error, HTTPTimeoutError) and error.code not in self.statuses:
+            return None
+
+        wait = min(self.max_backoff, self.backoff * (2 ** attempt))
+        wait = random.uniform(wait / 2.0, wait)
+
+        return max(wait, error.retry_after or 0)
+
+
+class retry(object):
+    """ Global retry policy used by downloads, None (fail on the first
+    error) by default """
+    __policy = None
+
+    @classmethod
+    def set(cls, value):
+        cls.__policy = value
+
+    @classmethod
+    def get(cls):
+        return cls.__policy
+
+
+def _parse_retry_after(value):
+    """ Retry-After is either an amount of seconds or an HTTP date """
+    if not value:
+        return None
+
+    try:
+        return max(0, int(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date:
+            return max(0, mktime_tz(date) - time.time())
+
+
+class coalescing(object):
+    """ Global switch for sharing one fetch between concurrent downloads
+    of the same URL, on by default """
+    __enabled = True
+
+    @classmethod
+    def set(cls, value):
+        cls.__enabled = bool(value)
+
+    @classmethod
+    def get(cls):
+        return cls.__enabled
+
+
+class interning(object):
+    """ Global switch for interning the keys of streamed JSON, off by
+    default. Keys like "defindex" or "name" repeat in every entry of
+    large results. Whole documents already get one string object per key
+    from the decoder, but 'method_result.stream' decodes each entry on its
+    own, interning keeps one per key for the whole stream. """
+    __enabled = False
+
+    @classmethod
+    def set(cls, value):
+        cls.__enabled = bool(value)
+
+    @classmethod
+    def get(cls):
+        return cls.__enabled
+
+
+def _interning_hook():
+    """ Returns an object_pairs_hook for json.loads that interns keys in
+    a pool shared by every object it's used for """
+    pool = {}.setdefault
+
+    def hook(pairs):
+        return dict([(pool(k, k), v) for k, v in pairs])
+
+    return hook
+
+
+class _flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _single_flight(object):
+    """ Runs one call per key at a time, callers asking for a key that's
+    already in flight wait for it and get its result or exception """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func, joined=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._flights[key] = _flight()
+
+        if not leader:
+            if joined:
+                joined()
+            flight.done.wait()
+
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+        except BaseException as E:
+            flight.error = E
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+        return flight.result
+
+
+_in_flight = _single_flight()
+
+
 class http_downloader(object):
-    def __init__(self, url, last_modified=None, timeout=None):
+    def __init__(self, url, last_modified=None, timeout=None, transport=None,
+                 cache=None):
         self._user_agent = "Mozilla/5.0 (Windows; U; Windows NT 6.1; en-US; Valve Steam Client/1366845241; ) AppleWebKit/535.15 (KHTML, like Gecko) Chrome/18.0.989.0 Safari/535.11"
         self._url = url
         self._timeout = timeout or socket_timeout.get()
         self._last_modified = last_modified
+        self._transport = transport
+        self._cache = cache
+        self._use_cache = last_modified is None
+        self._entry = None
 
     def _build_headers(self):
         head = {}
-
-        if self._last_modified:
+        entry = self._entry
+
+        if entry:
+            if entry.last_modified:
+                head["If-Modified-Since"] = str(entry.last_modified)
+            if entry.etag:
+                head["If-None-Match"] = str(entry.etag)
+        elif self._last_modified:
             head["If-Modified-Since"] = str(self._last_modified)
 
         if self._user_agent:
             head["User-Agent"] = str(self._user_agent)
 
+        if compression.get():
+            head["Accept-Encoding"] = "gzip, deflate"
+
         return head
 
-    def download(self):
+    def _cache_store(self):
+        if self._use_cache:
+            return self._cache or cache.get()
+
+    def _cached_body(self):
+        """ Returns the cached body if it's fresh enough to skip the request,
+        otherwise keeps the stored entry around for revalidation """
+        store = self._cache_store()
+        self._entry = None
+
+        if not store:
+            return None
+
+        self._entry = store.get(self._url)
+        info = {"url": self._url, "endpoint": endpoint(self._url)}
+
+        if self._entry and store.fresh(self._entry):
+            info["result"] = "hit"
+            hooks.fire("cache", info)
+            self._last_modified = self._entry.last_modified
+            return self._entry.body
+
+        info["result"] = "stale" if self._entry else "miss"
+        hooks.fire("cache", info)
+
+    def _handle_response(self, req, body):
+        code = req.code
+        store = self._cache_store()
+
+        if code == 304 and self._entry:
+            hooks.fire("cache", {"url": self._url, "endpoint": endpoint(self._url),
+                                 "result": "revalidated"})
+            entry = store.touch(self._url, self._entry)
+            self._last_modified = entry.last_modified
+            return entry.body
+
+        if code == 404:
+            raise HTTPFileNotFoundError("File not found")
+        elif code == 304:
+            raise HTTPStale(str(self._last_modified))
+        elif not 200 <= code < 300:
+            raise HTTPError("Server connection failed: {0} ({1})".format(req.reason or "Connection error", code),
+                            code, _parse_retry_after(req.headers.get("retry-after")))
+
+        lm = req.headers.get("last-modified")
+        self._last_modified = lm
+
+        if store:
+            store.set(self._url, body, lm, req.headers.get("etag"))
+
+        return body
+
+    def _rate_delay(self):
+        limiter = rate_limit.get()
+
+        if limiter:
+            return limiter.reserve(self._url)
+        else:
+            return 0
+
+    def _retry_delay(self, attempt, error):
+        """ Seconds to wait before retrying after error, None to give up.
+        Being throttled slows down every other request sharing the limiter """
+        policy = retry.get()
+        delay = policy.delay(attempt, error) if policy else None
+        limiter = rate_limit.get()
+
+        if delay and limiter and error.code == 429:
+            limiter.throttle(self._url, delay)
+
+        return delay
+
+    def _request_started(self):
+        info = {"url": self._url, "endpoint": endpoint(self._url), "status": None,
+                "bytes": None, "error": None, "timings": {}, "start": time.time()}
+        hooks.fire("request_start", info)
+
+        return info
+
+    def _request_finished(self, info, req, error=None):
+        info["elapsed"] = time.time() - info["start"]
+        info["error"] = error
+
+        if req:
+            info["status"] = req.code
+            info["timings"] = req.timings
+
+        hooks.fire("request_end", info)
+
+    def _fetch(self, stream=False):
         head = self._build_headers()
-        status_code = -1
-        body = ''
+        conn = self._transport or transport.get()
+        info = self._request_started()
+        req = None
 
         try:
-            req = urlopen(urlrequest(self._url, headers=head),
-                          timeout=self._timeout)
-            status_code = req.code
-            body = req.read()
-        except urlerror.HTTPError as E:
-            code = E.getcode()
-            # More portability hax (no reason property in 2.6?)
             try:
-                reason = E.reason
-            except AttributeError:
-                reason = "Connection error"
+                req = conn.open(self._url, head, self._timeout)
+
+                if stream and 200 <= req.code < 300:
+                    self._last_modified = req.headers.get("last-modified")
+                    self._request_finished(info, req)
+                    return req
+
+                bodystart = time.time()
+                try:
+                    body = req.read()
+                finally:
+                    req.close()
+                req.timings["body"] = time.time() - bodystart
+                info["bytes"] = len(body)
+            except (socket.timeout, urlerror.URLError):
+                raise HTTPTimeoutError("Server took too long to respond")
+            except (socket.error, httplib.HTTPException, zlib.error) as E:
+                raise HTTPError("Server read error: {0}".format(E))
+
+            body = self._handle_response(req, body)
+        except HTTPError as E:
+            self._request_finished(info, req, E)
+            raise
+
+        self._request_finished(info, req)
+
+        if stream:
+            # Revalidated cache entry
+            return http_response(200, "OK", {}, io.BytesIO(body))
+        else:
+            return body
 
-            if code == 404:
-                raise HTTPFileNotFoundError("File not found")
-            elif code == 304:
-                raise HTTPStale(str(self._last_modified))
-            else:
-                raise HTTPError("Server connection failed: {0} ({1})".format(reason, code))
-        except (socket.timeout, urlerror.URLError):
-            raise HTTPTimeoutError("Server took too long to respond")
-        except socket.error as E:
-            raise HTTPError("Server read error: {0}".format(E))
+    def _retrying(self, fetch):
+        attempt = 0
+        while True:
+            wait = self._rate_delay()
+            if wait:
+                time.sleep(wait)
 
-        lm = req.headers.get("last-modified")
-        self._last_modified = lm
+            try:
+                return fetch()
+            except HTTPError as E:
+                delay = self._retry_delay(attempt, E)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def _flight_key(self):
+        """ Downloads sharing this key (same URL, API key included, and
+        headers) can share a fetch """
+        return self._url, tuple(sorted(self._build_headers().items()))
+
+    def _coalesced(self):
+        hooks.fire("coalesced", {"url": self._url, "endpoint": endpoint(self._url)})
+
+    def _fetch_shared(self):
+        body = self._retrying(self._fetch)
+        return body, self._last_modified
+
+    def download(self):
+        cached = self._cached_body()
+        if cached is not None:
+            return cached
+
+        if not coalescing.get():
+            return self._retrying(self._fetch)
 
+        body, self._last_modified = _in_flight.do(self._flight_key(), self._fetch_shared,
+                                                  self._coalesced)
         return body
 
+    def open(self):
+        """ Same as 'download' but returns the response as soon as the
+        headers are in, so that the body can be read incrementally.
+        Bodies read this way aren't stored in the cache. """
+        cached = self._cached_body()
+        if cached is not None:
+            return http_response(200, "OK", {}, io.BytesIO(cached))
+
+        return self._retrying(lambda: self._fetch(stream=True))
+
+    def download_async(self):
+        """ Returns an awaitable resolving to the body, see 'download' """
+        return _aio().download(self)
+
     @property
     def last_modified(self):
         return self._last_modified
@@ -180,6 +1432,158 @@ class http_downloader(object):
         return self._url
 
 
+class _json_stream(object):
+    """ Pulls JSON text off a file object in chunks. Only the structure
+    leading to the wanted array is scanned, its entries are then sliced
+    out of the buffer one at a time and handed to json.loads """
+
+    _whitespace = re.compile(r"\s*")
+    _string = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+    _special = re.compile(r'["{}\[\]]')
+    _scalar_end = re.compile(r"[,}\]\s]")
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._buf = u''
+        self._pos = 0
+        self._mark = None
+        self._eof = False
+
+    def _fill(self):
+        """ Appends another chunk to the buffer, dropping what was already
+        consumed. Raises ValueError at the end of the stream """
+        if self._eof:
+            raise ValueError("Unexpected end of JSON data")
+
+        data = self._stream.read(self._chunk_size)
+        if not data:
+            self._eof = True
+
+        keep = self._pos if self._mark is None else min(self._pos, self._mark)
+        self._buf = self._buf[keep:] + self._decoder.decode(data, not data)
+        self._pos -= keep
+        if self._mark is not None:
+            self._mark -= keep
+
+    def _peek(self):
+        """ Returns the next non-whitespace char or '' at the end """
+        while True:
+            self._pos = self._whitespace.match(self._buf, self._pos).end()
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            elif self._eof:
+                return ''
+
+            self._fill()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Expected {0!r} at JSON offset {1}".format(char, self._pos))
+        self._pos += 1
+
+    def _skip_string(self):
+        while True:
+            match = self._string.match(self._buf, self._pos)
+            if match:
+                self._pos = match.end()
+                return match.group()
+            self._fill()
+
+    def _skip_value(self):
+        char = self._peek()
+
+        if char == '"':
+            self._skip_string()
+        elif char == '{' or char == '[':
+            depth = 0
+            while True:
+                match = self._special.search(self._buf, self._pos)
+                if not match:
+                    self._pos = len(self._buf)
+                    self._fill()
+                    continue
+
+                char = match.group()
+                self._pos = match.start()
+
+                if char == '"':
+                    self._skip_string()
+                    continue
+
+                self._pos += 1
+                depth += 1 if char == '{' or char == '[' else -1
+                if depth == 0:
+                    return
+        elif char:
+            while True:
+                match = self._scalar_end.search(self._buf, self._pos)
+                if match:
+                    self._pos = match.start()
+                    return
+                elif self._eof:
+                    self._pos = len(self._buf)
+                    return
+                self._pos = len(self._buf)
+                self._fill()
+        else:
+            raise ValueError("Unexpected end of JSON data")
+
+    def _find(self, path, siblings=None):
+        for name in path:
+            self._expect('{')
+
+            while True:
+                if self._peek() != '"':
+                    raise KeyError(name)
+
+                key = json.loads(self._skip_string())
+                self._expect(':')
+
+                if key == name:
+                    break
+
+                if siblings is not None and self._peek() not in "{[":
+                    self._mark = self._pos
+                    self._skip_value()
+                    siblings[key] = json.loads(self._buf[self._mark:self._pos])
+                    self._mark = None
+                else:
+                    self._skip_value()
+
+                if self._peek() == ',':
+                    self._pos += 1
+
+    def iter_array(self, path, object_pairs_hook=None, siblings=None):
+        """ Yields the decoded entries of the array found by following
+        the object keys in 'path'. Scalars passed over on the way there,
+        such as a status next to the array, are put in the 'siblings'
+        dict if given, by their key. """
+        self._find(path, siblings)
+        self._expect('[')
+
+        if self._peek() == ']':
+            return
+
+        while True:
+            self._peek()
+            self._mark = self._pos
+            self._skip_value()
+            entry = self._buf[self._mark:self._pos]
+            self._mark = None
+
+            yield json.loads(entry, object_pairs_hook=object_pairs_hook)
+
+            char = self._peek()
+            self._pos += 1
+            if char == ']':
+                return
+            elif char != ',':
+                raise ValueError("Expected ',' at JSON offset {0}".format(self._pos - 1))
+
+
 class method_result(dict):
     """ Holds a deserialized JSON object obtained from fetching the given URL.
     If aggressive is True then the data will be fetched when the method is called
@@ -229,9 +1633,9 @@ class method_result(dict):
     def __str__(self):
         return self.__handle_accessor("__str__")
 
-    def call(self):
-        """ Make the API call again and fetch fresh data. """
-        data = self._downloader.download()
+    def _apply(self, data):
+        start = time.time()
+        size = len(data)
 
         # Only try to pass errors arg if supported
         if sys.version >= "2.7":
@@ -242,8 +1646,47 @@ class method_result(dict):
         self.update(json.loads(data))
         self._fetched = True
 
+        url = self._downloader.url
+        hooks.fire("decode", {"url": url, "endpoint": endpoint(url),
+                              "bytes": size, "elapsed": time.time() - start})
+
+    def call(self):
+        """ Make the API call again and fetch fresh data. """
+        self._apply(self._downloader.download())
+
+    def stream(self, *path, **kwargs):
+        """ Fetches the data again, yielding the entries of the JSON array
+        at 'path' (e.g. "result", "items") as they're decoded off the
+        connection instead of loading the whole document first. The
+        result itself isn't populated. KeyError is raised if the path
+        doesn't exist. 'siblings' works like it does for
+        '_json_stream.iter_array'. """
+        req = self._downloader.open()
+        hook = _interning_hook() if interning.get() else None
+
+        try:
+            for entry in _json_stream(req).iter_array(path, hook, kwargs.get("siblings")):
+                yield entry
+        except socket.timeout:
+            raise HTTPTimeoutError("Server took too long to respond")
+        except (socket.error, httplib.HTTPException, zlib.error) as E:
+            raise HTTPError("Server read error: {0}".format(E))
+        finally:
+            req.close()
+
+    def call_async(self, value=None):
+        """ Returns an awaitable that fetches fresh data without blocking
+        the event loop. It resolves to 'value' or the result itself if not
+        given. Requires python 3.7 or newer """
+        return _aio().call(self, value)
+
     def get(self, *args, **kwargs):
         return self.__handle_accessor("get", *args, **kwargs)
 
     def keys(self):
         return self.__handle_accessor("keys")
+
+    @property
+    def last_modified(self):
+        """ The Last-Modified header of the fetched data, if there was one """
+        return self._downloader.last_modified
@@ -4,10 +4,26 @@ Copyright (c) 2010-2013, Anthony Garcia <anthony@lagg.me>
 Distributed under the ISC License (see LICENSE)
 """
 
+import marshal
+import mmap
+import os
+import struct
+import sys
 import time
 import operator
+from bisect import bisect_left
 from . import api, loc
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+try:
+    from sys import intern
+except ImportError:
+    pass
+
 
 class SchemaError(api.APIError):
     pass
@@ -29,11 +45,131 @@ class ProfilePrivateError(InventoryError):
     pass
 
 
+# Schema snapshots: magic, format version, the python and marshal versions
+# that wrote it and the size of the marshalled header, then the body. The
+# header holds the app, language, Last-Modified and the small maps. The
+# large maps are tables in the body: their sorted keys, the offsets of
+# their values and the values marshalled one by one.
+_SNAPSHOT = struct.Struct("<4sBBBBI")
+_SNAPSHOT_MAGIC = b"SOSC"
+_SNAPSHOT_VERSION = 2
+_SNAPSHOT_BUILD = (_SNAPSHOT_VERSION,) + tuple(sys.version_info[:2]) + (marshal.version,)
+_SNAPSHOT_TABLES = ("items", "attributes", "qualities")
+
+
+def _unmarshal(mapped, start, end=None):
+    """ Unmarshals mapped[start:end] without copying it out of the map first """
+    try:
+        view = memoryview(mapped)
+    except TypeError:
+        # No new style buffers on python 2
+        return marshal.loads(mapped[start:end])
+
+    try:
+        return marshal.loads(view[start:end])
+    finally:
+        view.release()
+
+
+def _interned(value):
+    """ Returns 'value' with the keys of its dicts interned. marshal keeps
+    that, so entries decoded one by one still share their keys. """
+    if isinstance(value, dict):
+        return dict([(_intern(k), _interned(v)) for k, v in value.items()])
+    elif isinstance(value, list):
+        return [_interned(v) for v in value]
+    else:
+        return value
+
+
+def _intern(key):
+    try:
+        return intern(key)
+    except TypeError:
+        # Only byte strings can be interned on python 2
+        return key
+
+
+def _pack_table(table, pos):
+    """ Returns the map 'table' packed for '_snapshot_table', 'pos' being
+    where it goes in the body """
+    keys = sorted(table)
+    values = [marshal.dumps(_interned(table[k])) for k in keys]
+    offset = pos + 8 * (2 * len(keys) + 1)
+    offsets = [offset]
+
+    for value in values:
+        offset += len(value)
+        offsets.append(offset)
+
+    return b''.join([struct.pack("<{0}q".format(len(keys)), *keys),
+                     struct.pack("<{0}Q".format(len(offsets)), *offsets)] + values)
+
+
+def _file_key(st):
+    """ What tells a file replaced by 'schema.save' apart """
+    return st.st_ino, st.st_size, st.st_mtime
+
+
+class _snapshot_table(Mapping):
+    """ Read-only map of a table in a mapped snapshot. Values are decoded
+    from the map when they're looked up and kept if 'keep' is true. """
+
+    def __init__(self, mapped, base, pos, count, keep=True):
+        keys = struct.Struct("<{0}q".format(count))
+        self._map = mapped
+        self._base = base
+        self._keys = keys.unpack_from(mapped, base + pos)
+        self._offsets = struct.unpack_from("<{0}Q".format(count + 1), mapped,
+                                           base + pos + keys.size)
+        self._values = {}
+        self._keep = keep
+
+    def _index(self, key):
+        try:
+            i = bisect_left(self._keys, key)
+        except TypeError:
+            return None
+
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except (KeyError, TypeError):
+            pass
+
+        i = self._index(key)
+        if i is None:
+            raise KeyError(key)
+
+        value = _unmarshal(self._map, self._base + self._offsets[i],
+                           self._base + self._offsets[i + 1])
+        if self._keep:
+            self._values[key] = value
+
+        return value
+
+    def __contains__(self, key):
+        return self._index(key) is not None
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
 class schema(object):
     """ The base class for the item schema. """
 
     @property
     def _schema(self):
+        attached = self._attached
+        if attached and time.time() - attached[3] >= attached[1]:
+            self._follow()
+
         if self._cache:
             return self._cache
 
@@ -90,6 +226,8 @@ class schema(object):
             # minimal compared to lookup benefits in backpacks)
             items = self._api["result"]["items"]
             self._cache["items"] = dict([(i["defindex"], i) for i in items])
+
+            self._last_modified = self._api.last_modified
         except KeyError:
             # Due to the various fields needed we can't check for certain
             # fields and fall back ala 'inventory'
@@ -112,22 +250,130 @@ class schema(object):
         is localized to """
         return self._language
 
+    @property
+    def last_modified(self):
+        """ The Last-Modified date of the schema, None if it's not
+        known or the schema wasn't fetched or loaded yet. Can be passed
+        as 'since' to only fetch the schema if it changed. """
+        return self._last_modified
+
+    def save(self, path):
+        """ Writes the schema maps to 'path' as a snapshot 'load' can read
+        without network access or JSON parsing, fetching the schema first
+        if needed. The file is replaced atomically. """
+        maps = dict(self._schema)
+        tables = {}
+        body = []
+        pos = 0
+
+        for name in _SNAPSHOT_TABLES:
+            table = maps[name]
+            # Anything the table format can't key stays an ordinary map
+            if all([isinstance(k, int) and not isinstance(k, bool) for k in table]):
+                del maps[name]
+                tables[name] = (pos, len(table))
+                body.append(_pack_table(table, pos))
+                pos += len(body[-1])
+
+        header = marshal.dumps({"app": self._app, "language": self._language,
+                                "last_modified": self._last_modified,
+                                "maps": maps, "tables": tables})
+
+        fields = (_SNAPSHOT_MAGIC,) + _SNAPSHOT_BUILD + (len(header),)
+
+        def write(f):
+            f.write(_SNAPSHOT.pack(*fields))
+            f.write(header)
+            f.write(b''.join(body))
+
+        api._atomic_write(path, write)
+
+    def _read_snapshot(self, path, keep):
+        """ Returns the maps in the snapshot at 'path', its Last-Modified and
+        the stat result of the file read. 'keep' is passed on to the tables. """
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SchemaError("Empty schema snapshot")
+
+        try:
+            fields = _SNAPSHOT.unpack_from(mapped)
+            magic, build, size = fields[0], fields[1:-1], fields[-1]
+            if magic != _SNAPSHOT_MAGIC:
+                raise SchemaError("Not a schema snapshot")
+            if build != _SNAPSHOT_BUILD:
+                # marshal's format is only stable within a python version
+                raise SchemaError("Schema snapshot of version {0} written by python {1}.{2} "
+                                  "with marshal version {3}, it has to be written again "
+                                  "with 'save'".format(*build))
+
+            base = _SNAPSHOT.size + size
+            header = _unmarshal(mapped, _SNAPSHOT.size, base)
+            if header["app"] != self._app or header["language"] != self._language:
+                raise SchemaError("Snapshot is of app {0} in {1}".format(header["app"],
+                                                                        header["language"]))
+
+            cache = header["maps"]
+            for name, (pos, count) in header["tables"].items():
+                cache[name] = _snapshot_table(mapped, base, pos, count, keep)
+        except (struct.error, EOFError, ValueError, TypeError, KeyError):
+            mapped.close()
+            raise SchemaError("Corrupt schema snapshot")
+        except:
+            mapped.close()
+            raise
+
+        return cache, header["last_modified"], st
+
+    def load(self, path):
+        """ Replaces the schema maps with the snapshot at 'path' written by
+        'save'. The file is memory mapped and items, attributes and
+        qualities are only decoded from it when they're looked up, so
+        loading is quick and processes loading the same snapshot share its
+        pages. Raises SchemaError if the snapshot is of another app or
+        language, was written by another version of python or can't be
+        read. Loading never goes out to the network, snapshots of another
+        version have to be written again with 'save' by the caller. """
+        self._cache, self._last_modified, st = self._read_snapshot(path, True)
+        self._attached = None
+
+    def attach(self, path, interval=5):
+        """ Like 'load', for worker processes sharing a snapshot a parent
+        process keeps up to date with 'save'. Entries looked up aren't
+        kept, so besides the small maps the schema only takes the shared
+        pages of the file. Every 'interval' seconds at most the file is
+        checked and the snapshot reloaded if 'save' replaced it. Until a
+        replacement can be read the current one stays in use. """
+        self._cache, self._last_modified, st = self._read_snapshot(path, False)
+        self._attached = (path, interval, _file_key(st), time.time())
+
+    def _follow(self):
+        """ Reloads the attached snapshot if the file was replaced """
+        path, interval, key, checked = self._attached
+
+        try:
+            st = os.stat(path)
+            if _file_key(st) != key:
+                self._cache, self._last_modified, st = self._read_snapshot(path, False)
+                key = _file_key(st)
+        except (EnvironmentError, SchemaError):
+            pass
+
+        self._attached = (path, interval, key, time.time())
+
     def _attribute_definition(self, attrid):
         """ Returns the attribute definition dict of a given attribute
-        ID, can be the name or the integer ID """
+        ID, can be the name or the integer ID. The dict is the schema's
+        own, it's not to be modified. """
         attrs = self._schema["attributes"]
 
         try:
-            # Make a new dict to avoid side effects
-            return dict(attrs[attrid])
+            return attrs[attrid]
         except KeyError:
             attr_names = self._schema["attribute_names"]
-            attrdef = attrs.get(attr_names.get(str(attrid).lower()))
-
-            if not attrdef:
-                return None
-            else:
-                return dict(attrdef)
+            return attrs.get(attr_names.get(str(attrid).lower())) or None
 
     def _quality_definition(self, qid):
         """ Returns the ID and localized name of the given quality, can be either ID type """
@@ -186,6 +432,21 @@ class schema(object):
 
         return self.origins.get(oid)
 
+    def load_async(self):
+        """ Returns an awaitable that fetches the schema without
+        blocking, resolving to the schema itself """
+        return self._api.call_async(self)
+
+    def stream(self):
+        """ Yields the raw item definitions of a fresh schema download
+        as they come in without holding the whole schema in memory.
+        The schema maps aren't built by this. """
+        try:
+            for schema_item in self._api.stream("result", "items"):
+                yield schema_item
+        except KeyError:
+            raise SchemaError("Empty or corrupt schema returned")
+
     def _find_item_by_id(self, id):
         return self._schema["items"].get(id)
 
@@ -226,6 +487,8 @@ class schema(object):
         self._language = loc.language(lang).code
         self._app = int(app)
         self._cache = {}
+        self._last_modified = None
+        self._attached = None
 
         # WORKAROUND: CS GO v1 returns 404
         if self._app == 730 and version == 1:
@@ -234,22 +497,100 @@ class schema(object):
         self._api = api.interface("IEconItems_" + str(self._app)).GetSchema(language=self._language, version=version, **kwargs)
 
 
-class item(object):
-    """ Stores a single inventory item """
+class _attribute_overlay(Mapping):
+    """ Read-only view of an item's values for an attribute laid over
+    the attribute definition, which is the schema's and isn't copied """
+
+    __slots__ = ("_own", "_definition")
+
+    def __init__(self, own, definition):
+        self._own = own
+        self._definition = definition
+
+    def __getitem__(self, key):
+        own = self._own
+        if key in own:
+            return own[key]
+
+        return self._definition[key]
+
+    def get(self, key, default=None):
+        own = self._own
+        if key in own:
+            return own[key]
+
+        return self._definition.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._own or key in self._definition
+
+    def __iter__(self):
+        for key in self._own:
+            yield key
+
+        for key in self._definition:
+            if key not in self._own:
+                yield key
+
+    def __len__(self):
+        return len(set(self._own).union(self._definition))
+
+
+class _item_base(object):
+    """ What 'item' and 'compact_item' have in common, how the item's
+    fields are kept is up to them """
+
+    __slots__ = ()
 
     @property
     def attributes(self):
         """ Returns a list of attributes """
 
-        overridden_attrs = self._attributes
-        sortmap = {"neutral": 1, "positive": 2,
-                   "negative": 3}
+        if self._sorted_attributes is None:
+            overridden_attrs = self._attributes
+            sortmap = {"neutral": 1, "positive": 2,
+                       "negative": 3}
+
+            sortedattrs = list(overridden_attrs.values())
+            sortedattrs.sort(key=operator.itemgetter("defindex"))
+            sortedattrs.sort(key=lambda t: sortmap.get(t.get("effect_type",
+                                                             "neutral"), 99))
+            self._sorted_attributes = [item_attribute(theattr) for theattr in sortedattrs]
+
+        return list(self._sorted_attributes)
 
-        sortedattrs = list(overridden_attrs.values())
-        sortedattrs.sort(key=operator.itemgetter("defindex"))
-        sortedattrs.sort(key=lambda t: sortmap.get(t.get("effect_type",
-                                                         "neutral"), 99))
-        return [item_attribute(theattr) for theattr in sortedattrs]
+    @property
+    def _attribute_index(self):
+        """ A dict of attributes by ID and name, built from 'attributes'
+        on first use """
+        if self._attribute_cache is None:
+            index = {}
+
+            # Earlier attributes win when an ID or name repeats
+            for attr in reversed(self.attributes):
+                index[attr.name] = attr
+                index[attr.id] = attr
+
+            self._attribute_cache = index
+
+        return self._attribute_cache
+
+    @property
+    def _attributes(self):
+        """ Attribute values by index, resolved against the schema on
+        first use """
+        if self._attribute_values is None:
+            self._attribute_values = self._resolve_attributes()
+
+        return self._attribute_values
+
+    @property
+    def _own_attributes(self):
+        """ The item's attribute values, not counting its schema item's """
+        if self._item != self._schema_item:
+            return self._item.get("attributes", [])
+
+        return []
 
     @property
     def quality(self):
@@ -518,16 +859,16 @@ class item(object):
         as a dict that includes required score, name, and level.
         """
 
-        if self._rank != {}:
+        if self._rank is not None:
             # Don't bother doing attribute lookups again
-            return self._rank
+            return self._rank or None
 
         try:
             # The eater determining the rank
             levelkey, typename, count = self.kill_eaters[0]
         except IndexError:
-            # Apparently no eater available
-            self._rank = None
+            # Apparently no eater available, False remembers that
+            self._rank = False
             return None
 
         rankset = self._ranks.get(levelkey,
@@ -586,17 +927,15 @@ class item(object):
     next = __next__
 
     def __getitem__(self, key):
-        for attr in self:
-            if attr.id == key or attr.name == key:
-                return attr
-
-        raise KeyError(key)
+        try:
+            return self._attribute_index[key]
+        except TypeError:
+            raise KeyError(key)
 
     def __contains__(self, key):
         try:
-            self.__getitem__(key)
-            return True
-        except KeyError:
+            return key in self._attribute_index
+        except TypeError:
             return False
 
     def __str__(self):
@@ -608,72 +947,267 @@ class item(object):
         else:
             return fullname
 
+    @staticmethod
+    def _lookup(item, schema):
+        """ Returns the schema, None if there's none, and the schema item
+        of 'item' or None if the schema doesn't have it """
+        # Truth testing a schema means len() of its items, only do it once
+        if not schema:
+            return None, None
+
+        return schema, schema._find_item_by_id(item["defindex"]) or None
+
+    @staticmethod
+    def _quality_of(schema, qualityid):
+        if schema is not None:
+            return schema._quality_definition(qualityid)
+
+        return (qualityid, "normal", "Normal")
+
+    @staticmethod
+    def _origin_of(schema, originid):
+        if schema is not None:
+            return schema.origin_id_to_name(originid)
+        elif originid:
+            return str(originid)
+
+    def _resolve_attributes(self):
+        """ Lays the item's attribute values over the schema's, returns
+        a dict of them by attribute index """
+        schema = self._schema
+        attributes = {}
+
+        # Attribute definitions by index, followed by the values over them
+        layers = {}
+
+        for attr in self._schema_item.get("attributes", []):
+            index = attr.get("defindex", attr.get("name"))
+            attrdef = None
+
+            if schema is not None:
+                attrdef = schema._attribute_definition(index)
+                if attrdef:
+                    index = attrdef["defindex"]
+
+            if index not in layers:
+                layers[index] = [attrdef or None, attr]
+            else:
+                if attrdef:
+                    layers[index].append(attrdef)
+                layers[index].append(attr)
+
+        for attr in self._own_attributes:
+            index = attr.get("defindex", attr.get("name"))
+
+            if index not in layers:
+                attrdef = None
+                if schema is not None:
+                    attrdef = schema._attribute_definition(index)
+                layers[index] = [attrdef or None, attr]
+            else:
+                layers[index].append(attr)
+
+        for index, layer in layers.items():
+            attrdef, own = layer[0], layer[1]
+
+            if len(layer) > 2:
+                # The item's values are its own, merging them copies nothing shared
+                own = dict(own)
+                for values in layer[2:]:
+                    own.update(values)
+
+            if attrdef is None:
+                attributes[index] = own
+            else:
+                attributes[index] = _attribute_overlay(own, attrdef)
+
+        return attributes
+
+
+class item(_item_base):
+    """ Stores a single inventory item """
+
     def __init__(self, item, schema=None):
+        schema, schema_item = self._lookup(item, schema)
+
         self._item = item
-        self._schema_item = None
+        self._schema_item = schema_item or item
         self._schema = schema
-        self._rank = {}
+        self._rank = None
         self._ranks = {}
         self._kill_types = {}
-        self._origin = None
-        self._attributes = {}
-
-        if schema:
-            self._schema_item = schema._find_item_by_id(self._item["defindex"])
-
-        if not self._schema_item:
-            self._schema_item = self._item
+        self._attribute_values = None
+        self._sorted_attributes = None
+        self._attribute_cache = None
 
         qualityid = self._item.get("quality",
                                    self._schema_item.get("item_quality", 0))
-        if schema:
-            self._quality = schema._quality_definition(qualityid)
-        else:
-            self._quality = (qualityid, "normal", "Normal")
+        self._quality = self._quality_of(schema, qualityid)
+        self._origin = self._origin_of(schema, self._item.get("origin"))
 
-        if schema:
+        if schema is not None:
             self._language = schema.language
         else:
             self._language = "en_US"
 
-        originid = self._item.get("origin")
-        if schema:
-            self._origin = schema.origin_id_to_name(originid)
-        elif originid:
-            self._origin = str(originid)
-
-        if schema:
+        if schema is not None:
             self._ranks = schema.kill_ranks
             self._kill_types = schema.kill_types
 
-        for attr in self._schema_item.get("attributes", []):
-            index = attr.get("defindex", attr.get("name"))
-            attrdef = None
 
-            if schema:
-                attrdef = schema._attribute_definition(index)
-                if attrdef:
-                    index = attrdef["defindex"]
+class _no_fields(Mapping):
+    """ Empty mapping that can't be changed either, shared by the compact
+    items that have nothing to keep in a dict """
 
-            self._attributes.setdefault(index, {})
+    __slots__ = ()
 
-            if attrdef:
-                self._attributes[index].update(attrdef)
+    def __getitem__(self, key):
+        raise KeyError(key)
 
-            self._attributes[index].update(attr)
+    def get(self, key, default=None):
+        return default
 
-        if self._item != self._schema_item:
-            for attr in self._item.get("attributes", []):
-                index = attr["defindex"]
+    def __contains__(self, key):
+        return False
 
-                if schema and index not in self._attributes:
-                    attrdef = schema._attribute_definition(index)
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+
+class compact_item(_item_base):
+    """ An item with the same properties as 'item' that keeps its common
+    fields in slots instead of holding on to the item's dict, for when a
+    lot of items are kept around. Rarely set fields such as custom names
+    go in a dict of their own. """
+
+    __slots__ = ("_id", "_original_id", "_defindex", "_level", "_quality_id",
+                 "_origin_id", "_quantity", "_inventory", "_attribute_data",
+                 "_extra", "_schema", "_schema_item", "_rank",
+                 "_attribute_values", "_sorted_attributes", "_attribute_cache")
+
+    _FIELDS = frozenset(["id", "original_id", "defindex", "level", "quality",
+                         "origin", "quantity", "inventory", "attributes"])
+
+    # Attribute values are mostly just these, such are kept as a tuple of them
+    _ATTRIBUTE_FIELDS = ("defindex", "value", "float_value")
+
+    # Stands in for the item's dict and schema item when there's nothing in them
+    _NO_FIELDS = _no_fields()
+
+    @property
+    def _item(self):
+        if self._extra is None:
+            return self._NO_FIELDS
+
+        return self._extra
+
+    @property
+    def _own_attributes(self):
+        fields = self._ATTRIBUTE_FIELDS
+
+        return [dict(zip(fields, attr)) if isinstance(attr, tuple) else attr
+                for attr in self._attribute_data]
+
+    @property
+    def _quality(self):
+        return self._quality_of(self._schema, self._quality_id)
+
+    @property
+    def _language(self):
+        if self._schema is not None:
+            return self._schema.language
+
+        return "en_US"
+
+    @property
+    def _origin(self):
+        return self._origin_of(self._schema, self._origin_id)
+
+    @property
+    def _ranks(self):
+        if self._schema is not None:
+            return self._schema.kill_ranks
+
+        return {}
+
+    @property
+    def _kill_types(self):
+        if self._schema is not None:
+            return self._schema.kill_types
+
+        return {}
 
-                    if attrdef:
-                        self._attributes[index] = attrdef
+    @property
+    def inventory_token(self):
+        return self._inventory
+
+    @property
+    def schema_id(self):
+        return self._defindex
+
+    @property
+    def id(self):
+        return self._id
 
-                self._attributes.setdefault(index, {})
-                self._attributes[index].update(attr)
+    @property
+    def original_id(self):
+        return self._original_id
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def quantity(self):
+        return self._quantity
+
+    def _pack_attribute(self, attr):
+        if len(attr) == len(self._ATTRIBUTE_FIELDS):
+            try:
+                return tuple([attr[field] for field in self._ATTRIBUTE_FIELDS])
+            except KeyError:
+                pass
+
+        return attr
+
+    def __init__(self, item, schema=None):
+        schema, schema_item = self._lookup(item, schema)
+
+        self._schema = schema
+        self._rank = None
+        self._attribute_values = None
+        self._sorted_attributes = None
+        self._attribute_cache = None
+
+        if schema_item is not None and item == schema_item:
+            # The schema's own dict, it's shared already
+            self._schema_item = schema_item
+            self._extra = schema_item
+            self._attribute_data = ()
+        else:
+            fields = self._FIELDS
+            self._extra = dict((key, value) for key, value in item.items()
+                               if key not in fields) or None
+            self._attribute_data = tuple(self._pack_attribute(attr)
+                                         for attr in item.get("attributes", ()))
+
+            if schema_item is not None:
+                self._schema_item = schema_item
+            else:
+                # The item is its own schema item, what's left of it serves as one
+                self._schema_item = self._item
+
+        self._id = item.get("id")
+        self._original_id = item.get("original_id")
+        self._defindex = item.get("defindex")
+        self._level = item.get("level")
+        self._quality_id = item.get("quality", self._schema_item.get("item_quality", 0))
+        self._origin_id = item.get("origin")
+        self._quantity = item.get("quantity", 1)
+        self._inventory = item.get("inventory", 0)
 
 
 class item_attribute(object):
@@ -836,6 +1370,16 @@ class item_attribute(object):
 class inventory(object):
     """ Functions for reading player inventory """
 
+    @staticmethod
+    def _missing_items(status):
+        """ Returns the error for a result without items by its status """
+        if status == 8:
+            return BadID64Error("Bad Steam ID64 given")
+        elif status == 15:
+            return ProfilePrivateError("Profile is private")
+
+        return InventoryError("Backpack data incomplete or corrupt")
+
     @property
     def _inv(self):
         if self._cache:
@@ -849,16 +1393,18 @@ class inventory(object):
         except KeyError:
             # Only try to check status code if items don't exist (why error out
             # when items are there)
-            if status is not None:
-                if status == 8:
-                    raise BadID64Error("Bad Steam ID64 given")
-                elif status == 15:
-                    raise ProfilePrivateError("Profile is private")
-            raise InventoryError("Backpack data incomplete or corrupt")
+            raise self._missing_items(status)
+
+        cells = self._api["result"].get("num_backpack_slots", len(items))
+
+        if self._item_class is compact_item:
+            # Kept built, the raw item dicts and the rest of the response can go
+            items = [compact_item(data, self._schema) for data in items]
+            self._api.clear()
 
         self._cache = {
                 "items": items,
-                "cells": self._api["result"].get("num_backpack_slots", len(items))
+                "cells": cells
                 }
 
         return self._cache
@@ -872,6 +1418,24 @@ class inventory(object):
         can be obtained by calling len on an inventory object """
         return self._inv["cells"]
 
+    def stream(self):
+        """ Yields 'item' objects as they are decoded off a fresh download
+        of the inventory instead of loading all of it first. Useful for
+        huge backpacks, note that the inventory itself isn't populated. """
+        siblings = {}
+
+        try:
+            for data in self._api.stream("result", "items", siblings=siblings):
+                yield self._item_class(data, self._schema)
+        except KeyError:
+            raise self._missing_items(siblings.get("status"))
+
+    def load_async(self):
+        """ Returns an awaitable that fetches the inventory without
+        blocking, resolving to the inventory itself. Note that the
+        schema (if any) should be loaded too """
+        return self._api.call_async(self)
+
     def __getitem__(self, key):
         key = str(key)
         for item in self:
@@ -888,23 +1452,29 @@ class inventory(object):
     def __next__(self):
         iterindex = 0
         iterdata = self._inv["items"]
+        built = self._item_class is compact_item
 
         while(iterindex < len(iterdata)):
-            data = item(iterdata[iterindex], self._schema)
+            data = iterdata[iterindex]
+            if not built:
+                data = self._item_class(data, self._schema)
             iterindex += 1
             yield data
     next = __next__
 
-    def __init__(self, app, profile, schema=None, **kwargs):
+    def __init__(self, app, profile, schema=None, compact=False, **kwargs):
         """
         'app': Steam app to get the inventory for.
         'profile': A user ID or profile object.
         'schema': The schema to use for item lookup.
+        'compact': Yield 'compact_item' objects, for keeping a lot of them.
+        They're built once and kept instead of the downloaded items.
         """
 
         self._app = app
         self._schema = schema
         self._cache = {}
+        self._item_class = compact_item if compact else item
 
         try:
             sid = profile.id64
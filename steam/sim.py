@@ -8,6 +8,7 @@ from xml.sax import saxutils
 import re
 import json
 import operator
+import threading
 from . import api
 from . import items
 
@@ -112,6 +113,66 @@ class inventory(object):
     def __len__(self):
         return len(self._inv.get("items", []))
 
+    @property
+    def section_errors(self):
+        """ Returns a dict of section IDs and the error raised while fetching
+        them. Only concurrent fetches (workers > 1) skip failed sections,
+        otherwise the first failure is raised """
+        return self._inv.get("errors", {})
+
+    def _fetch_section(self, url, sec):
+        req = api.http_downloader(url + sec, timeout=self._timeout)
+        inventorysection = json.loads(req.download().decode("utf-8"))
+
+        if not inventorysection:
+            raise items.InventoryError("Empty context data returned")
+
+        try:
+            itemdescs = inventorysection["rgDescriptions"]
+        except KeyError:
+            raise items.InventoryError("Steam returned inventory with missing context")
+
+        inv = inventorysection.get("rgInventory")
+        if not inv:
+            return []
+
+        sectionitems = []
+        for id, item in inv.items():
+            # Store the section ID for later use
+            item["sec"] = sec
+            item.update(itemdescs.get(item["classid"] + "_" + item["instanceid"], {}))
+            sectionitems.append(item)
+
+        return sectionitems
+
+    def _fetch_sections(self, url, downloadlist):
+        """ Fetches sections on up to 'workers' threads, returns a dict
+        of section IDs and their items or the exception raised """
+        pending = list(reversed(downloadlist))
+        results = {}
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    sec = pending.pop()
+
+                try:
+                    results[sec] = self._fetch_section(url, sec)
+                except Exception as E:
+                    results[sec] = E
+
+        threads = [threading.Thread(target=work)
+                   for i in range(min(self._workers, len(downloadlist)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
     @property
     def _inv(self):
         if self._cache:
@@ -122,52 +183,52 @@ class inventory(object):
         url = invstr.format(self._user, self._ctx["appid"])
         contexts = self._ctx["rgContexts"]
         cellcount = 0
-        items = []
+        itemlist = []
+        errors = {}
 
         if self._section is not None:
             sec = str(self._section)
-            downloadlist = sec
+            downloadlist = [sec]
             cellcount = contexts[sec]["asset_count"]
         else:
             for sec, ctx in contexts.items():
                 cellcount += ctx["asset_count"]
                 downloadlist.append(str(sec))
 
-        for sec in downloadlist:
-            req = api.http_downloader(url + sec, timeout=self._timeout)
-            inventorysection = json.loads(req.download().decode("utf-8"))
-
-            if not inventorysection:
-                raise items.InventoryError("Empty context data returned")
-
-            try:
-                itemdescs = inventorysection["rgDescriptions"]
-            except KeyError:
-                raise items.InventoryError("Steam returned inventory with missing context")
-
-            inv = inventorysection.get("rgInventory")
-            if not inv:
-                continue
-
-            for id, item in inv.items():
-                # Store the section ID for later use
-                item["sec"] = sec
-                item.update(itemdescs.get(item["classid"] + "_" + item["instanceid"], {}))
-                items.append(item)
+        if self._workers > 1 and len(downloadlist) > 1:
+            results = self._fetch_sections(url, downloadlist)
+
+            # Merge in section order regardless of completion order
+            for sec in downloadlist:
+                result = results[sec]
+                if isinstance(result, (api.APIError, ValueError)):
+                    errors[sec] = result
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    itemlist.extend(result)
+
+            if len(errors) == len(downloadlist):
+                raise errors[downloadlist[0]]
+        else:
+            for sec in downloadlist:
+                itemlist.extend(self._fetch_section(url, sec))
 
-        self._cache = {"cells": cellcount, "items": items}
+        self._cache = {"cells": cellcount, "items": itemlist, "errors": errors}
         return self._cache
 
-    def __init__(self, app, profile, schema=None, section=None, timeout=None):
+    def __init__(self, app, profile, schema=None, section=None, timeout=None, workers=1):
         """
         app is context data as returned by 'inventory_context.get'
         profile is a valid user object or ID64
+        workers is the amount of sections fetched concurrently
         """
 
         self._cache = {}
         self._section = section
         self._ctx = app
         self._timeout = timeout or api.socket_timeout.get()
+        self._workers = workers
 
         if not app:
             raise items.InventoryError("No inventory available")
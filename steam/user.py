@@ -6,8 +6,14 @@ Distributed under the ISC License (see LICENSE)
 
 import time
 import os
+import threading
 from . import api
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
 
 class ProfileError(api.APIError):
     pass
@@ -213,6 +219,11 @@ class profile(object):
         except:
             return -1
 
+    def load_async(self):
+        """ Returns an awaitable that fetches the player summary without
+        blocking, resolving to the profile itself """
+        return self._api.call_async(self)
+
     @classmethod
     def from_def(cls, obj):
         """ Builds a profile object from a raw player summary object """
@@ -238,10 +249,24 @@ class profile(object):
 class _batched_request(object):
     """ Base class for implementations that support multiple results
     per request (for example GetPlayerSummaries takes multiple id64s)
+
+    If workers is more than 1 the batches are dispatched concurrently
+    and results are yielded as each batch completes, or in input order
+    if ordered is True. Batches failing with a timeout or a retryable
+    HTTP status are retried on their own, 'retries' is either the amount
+    of attempts or an 'api.retry_policy' which also sets the backoff.
     """
 
-    def __init__(self, batch, batchsize=100):
+    def __init__(self, batch, batchsize=100, workers=1, ordered=False, retries=0):
         self._batches = []
+        self._workers = workers
+        self._ordered = ordered
+
+        if isinstance(retries, api.retry_policy):
+            self._retry_policy = retries
+        else:
+            self._retry_policy = api.retry_policy(attempts=retries)
+
         batchlen, rem = divmod(len(batch), batchsize)
 
         if rem > 0:
@@ -265,23 +290,89 @@ class _batched_request(object):
         """
         raise NotImplementedError
 
+    def _call_batch(self, batch):
+        attempt = 0
+
+        while True:
+            try:
+                return list(self._call_method(batch))
+            except api.HTTPError as E:
+                delay = self._retry_policy.delay(attempt, E)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def _call_concurrent(self):
+        """ Calls the batches on up to 'workers' threads, yielding
+        results as batches complete (or in order, see 'ordered') """
+        pending = list(reversed(list(enumerate(self._batches))))
+        done = Queue()
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    i, batch = pending.pop()
+
+                try:
+                    done.put((i, self._call_batch(batch)))
+                except Exception as E:
+                    done.put((i, E))
+
+        threads = [threading.Thread(target=work)
+                   for i in range(min(self._workers, len(self._batches)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        finished = {}
+        nextbatch = 0
+
+        try:
+            for count in range(len(self._batches)):
+                i, results = done.get()
+                if isinstance(results, Exception):
+                    raise results
+
+                if not self._ordered:
+                    for result in results:
+                        yield result
+                    continue
+
+                finished[i] = results
+                while nextbatch in finished:
+                    for result in finished.pop(nextbatch):
+                        yield result
+                    nextbatch += 1
+        finally:
+            # Don't start on batches nobody is waiting for anymore
+            with lock:
+                del pending[:]
+
     def __iter__(self):
         return next(self)
 
     def __next__(self):
-        for batch in self._batches:
-            for result in self._call_method(batch):
+        if self._workers > 1 and len(self._batches) > 1:
+            for result in self._call_concurrent():
                 yield result
+        else:
+            for batch in self._batches:
+                for result in self._call_batch(batch):
+                    yield result
     next = __next__
 
 
 class profile_batch(_batched_request):
-    def __init__(self, sids):
+    def __init__(self, sids, **kwargs):
         """ Fetches user profiles en masse and generates 'profile' objects.
         The length of the ID list can be indefinite, separate requests
         will be made if the length exceeds the API's ID cap and the list
-        split into batches. """
-        super(profile_batch, self).__init__(sids)
+        split into batches. See '_batched_request' for the keyword args """
+        super(profile_batch, self).__init__(sids, **kwargs)
 
     def _process_batch(self, batch):
         processed = set()
@@ -367,8 +458,8 @@ class bans(object):
 
 
 class bans_batch(_batched_request):
-    def __init__(self, sids):
-        super(bans_batch, self).__init__(sids)
+    def __init__(self, sids, **kwargs):
+        super(bans_batch, self).__init__(sids, **kwargs)
 
     def _process_batch(self, batch):
         processed = set()
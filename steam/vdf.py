@@ -4,6 +4,23 @@ Copyright (c) 2010-2013, Anthony Garcia <anthony@lagg.me>
 Distributed under the ISC License (see LICENSE)
 """
 
+import codecs
+import fnmatch
+import functools
+import hashlib
+import io
+import mmap
+import numbers
+import operator
+import os
+import re
+import stat
+import struct
+import tempfile
+from bisect import bisect_left
+from itertools import chain
+from . import api
+
 STRING = '"'
 NODE_OPEN = '{'
 NODE_CLOSE = '}'
@@ -16,181 +33,1224 @@ SPACE = ' '
 TAB = '\t'
 WHITESPACE = set(' \t\r\n')
 
+_TEXT = type(u'')
+# What lists hold when they can be written in one go
+_STRINGS = frozenset([_TEXT])
+_DICTS = frozenset([dict])
+# Average length up to which strings are joined when dumping
+_SHORT_LENGTH = 256
+# Whether text has a quote in it. Python 2 looks through unicode a char
+# at a time without memchr, counting quotes is about twice as quick there.
+_quoted = operator.methodcaller("count" if bytes is str else "__contains__", STRING)
+
+# Enough bytes to see a BOM or the NUL bytes of UTF-16
+_SNIFF_SIZE = 64
+
+# iterparse events
+START = "start"
+END = "end"
+PAIR = "pair"
+
 try:
     from collections import OrderedDict as odict
 except ImportError:
     odict = dict
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+# Token patterns. Quirks of the original char by char parser are kept:
+# quotes and brackets preceded by a backslash don't terminate, unquoted
+# strings eat the single whitespace char after them and newlines, comments
+# and stray slashes all just separate strings. Separators are folded into
+# the token before them and the common "key" "value" and "key" { forms are
+# matched as one token, so there are as few trips through the loop as
+# possible.
+_QUOTED = r'"([^"]*(?:(?<=\\)"[^"]*)*)(?<!\\)"'
+_SEPARATORS = r'(?:[\r\n][\r\n \t]*|//[^\n]*(?:\n|\Z)[\r\n \t]*|/(?!/)[\r\n \t]*)+'
+_TOKEN = re.compile(r'''[ \t]*(?:
+      {0}(?:                                # string
+          [ \t]+{0}(?:[ \t]*({1}))?         # with its value, then a separator
+        | [ \t]*(?:{1})?(\{{)[ \t]*(?:{1})?  # opening a node
+      )?
+    | ({1})                                  # separator
+    | (\{{)[ \t]*(?:{1})?                    # node open
+    | (\}})[ \t]*(?:{1})?                    # node close
+    | \[([^\]]*(?:(?<=\\)\][^\]]*)*)(?<!\\)\]    # bracket expression
+    | (["\[])                               # unterminated string or bracket
+    | ([^ \t\r\n]+)[ \t\r\n]?                 # unquoted string
+    )'''.format(_QUOTED, _SEPARATORS), re.VERBOSE)
+
+# Groups of '_TOKEN', the last one matched tells what kind of token it is
+(_T_STRING, _T_PAIR, _T_PAIR_END, _T_STRING_OPEN, _T_SEPARATOR, _T_OPEN, _T_CLOSE,
+ _T_BRACKET, _T_UNTERMINATED, _T_UNQUOTED) = range(1, 11)
+
+# What the scanner hands the parser besides strings
+_NEWLINE = (LF,)
+_OPEN = (NODE_OPEN,)
+_CLOSE = (NODE_CLOSE,)
+
+# Text is split on quotes this many chars at a time
+_WINDOW = 16384
+
+# Tokens between two strings by the text between them, False where
+# splitting on quotes can't be trusted. The same few indents and braces
+# make up nearly all of it, longer text is mostly comments that won't
+# come up again and isn't kept.
+_structures = {}
+_STRUCTURES_MAX = 4096
+_STRUCTURE_LENGTH_MAX = 64
+
+
+def _structure(sep):
+    """ Returns the tokens in 'sep', text found between two quotes, or
+    False if it has anything splitting on quotes would get wrong:
+    unquoted strings, unterminated brackets and comments running into the
+    next quote """
+    if sep.rfind("//") > sep.rfind(LF):
+        return False
+
+    tokens = []
+    match = _TOKEN.match
+    m = match(sep)
+
+    while m:
+        kind = m.lastindex
+        if kind == _T_SEPARATOR:
+            tokens.append(_NEWLINE)
+        elif kind == _T_OPEN:
+            tokens.append(_OPEN)
+        elif kind == _T_CLOSE:
+            tokens.append(_CLOSE)
+        elif kind == _T_BRACKET:
+            tokens.append((BR_OPEN, m.group(kind)))
+        else:
+            return False
+        m = match(sep, m.end())
+
+    return tuple(tokens)
+
+
+def _split_strings(text):
+    """ Splits 'text' on quotes, leaving quoted strings at the odd indexes.
+    Quotes preceded by a backslash don't end a string. """
+    parts = text.split(STRING)
+
+    # Backslashes are rare and looking for a single char is a lot quicker
+    if '\\' not in text or '\\"' not in text:
+        return parts
+
+    joined = [parts[0]]
+    i = 1
+    while i < len(parts):
+        string = parts[i]
+        while string.endswith('\\') and i + 1 < len(parts):
+            i += 1
+            string += STRING + parts[i]
+        joined.append(string)
+        joined.extend(parts[i + 1:i + 2])
+        i += 2
+
+    return joined
+
+
+def _units(chunks):
+    """ Scans the text pieces from 'chunks', yielding lists of (structure,
+    string) pairs: the tokens before a string, see '_structure', and the
+    string itself or None. Text is split on quotes a window at a time,
+    whatever that can't handle goes through '_TOKEN' up to the end of the
+    window. """
+    chunks = iter(chunks)
+    buf = u''
+    i = 0
+    eof = False
+    match = _TOKEN.match
+    structures = _structures
+
+    while True:
+        if not eof and len(buf) - i < _WINDOW:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buf = buf[i:] + chunk
+                i = 0
+            continue
+
+        stop = i + _WINDOW
+        # Ending it just past a quote keeps long strings from straddling
+        # the window and being split all over again in the next one
+        quote = buf.find(STRING, stop, stop + _WINDOW)
+        if quote != -1:
+            stop = quote + 1
+        parts = _split_strings(buf[i:stop])
+        # The last separator might go on past the window, so it's left
+        # for the next one along with the string after it
+        count = (len(parts) - 1) // 2
+        seps = parts[0:count * 2:2]
+        found = list(map(structures.get, seps))
+
+        if None in found:
+            if len(structures) >= _STRUCTURES_MAX:
+                structures.clear()
+            for n, sep in enumerate(seps):
+                if found[n] is None:
+                    found[n] = _structure(sep)
+                    if len(sep) <= _STRUCTURE_LENGTH_MAX:
+                        structures[sep] = found[n]
+
+        trusted = False not in found
+        if not trusted:
+            count = found.index(False)
 
-def _symtostr(line, i, token=STRING):
-    opening = i + 1
-    closing = 0
+        if count:
+            yield list(zip(found[:count], parts[1:count * 2:2]))
+            i += sum(map(len, parts[:count * 2])) + count * 2
+            if trusted:
+                continue
 
-    ci = line.find(token, opening)
-    while ci != -1:
-        if line[ci - 1] != '\\':
-            closing = ci
-            break
-        ci = line.find(token, ci + 1)
+        # Tokenize up to the end of the window instead
+        units = []
+        add = units.append
 
-    finalstr = line[opening:closing]
-    return finalstr, i + len(finalstr) + 1
+        while i < stop:
+            m = match(buf, i)
 
+            if not eof and (not m or m.end() >= len(buf) or m.lastindex == _T_UNTERMINATED):
+                # The token might continue in the next chunk
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                else:
+                    stop -= i
+                    buf = buf[i:] + chunk
+                    i = 0
+                continue
+
+            if not m:
+                yield units
+                return
+
+            i = m.end()
+            kind = m.lastindex
+
+            if kind == _T_STRING or kind == _T_UNQUOTED:
+                add(((), m.group(kind)))
+            elif kind == _T_PAIR or kind == _T_PAIR_END:
+                add(((), m.group(_T_STRING)))
+                add(((), m.group(_T_PAIR)))
+                if kind == _T_PAIR_END:
+                    add(((_NEWLINE,), None))
+            elif kind == _T_STRING_OPEN:
+                add(((), m.group(_T_STRING)))
+                add(((_OPEN,), None))
+            elif kind == _T_SEPARATOR:
+                add(((_NEWLINE,), None))
+            elif kind == _T_OPEN:
+                add(((_OPEN,), None))
+            elif kind == _T_CLOSE:
+                add(((_CLOSE,), None))
+            elif kind == _T_BRACKET:
+                add((((BR_OPEN, m.group(kind)),), None))
+            elif m.group(kind) == STRING:
+                # Unterminated, the original parser skipped a char after it
+                add(((), u''))
+                i += 1
+            else:
+                # Unterminated bracket, skipped past the same way
+                add((((BR_OPEN, u''),), None))
+                i += 1
+
+        yield units
 
-def _unquotedtostr(line, i):
-    ci = i
-    _len = len(line)
-    while ci < _len:
-        if line[ci] in WHITESPACE:
-            break
-        ci += 1
-    return line[i:ci], ci
+
+def _merge(node, key, value):
+    """ Adds 'value' under 'key', duplicate keys turn into lists of values """
+    if key in node:
+        existing = node[key]
+        if type(existing) is not list:
+            node[key] = [existing, value]
+        else:
+            existing.append(value)
+    else:
+        node[key] = value
 
 
-def _parse(stream, ptr=0):
-    i = ptr
+def _events(chunks):
+    """ Runs the scanner over the text pieces from 'chunks', yielding the
+    events described in 'iterparse' """
+    stack = []
+    keys = set()  # Keys already in the current node
     laststr = None
-    lasttok = None
     lastbrk = None
+    adjacent = False  # Previous token was a string on the same line
     next_is_value = False
-    deserialized = {}
-
-    while i < len(stream):
-        c = stream[i]
 
-        if c == NODE_OPEN:
-            next_is_value = False  # Make sure next string is interpreted as a key.
+    for units in _units(chunks):
+        for structure, string in units:
+            for token in structure:
+                if token is _NEWLINE:
+                    adjacent = False
+                elif token is _OPEN:
+                    keys.add(laststr)
+                    yield START, laststr, None
+                    stack.append((laststr, lastbrk, keys))
+                    keys = set()
+                    laststr = None
+                    lastbrk = None
+                    adjacent = False
+                    next_is_value = False
+                elif token is _CLOSE:
+                    if not stack:
+                        # Stray closing brace, the rest of the input is ignored
+                        return
+                    laststr, lastbrk, keys = stack.pop()
+                    yield END, laststr, None
+                    adjacent = False
+                    next_is_value = False
+                else:
+                    lastbrk = token[1]
+                    adjacent = False
 
-            if laststr in deserialized.keys():
-                # If this key already exists then we need to make it a list and append the current value.
-                if type(deserialized[laststr]) is not list:
-                    # If the value already set is not a list, let's make it one.
-                    deserialized[laststr] = [deserialized[laststr]]
+            if string is None:
+                continue
 
-                # Append the current value to the list
-                _value, i = _parse(stream, i + 1)
-                deserialized[laststr].append(_value)
-            else:
-                # Key is brand new!
-                deserialized[laststr], i = _parse(stream, i + 1)
-        elif c == NODE_CLOSE:
-            return deserialized, i
-        elif c == BR_OPEN:
-            lastbrk, i = _symtostr(stream, i, BR_CLOSE)
-        elif c == COMMENT:
-            if (i + 1) < len(stream) and stream[i + 1] == '/':
-                i = stream.find('\n', i)
-        elif c == CR or c == LF:
-            ni = i + 1
-            if ni < len(stream) and stream[ni] == LF:
-                i = ni
-            if lasttok != LF:
-                c = LF
-        elif c != SPACE and c != TAB:
-            string, i = (
-                _symtostr if c == STRING else
-                _unquotedtostr)(stream, i)
-            if lasttok == STRING and next_is_value:
-                if laststr in deserialized and lastbrk is not None:
+            if adjacent and next_is_value:
+                if lastbrk is not None and laststr in keys:
                     # ignore this entry if it's the second bracketed expression
                     lastbrk = None
                 else:
-                    if laststr in deserialized.keys():
-                        # If this key already exists then we're dealing with a list of items
-                        if type(deserialized[laststr]) is not list:
-                            # If the existing val is not a list, we need to cast it to one.
-                            deserialized[laststr] = [deserialized[laststr]]
-
-                        # Append current val to list
-                        deserialized[laststr].append(string)
-                    else:
-                        # First occurence of laststr in deserialized.  Assign the value as normal
-                        deserialized[laststr] = string
+                    keys.add(laststr)
+                    yield PAIR, laststr, string
 
-            # force c = STRING so that lasttok will be set properly
-            c = STRING
             laststr = string
             next_is_value = not next_is_value
+            adjacent = True
+
+    while stack:
+        yield END, stack.pop()[0], None
+
+
+def _detect_encoding(head):
+    """ Picks the encoding of VDF bytes starting with 'head' by their BOM.
+    NUL bytes mean UTF-16 without one, anything else is taken as UTF-8. """
+    if head[:3] == codecs.BOM_UTF8:
+        return "utf-8-sig"
+    elif head[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return "utf-16"
+    elif b'\0' in head:
+        return "utf-16-le"
+    else:
+        return "utf-8"
+
+
+def _decoded_chunks(stream, chunk_size, encoding=None):
+    """ Reads 'stream' in chunks, decoding them with 'encoding' (or the
+    detected one) if it's a byte stream """
+    decoder = None
+
+    while True:
+        chunk = stream.read(chunk_size)
+
+        if decoder is None:
+            if isinstance(chunk, _TEXT):
+                if not chunk:
+                    return
+                yield chunk
+                continue
+
+            while 0 < len(chunk) < _SNIFF_SIZE:
+                more = stream.read(chunk_size)
+                if not more:
+                    break
+                chunk += more
+
+            encoding = encoding or _detect_encoding(chunk[:_SNIFF_SIZE])
+            decoder = codecs.getincrementaldecoder(encoding)()
+
+        if not chunk:
+            yield decoder.decode(b'', True)
+            return
+
+        yield decoder.decode(chunk)
+
+
+def _build(events, intern_keys=False):
+    """ Builds the tree from 'events', duplicate keys turn into lists.
+    With 'intern_keys' equal keys share one string object. """
+    deserialized = {}
+    node = deserialized
+    stack = []
+    pool = {}.setdefault if intern_keys else None
+
+    for event, key, value in events:
+        if pool:
+            key = pool(key, key)
+
+        if event is PAIR:
+            if key in node:
+                _merge(node, key, value)
+            else:
+                node[key] = value
+        elif event is START:
+            child = {}
+            _merge(node, key, child)
+            stack.append(node)
+            node = child
         else:
-            c = lasttok
+            node = stack.pop()
+
+    return deserialized
 
-        lasttok = c
-        i += 1
 
-    return deserialized, i
+def _run_parse_encoded(string, encoding=None, intern_keys=False):
+    """ Parses text as is, anything else supporting the buffer interface
+    is decoded once with 'encoding' or the detected one """
+    if isinstance(string, _TEXT):
+        text = string
+    elif encoding:
+        text = codecs.decode(string, encoding)
+    else:
+        encoding = _detect_encoding(bytes(string[:_SNIFF_SIZE]))
+        try:
+            text = codecs.decode(string, encoding)
+        except UnicodeDecodeError:
+            if encoding != "utf-8":
+                raise
+            # Where the old ascii -> utf-8 -> utf-16 guessing ended up
+            text = codecs.decode(string, "utf-16")
 
+    return _build(_events((text,)), intern_keys)
 
-def _run_parse_encoded(string):
-    try:
-        encoded = bytearray(string, "utf-16")
-    except:
-        encoded = bytearray(string)  # Already byte object?
+
+def iterparse(stream, chunk_size=65536, encoding=None):
+    """ Parses the VDF in 'stream' incrementally, reading 'chunk_size'
+    at a time. Yields ("start", key, None) and ("end", key, None) around
+    nodes and ("pair", key, value) for values, so single sections can be
+    picked out without building the whole tree. Values of duplicate keys
+    are all reported, in the tree they would be merged into a list.
+    Byte streams are decoded with 'encoding', which is detected from a
+    BOM if not given. """
+    return _events(_decoded_chunks(stream, chunk_size, encoding))
+
+
+def load(stream, encoding=None, intern_keys=False):
+    """ Parses the VDF in 'stream', see 'loads' """
+    return _build(iterparse(stream, encoding=encoding), intern_keys)
+
+
+def loads(string, encoding=None, intern_keys=False):
+    """ Parses the VDF in 'string', which is decoded with 'encoding' or
+    the detected one if it isn't text. With 'intern_keys' keys that
+    repeat throughout the tree share one string object, which saves a
+    lot of memory on files like items_game.txt """
+    return _run_parse_encoded(string, encoding, intern_keys)
+
+
+# Finds braces that open or close nodes without tokenizing everything.
+# Runs of quoted strings and whitespace are skipped in one match and the
+# rest is matched a token at a time the same way '_TOKEN' would, so braces
+# in strings, comments and brackets aren't picked up.
+_INDEX_TOKEN = re.compile(br'''(?:"[^"]*(?:(?<=\\)"[^"]*)*(?<!\\)"|[ \t\r\n])*(?:
+      ([{}])
+    | //[^\n]*
+    | \[[^\]]*(?:(?<=\\)\][^\]]*)*(?<!\\)\]
+    | [^ \t\r\n"{}\[/][^ \t\r\n]*
+    | \Z
+    | ["\[].?
+    | .
+    )''', re.VERBOSE | re.DOTALL)
+
+
+class lazy_node(Mapping):
+    """ Read-only mapping over a node of a 'mmap_document'. The node is
+    parsed the first time it's accessed, nodes below it stay unparsed
+    until they are accessed themselves. """
+
+    def __init__(self, document, start, end):
+        self._document = document
+        self._start = start
+        self._end = end
+        self._tree = None
+
+    def _parsed(self):
+        if self._tree is None:
+            self._tree = self._document._parse_node(self._start, self._end)
+        return self._tree
+
+    def __getitem__(self, key):
+        return self._parsed()[key]
+
+    def __iter__(self):
+        return iter(self._parsed())
+
+    def __len__(self):
+        return len(self._parsed())
+
+    def __contains__(self, key):
+        return key in self._parsed()
+
+    def to_dict(self):
+        """ Parses the whole node, returning the same tree 'loads' would """
+        def convert(value):
+            if isinstance(value, lazy_node):
+                return value.to_dict()
+            elif isinstance(value, list):
+                return [convert(v) for v in value]
+            else:
+                return value
+
+        return dict([(k, convert(v)) for k, v in self._parsed().items()])
+
+
+class mmap_document(lazy_node):
+    """ A UTF-8 VDF file memory mapped and indexed by a quick pass over
+    its braces, see 'lazy_node'. Only the text of the nodes that are
+    looked at is decoded and parsed. """
+
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            try:
+                self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                self._map = b''
+
+        encoding = _detect_encoding(self._map[:_SNIFF_SIZE])
+        if encoding.startswith("utf-16"):
+            self.close()
+            raise ValueError("Only UTF-8 documents can be memory mapped, use load instead")
+
+        start = len(codecs.BOM_UTF8) if encoding == "utf-8-sig" else 0
+        end = len(self._map)
+        opens = []
+        closes = {}
+        stack = []
+
+        for m in _INDEX_TOKEN.finditer(self._map, start):
+            if m.lastindex:
+                brace = m.start(1)
+                if self._map[brace:brace + 1] == b'{':
+                    stack.append(brace)
+                    opens.append(brace)
+                elif stack:
+                    closes[stack.pop()] = brace
+                else:
+                    # Stray closing brace, parsing stops here
+                    end = brace
+                    break
+
+        for brace in stack:
+            closes[brace] = end
+
+        self._opens = opens
+        self._closes = closes
+        lazy_node.__init__(self, self, start, end)
+
+    def _text(self, start, end, children):
+        """ Returns the text of the node between 'start' and 'end' with the
+        bodies of child nodes left out, adding a 'lazy_node' for each """
+        opens = self._opens
+        i = bisect_left(opens, start)
+        pos = start
+        pieces = []
+
+        while i < len(opens) and opens[i] < end:
+            brace = opens[i]
+            close = self._closes[brace]
+            children.append(lazy_node(self, brace + 1, close))
+            pieces.append(self._map[pos:brace + 1])
+            pos = close
+            i = bisect_left(opens, pos, i)
+
+        pieces.append(self._map[pos:end])
+
+        return b''.join(pieces).decode("utf-8")
+
+    def _parse_node(self, start, end):
+        children = []
+        tree = {}
+        n = 0
+
+        for event, key, value in _events((self._text(start, end, children),)):
+            if event is PAIR:
+                _merge(tree, key, value)
+            elif event is START:
+                _merge(tree, key, children[n] if n < len(children) else {})
+                n += 1
+
+        return tree
+
+    def close(self):
+        if not isinstance(self._map, bytes):
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_GLOB = re.compile(r'[*?\[]')
+
+# Compiled queries by path, see 'select'
+_queries = {}
+_QUERIES_MAX = 100
+
+
+class query(object):
+    """ A path of keys separated by slashes, like
+    "items_game/items/*/used_by_classes", compiled once so it can be run
+    over many trees or streams. Steps may use 'fnmatch' wildcards. """
+
+    def __init__(self, path):
+        self.path = path
+        self._steps = tuple([self._compile(step) for step in path.strip('/').split('/')])
+
+    @staticmethod
+    def _compile(step):
+        """ Returns a key to look up, None to take every key or a
+        function to match keys against """
+        if step == '*':
+            return None
+        elif _GLOB.search(step):
+            return re.compile(fnmatch.translate(step)).match
+        else:
+            return step
+
+    @staticmethod
+    def _matches(step, key):
+        if step is None:
+            return True
+        elif callable(step):
+            return key is not None and step(key) is not None
+        else:
+            return step == key
+
+    def select(self, tree):
+        """ Returns the values matching the path in 'tree', one level at a
+        time in the order they're stored. Values of duplicate keys are
+        matched one by one. Nodes of a 'mmap_document' are only parsed if
+        the path goes through them. """
+        nodes = [tree]
+        last = len(self._steps) - 1
+
+        for n, step in enumerate(self._steps):
+            found = []
+            add = found.append
+
+            for node in nodes:
+                if step is None:
+                    values = node.values()
+                elif callable(step):
+                    values = [v for k, v in node.items() if k is not None and step(k)]
+                elif step in node:
+                    values = node[step]
+                    if type(values) is not list:
+                        add(values)
+                        continue
+                else:
+                    continue
+
+                for value in values:
+                    if type(value) is list:
+                        found.extend(value)
+                    else:
+                        add(value)
+
+            if n < last:
+                found = [value for value in found
+                         if type(value) is dict or isinstance(value, Mapping)]
+
+            nodes = found
+
+        return nodes
+
+    def iterselect(self, events):
+        """ Yields the values matching the path as 'events' from
+        'iterparse' come in, in document order. Nodes off the path are
+        skipped over without building anything. """
+        last = len(self._steps) - 1
+        depth = 0  # Nodes open along the path
+        skip = 0  # Nodes open below one that's off the path
+        events = iter(events)
+
+        for event, key, value in events:
+            if skip:
+                if event is START:
+                    skip += 1
+                elif event is END:
+                    skip -= 1
+            elif event is END:
+                depth -= 1
+            elif not self._matches(self._steps[depth], key):
+                if event is START:
+                    skip = 1
+            elif event is PAIR:
+                if depth == last:
+                    yield value
+            elif depth < last:
+                depth += 1
+            else:
+                yield self._subtree(events)
+
+    @staticmethod
+    def _subtree(events):
+        """ Builds the node that was just opened from 'events', up to
+        where it closes """
+        tree = {}
+        node = tree
+        stack = []
+
+        for event, key, value in events:
+            if event is PAIR:
+                _merge(node, key, value)
+            elif event is START:
+                child = {}
+                _merge(node, key, child)
+                stack.append(node)
+                node = child
+            elif stack:
+                node = stack.pop()
+            else:
+                break
+
+        return tree
+
+
+def _query(path):
+    if isinstance(path, query):
+        return path
+
+    compiled = _queries.get(path)
+    if compiled is None:
+        if len(_queries) >= _QUERIES_MAX:
+            _queries.clear()
+        compiled = _queries[path] = query(path)
+
+    return compiled
+
+
+def select(tree, path):
+    """ Returns the values in 'tree' matching 'path', a string or a
+    'query'. See 'query' for the syntax. """
+    return _query(path).select(tree)
+
+
+def iterselect(stream, path, chunk_size=65536, encoding=None):
+    """ Like 'select' over what 'load' would return, but evaluated while
+    'stream' is parsed. Values are yielded in document order and only
+    matching nodes are built, see 'iterparse' for the other arguments. """
+    return _query(path).iterselect(iterparse(stream, chunk_size, encoding))
+
+
+def _escape(value):
+    """ Returns 'value' as text with its quotes escaped, quotes the parser
+    would see as escaped already are left alone """
+    if type(value) is not _TEXT:
+        value = u"{0}".format(value)
+
+    if _quoted(value):
+        value = value.replace(u'"', u'\\"').replace(u'\\\\"', u'\\"')
+
+    return value
+
+
+class _pair_starts(dict):
+    """ What the lines of pairs at one indent start with by key. The same
+    keys come up over and over, so each is only escaped once. """
+
+    def __init__(self, start):
+        dict.__init__(self)
+        self.start = start
+
+    def __missing__(self, key):
+        line = self[key] = self.start + _escape(key) + u'" "'
+        return line
+
+
+def _short(strings):
+    """ Whether 'strings' are short enough on average to be joined into
+    one piece. Long ones are cheaper written one by one than copied. """
+    return sum(map(len, strings)) < _SHORT_LENGTH * len(strings)
+
+
+def _has_quote(strings):
+    """ Whether any of 'strings' has a quote in it """
+    if _short(strings):
+        return STRING in u''.join(strings)
+
+    for string in strings:
+        if _quoted(string):
+            return True
+    return False
+
+
+def _plain_leaves(nodes):
+    """ Whether the dicts 'nodes' hold nothing but strings without quotes
+    and none is empty, which lets them be written in one go """
+    if not all(nodes):
+        return False
 
     try:
-        encoded = encoded.decode("ascii")
-    except UnicodeDecodeError:
-        try:
-            encoded = encoded.decode("utf-8")
-        except:
-            encoded = encoded.decode("utf-16")
-    except UnicodeEncodeError:
-        pass  # Likely already decoded
+        # Joining fails on anything but strings, nodes included
+        text = u''.join(chain.from_iterable(nodes))
+        text += u''.join(chain.from_iterable(map(dict.values, nodes)))
+    except (TypeError, UnicodeError):
+        return False
+
+    return STRING not in text
 
-    res, ptr = _parse(encoded)
-    return res
 
+def _dump(obj, write, compact=False):
+    """ Writes the text of 'obj' in pieces through 'write'. Nodes are
+    tracked on a stack so nothing is shared between calls. Lists holding
+    nodes are expanded into repeated keys the way duplicate keys are
+    loaded, other lists are written as a node of their values each set
+    to "1". """
+    if compact:
+        newline, pad = u' ', u''
+    else:
+        newline, pad = u'\n', u'  '
 
-def load(stream):
-    return _run_parse_encoded(stream.read())
+    escape = _escape
+    texts = set([_TEXT]).issuperset
+    end = u'"' + newline
+    # How lines and nodes start and end by indent, worked out once
+    layouts = {}
 
+    def layout(indent):
+        opening = end + indent + u'{' + newline
+        inner = indent + pad + u'"'
+        layouts[indent] = (_pair_starts(indent + u'"'), indent + u'"', opening, opening + inner,
+                           end + inner, indent + u'}' + newline)
+        return layouts[indent]
 
-def loads(string):
-    return _run_parse_encoded(string)
+    # Frames are the pairs left to write, the layout to write them with and
+    # what closes the node they're from, if any
+    stack = [(iter(obj.items()), layout(u''), None)]
+    indent = u''
 
-indent = 0
-mult = 2
+    while stack:
+        pairs, (lines, start, opening, first, between, closing), parent = stack[-1]
 
+        for k, v in pairs:
+            if type(v) is _TEXT:
+                write(lines[k] + (v if STRING not in v else escape(v)) + end)
+            elif type(v) is dict or isinstance(v, Mapping):
+                key = k if type(k) is _TEXT and STRING not in k else escape(k)
 
-def _i():
-    return u' ' * (indent * mult)
+                if len(v) > 16 and texts(map(type, v)) and texts(map(type, v.values())):
+                    write(start + key + first)
 
+                    if _short(v) and _short(v.values()):
+                        # Big nodes of short strings only are written in one go
+                        if STRING in u''.join(v) or STRING in u''.join(v.values()):
+                            body = [escape(name) + u'" "' + escape(value)
+                                    for name, value in v.items()]
+                        else:
+                            body = map(u'" "'.join, v.items())
+                        write(between.join(body))
+                    else:
+                        # Long values are written as they are, not copied into bigger pieces
+                        separator = u''
+                        for name, value in v.items():
+                            write(separator + escape(name) + u'" "')
+                            write(escape(value))
+                            separator = between
 
-def _dump(obj):
-    nodefmt = u'\n' + _i() + '"{0}"\n' + _i() + '{{\n{1}' + _i() + '}}\n\n'
-    podfmt = _i() + '"{0}" "{1}"\n'
-    lstfmt = _i() + (' ' * mult) + '"{0}" "1"'
-    global indent
+                    write(end + closing)
+                    continue
 
-    indent += 1
+                write(start + key + opening)
+                indent += pad
+                stack.append((iter(v.items()), layouts.get(indent) or layout(indent), closing))
+                break
+            elif isinstance(v, (list, tuple)):
+                key = k if type(k) is _TEXT and STRING not in k else escape(k)
+                types = set(map(type, v))
 
-    nodes = []
-    for k, v in obj.items():
-        if isinstance(v, dict):
-            nodes.append(nodefmt.format(k, _dump(v)))
+                if types - _STRINGS and (dict in types or
+                                         [value for value in v if isinstance(value, Mapping)]):
+                    if types == _DICTS and _plain_leaves(v):
+                        # Repeated nodes of strings, mostly small, written in one go
+                        head = start + key + first
+                        tail = end + closing
+                        pairs = map(functools.partial(map, u'" "'.join), map(dict.items, v))
+                        write(head + (tail + head).join(map(between.join, pairs)) + tail)
+                        continue
+
+                    # Continue with the elements as if they were in the node
+                    stack.append((iter([(k, value) for value in v]), stack[-1][1], None))
+                    break
+
+                if not v:
+                    write(start + key + opening + closing)
+                    continue
+
+                # The values written in one go
+                if types - _STRINGS or _has_quote(v):
+                    v = [escape(value) for value in v]
+                write(start + key + first + (u'" "1' + between).join(v) + u'" "1' + end + closing)
+            else:
+                write(lines[k] + escape(v) + end)
         else:
-            try:
-                try:
-                    v.isdigit
-                    nodes.append(podfmt.format(k, v))
-                except AttributeError:
-                    lst = map(lstfmt.format, v)
-                    nodes.append(nodefmt.format(k, u'\n'.join(lst) + '\n'))
-            except TypeError:
-                nodes.append(podfmt.format(k, v))
+            stack.pop()
+            if parent:
+                indent = indent[len(pad):]
+                write(parent)
+
+
+def dump(obj, stream, encoding="utf-16", compact=False):
+    """ Writes 'obj' to 'stream' encoded with 'encoding', or as text if
+    'encoding' is None. Lists of nodes are written as repeated keys, see
+    '_dump' for other lists. 'compact' puts everything on one line. """
+    write = codecs.getwriter(encoding)(stream).write if encoding else stream.write
+    batch = []
+
+    def buffered(piece):
+        batch.append(piece)
+        if len(batch) >= 1024:
+            write(u''.join(batch))
+            del batch[:]
+
+    _dump(obj, buffered, compact)
+    write(u''.join(batch))
 
-    indent -= 1
 
-    return u''.join(nodes)
+def dumps(obj, encoding="utf-16", compact=False):
+    """ Returns 'obj' serialized, see 'dump' """
+    pieces = []
+    _dump(obj, pieces.append, compact)
+    res = u''.join(pieces)
 
+    return res.encode(encoding) if encoding else res
+
+
+# Binary KeyValues, as used by appinfo.vdf, packageinfo.vdf and shortcuts.vdf
+BIN_NODE = b'\x00'
+BIN_STRING = b'\x01'
+BIN_INT32 = b'\x02'
+BIN_FLOAT32 = b'\x03'
+BIN_POINTER = b'\x04'
+BIN_WIDESTRING = b'\x05'
+BIN_COLOR = b'\x06'
+BIN_UINT64 = b'\x07'
+BIN_END = b'\x08'
+BIN_INT64 = b'\x0a'
+BIN_END_ALT = b'\x0b'
+
+_BINARY_FIXED = {
+    BIN_INT32: struct.Struct("<i"),
+    BIN_FLOAT32: struct.Struct("<f"),
+    BIN_POINTER: struct.Struct("<i"),
+    BIN_COLOR: struct.Struct("<i"),
+    BIN_UINT64: struct.Struct("<Q"),
+    BIN_INT64: struct.Struct("<q")
+    }
+
+# Strings are null terminated, string values are matched along with their key
+_BINARY_TOKEN = re.compile(br'\x01([^\x00]*)\x00([^\x00]*)\x00'  # 1, 2: string
+                           br'|\x00([^\x00]*)\x00'                # 3: node
+                           br'|([\x08\x0b])'                      # 4: end of node
+                           br'|(.)([^\x00]*)\x00', re.DOTALL)     # 5, 6: other types
+_BINARY_WIDE = re.compile(br'((?:..)*?)\x00\x00', re.DOTALL)
+
+
+def binary_loads(data, offset=0, intern_keys=False):
+    """ Parses binary KeyValues from 'data' starting at 'offset'. 'data'
+    can be anything supporting the buffer interface, values are read
+    straight out of it so a memoryview or mmap of a large file isn't
+    copied, except for memoryviews on python 2 which its re module can't
+    match against. 'intern_keys' works like it does for 'loads'. """
+    if bytes is str and isinstance(data, memoryview):
+        data = data.tobytes()
+
+    deserialized = {}
+    node = deserialized
+    stack = []
+    pool = {}.setdefault if intern_keys else None
+    match = _BINARY_TOKEN.match
+    size = len(data)
+    i = offset
+
+    while True:
+        m = match(data, i)
+        if not m:
+            if i >= size:
+                # Missing the final terminator, accept it like the text parser would
+                break
+            raise ValueError("Malformed binary VDF at offset {0}".format(i))
+
+        kind = m.lastindex
+        i = m.end()
+
+        if kind == 2:
+            key, value = m.group(1, 2)
+            key = key.decode("utf-8", "replace")
+            value = value.decode("utf-8", "replace")
+            if pool:
+                key = pool(key, key)
+            if key in node:
+                _merge(node, key, value)
+            else:
+                node[key] = value
+        elif kind == 3:
+            child = {}
+            key = m.group(3).decode("utf-8", "replace")
+            _merge(node, pool(key, key) if pool else key, child)
+            stack.append(node)
+            node = child
+        elif kind == 4:
+            if not stack:
+                break
+            node = stack.pop()
+        else:
+            vtype = m.group(5)
+            fixed = _BINARY_FIXED.get(vtype)
+
+            if fixed:
+                if i + fixed.size > size:
+                    raise ValueError("Truncated binary VDF at offset {0}".format(i))
+                value = fixed.unpack_from(data, i)[0]
+                i += fixed.size
+            elif vtype == BIN_WIDESTRING:
+                wide = _BINARY_WIDE.match(data, i)
+                if not wide:
+                    raise ValueError("Truncated binary VDF at offset {0}".format(i))
+                value = wide.group(1).decode("utf-16-le", "replace")
+                i = wide.end()
+            else:
+                raise ValueError("Unknown binary VDF type {0!r} at offset {1}".format(vtype, m.start()))
 
-def _run_dump(obj):
-    res = _dump(obj)
-    return res.encode("utf-16")
+            key = m.group(6).decode("utf-8", "replace")
+            _merge(node, pool(key, key) if pool else key, value)
 
+    return deserialized
 
-def dump(obj, stream):
-    stream.write(_run_dump(obj))
 
+def binary_load(stream, intern_keys=False):
+    """ Parses binary KeyValues from 'stream', files are memory mapped
+    rather than read """
+    try:
+        fileno = stream.fileno()
+        mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError, io.UnsupportedOperation):
+        # Not a real file or an empty one
+        return binary_loads(stream.read(), intern_keys=intern_keys)
+
+    try:
+        return binary_loads(mapped, intern_keys=intern_keys)
+    finally:
+        mapped.close()
+
+
+def _binary_dump(obj, out):
+    for k, v in obj.items():
+        key = u"{0}".format(k).encode("utf-8") + b'\x00'
+
+        # Lists are what duplicate keys load as, so they're written out as such
+        if not isinstance(v, list):
+            v = [v]
+
+        for value in v:
+            if isinstance(value, dict):
+                out.append(BIN_NODE + key)
+                _binary_dump(value, out)
+                out.append(BIN_END)
+            elif isinstance(value, numbers.Integral):
+                if -0x80000000 <= value <= 0x7fffffff:
+                    out.append(BIN_INT32 + key + _BINARY_FIXED[BIN_INT32].pack(value))
+                elif value > 0:
+                    out.append(BIN_UINT64 + key + _BINARY_FIXED[BIN_UINT64].pack(value))
+                else:
+                    out.append(BIN_INT64 + key + _BINARY_FIXED[BIN_INT64].pack(value))
+            elif isinstance(value, numbers.Real):
+                out.append(BIN_FLOAT32 + key + _BINARY_FIXED[BIN_FLOAT32].pack(value))
+            else:
+                out.append(BIN_STRING + key + u"{0}".format(value).encode("utf-8") + b'\x00')
+
+
+def binary_dumps(obj):
+    out = []
+    _binary_dump(obj, out)
+    out.append(BIN_END)
+    return b''.join(out)
+
+
+def binary_dump(obj, stream):
+    stream.write(binary_dumps(obj))
+
+
+# Snapshots of parsed files for load_cached: magic, format version, size
+# and mtime of the source, SHA-1 of its content, whether keys were
+# interned and the length of the encoding's name, then the name and the
+# tree as binary KeyValues
+_SNAPSHOT = struct.Struct("<4sBQd20s?B")
+_SNAPSHOT_MAGIC = b"VDFC"
+# 3: the encoding and intern_keys the tree was loaded with, 2: trees with
+# nodes missing their key aren't snapshotted anymore, 1 had those keys
+# as "None"
+_SNAPSHOT_VERSION = 3
+
+
+def _snapshot_encoding(encoding):
+    """ The name 'encoding' is recorded by in snapshots, empty if it's
+    detected. Aliases of one codec get the same name. """
+    if encoding is None:
+        return b""
+
+    return codecs.lookup(encoding).name.encode("ascii")
+
+
+def _read_snapshot(filename, st, path, encoding, intern_keys):
+    """ Returns the tree in the snapshot 'filename' if it's still valid
+    for the file at 'path' with the stat result 'st', loaded with
+    'encoding' and 'intern_keys' """
+    try:
+        with open(filename, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+
+    try:
+        fields = _SNAPSHOT.unpack_from(mapped)
+        magic, version, size, mtime, digest, interned, length = fields
+        base = _SNAPSHOT.size + length
+
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION or size != st.st_size:
+            return None
+
+        # Loaded some other way it could be another tree
+        if interned != bool(intern_keys) or mapped[_SNAPSHOT.size:base] != encoding:
+            return None
+
+        if mtime != st.st_mtime:
+            # Touched but maybe not changed, the content decides
+            with open(path, "rb") as f:
+                if hashlib.sha1(f.read()).digest() != digest:
+                    return None
+
+            with open(filename, "r+b") as f:
+                f.write(_SNAPSHOT.pack(magic, version, size, st.st_mtime, digest, interned,
+                                       length))
+
+        return binary_loads(mapped, base, intern_keys)
+    except (EnvironmentError, ValueError, struct.error):
+        return None
+    finally:
+        mapped.close()
+
+
+def _has_none_key(tree):
+    """ Whether a node in 'tree' has None as a key, what a node without
+    a key in front of it parses to """
+    stack = [tree]
+
+    while stack:
+        node = stack.pop()
+        if None in node:
+            return True
+        for value in node.values():
+            if isinstance(value, dict):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend([v for v in value if isinstance(v, dict)])
+
+    return False
+
+
+def _write_snapshot(filename, st, data, tree, encoding, intern_keys):
+    def write(f):
+        f.write(_SNAPSHOT.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, st.st_size,
+                               st.st_mtime, hashlib.sha1(data).digest(), intern_keys,
+                               len(encoding)))
+        f.write(encoding)
+        f.write(body)
+
+    # Binary KeyValues has no way to tell a None key from "None", and a
+    # snapshot has to load as the same tree as the text
+    if _has_none_key(tree):
+        return
+
+    try:
+        body = binary_dumps(tree)
+        api._atomic_write(filename, write)
+    except (EnvironmentError, ValueError):
+        # Not being able to cache shouldn't stop anyone from loading
+        pass
+
+
+def _private_cache_dir():
+    """ Returns the default snapshot directory, one per user in the temp
+    dir, or None if it's not a directory only the user can write to.
+    Snapshots are trusted on the file's size and mtime, so one anyone
+    else can plant would poison later loads. """
+    getuid = getattr(os, "getuid", None)
+    name = "steamodd-vdf"
+
+    if getuid:
+        name += "-{0}".format(getuid())
+
+    cache_dir = os.path.join(tempfile.gettempdir(), name)
+
+    try:
+        os.mkdir(cache_dir, 0o700)
+    except OSError:
+        pass
+
+    try:
+        st = os.lstat(cache_dir)
+    except OSError:
+        return None
+
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+
+    if getuid and (st.st_uid != getuid() or st.st_mode & 0o077):
+        return None
+
+    return cache_dir
+
+
+def load_cached(path, cache_dir=None, encoding=None, intern_keys=False):
+    """ Loads the VDF file at 'path', keeping a binary snapshot of the
+    tree in 'cache_dir' (a directory private to the user in the system's
+    temp dir by default). Later calls map and decode the snapshot instead
+    of parsing the text again, as long as the file's size and mtime or
+    failing that its content are unchanged and it's loaded with the same
+    'encoding' and 'intern_keys'. See 'loads' for those. """
+    if not cache_dir:
+        cache_dir = _private_cache_dir()
+
+    if not cache_dir:
+        with open(path, "rb") as f:
+            return loads(f.read(), encoding, intern_keys)
+
+    path = os.path.abspath(path)
+    filename = os.path.join(cache_dir, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".vdfc")
+
+    recorded = _snapshot_encoding(encoding)
+    tree = _read_snapshot(filename, os.stat(path), path, recorded, intern_keys)
+    if tree is not None:
+        return tree
+
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+
+    tree = loads(data, encoding, intern_keys)
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        return tree
+
+    _write_snapshot(filename, st, data, tree, recorded, bool(intern_keys))
 
-def dumps(obj):
-    return _run_dump(obj)
+    return tree
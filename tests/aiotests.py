@@ -0,0 +1,173 @@
+"""
+Tests for the asyncio layer, kept out of testapi since coroutines are a
+syntax error on the older pythons steamodd supports. testapi loads them
+on python 3.7 or newer.
+"""
+
+import os
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+from urllib.request import install_opener
+from steam import api, aio
+
+try:
+    from .testapi import LocalServerTestCase
+except (ImportError, ValueError):
+    from testapi import LocalServerTestCase
+
+
+class AsyncCoalescingTestCase(LocalServerTestCase):
+    def test_async(self):
+        async def fetch():
+            return await asyncio.gather(*[api.method_result(self.base + "/slow").call_async()
+                                          for i in range(5)])
+
+        results = asyncio.run(fetch())
+
+        self.assertEqual([res["result"]["status"] for res in results], [3] * 5)
+        self.assertEqual(len(self._server.hits), 1)
+
+    def test_cancelled_leader(self):
+        async def fetch():
+            leader = asyncio.ensure_future(asyncio.wait_for(
+                api.http_downloader(self.base + "/slow").download_async(), 0.05))
+            await asyncio.sleep(0)
+            follower = api.http_downloader(self.base + "/slow").download_async()
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(fetch())
+
+        self.assertIsInstance(leader, asyncio.TimeoutError)
+        self.assertEqual(follower, b'{"result": {"status": 3}}')
+        self.assertEqual(len(self._server.hits), 1)
+
+
+class AsyncTestCase(LocalServerTestCase):
+    def setUp(self):
+        super(AsyncTestCase, self).setUp()
+        self.pool = aio.connection_pool(max_connections=2)
+        api.async_transport.set(self.pool)
+
+    def tearDown(self):
+        api.async_transport.set(None)
+        super(AsyncTestCase, self).tearDown()
+
+    def _run(self, coro):
+        return asyncio.run(coro)
+
+    def test_call_async(self):
+        async def fetch():
+            return await asyncio.gather(*[api.method_result(self.base + "/json?i=" + str(i)).call_async()
+                                          for i in range(10)])
+
+        results = self._run(fetch())
+        self.assertEqual([res["result"]["status"] for res in results], [1] * 10)
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["requests"], 10)
+        self.assertLessEqual(stats["created"], 2)
+        self.assertEqual(stats["busy"], 0)
+
+    def test_call_async_value(self):
+        value = object()
+        self.assertIs(self._run(api.method_result(self.base + "/json").call_async(value)), value)
+
+    def test_redirect(self):
+        dl = api.http_downloader(self.base + "/moved")
+        self.assertEqual(self._run(dl.download_async()), b'{"result": {"status": 1}}')
+        self.assertEqual(dl.last_modified, "Sat, 01 Jan 2000 00:00:00 GMT")
+
+    def test_error_mapping(self):
+        self.assertRaises(api.HTTPFileNotFoundError, self._run,
+                          api.http_downloader(self.base + "/missing").download_async())
+        self.assertRaises(api.HTTPError, self._run,
+                          api.http_downloader(self.base + "/error").download_async())
+
+    def test_bad_url(self):
+        for url in ("http:///x", "http://127.0.0.1:port/x"):
+            self.assertRaises(api.HTTPError, self._run, self.pool.open(url, {}, 1))
+
+    def test_wait_timeout(self):
+        hostkey = ("http", "127.0.0.1", self._server.server_address[1])
+
+        async def fetch():
+            conns = [(await self.pool._acquire(hostkey, 1, {}))[0] for i in range(2)]
+
+            start = time.time()
+            with self.assertRaises(api.HTTPTimeoutError):
+                await self.pool._acquire(hostkey, 0.1, {})
+            waited = time.time() - start
+
+            # The slots are free again
+            for conn in conns:
+                await self.pool._release(hostkey, conn, False)
+            return waited, await api.http_downloader(self.base + "/json").download_async()
+
+        waited, body = self._run(fetch())
+        self.assertGreaterEqual(waited, 0.1)
+        self.assertEqual(body, b'{"result": {"status": 1}}')
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["waits"], 1)
+        self.assertEqual(stats["busy"], 0)
+
+    def test_disk_cache(self):
+        path = tempfile.mkdtemp()
+        threads = []
+
+        def hook(event, info):
+            if event == "cache":
+                threads.append(threading.current_thread())
+
+        api.cache.set(api.response_cache(path, ttl=60))
+        api.hooks.add(hook)
+        try:
+            for i in range(2):
+                dl = api.http_downloader(self.base + "/json")
+                self.assertEqual(self._run(dl.download_async()), b'{"result": {"status": 1}}')
+        finally:
+            api.hooks.remove(hook)
+            api.cache.set(None)
+            shutil.rmtree(path)
+
+        # The miss and the hit both read the disk tier off the loop
+        self.assertEqual(len(self._server.hits), 1)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_closed_on_shutdown(self):
+        self._run(api.http_downloader(self.base + "/json").download_async())
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["idle"], 0)
+        self.assertEqual(stats["discarded"], stats["created"])
+
+    def test_close(self):
+        async def fetch():
+            await api.http_downloader(self.base + "/json").download_async()
+            await self.pool.close()
+            return self.pool.stats()
+
+        self.assertEqual(self._run(fetch())["idle"], 0)
+
+    def test_proxy(self):
+        env = dict([(k, os.environ.get(k)) for k in ("http_proxy", "no_proxy")])
+        os.environ["http_proxy"] = self.base
+        os.environ["no_proxy"] = ""
+        install_opener(None)
+        try:
+            body = self._run(api.http_downloader("http://steamodd.invalid/json").download_async())
+        finally:
+            for k, v in env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            install_opener(None)
+
+        self.assertEqual(body, b'{"result": {"status": 1}}')
+        self.assertEqual(self._server.hits, ["http://steamodd.invalid/json"])
+        self.assertEqual(self.pool.stats()["requests"], 0)
@@ -0,0 +1,39 @@
+"""
+Benchmark figures stored per interpreter in a JSON file next to the
+benchmarks, for gating against them.
+"""
+
+import json
+import platform
+import sys
+
+
+def interpreter():
+    """ Baselines are kept per interpreter since they differ a lot """
+    return "{0}-{1}.{2}".format(platform.python_implementation().lower(),
+                                *sys.version_info[:2])
+
+
+def load(path):
+    """ Returns the figures in 'path' for this interpreter, empty if
+    there are none """
+    try:
+        with open(path) as f:
+            return json.load(f).get(interpreter(), {})
+    except EnvironmentError:
+        return {}
+
+
+def update(path, results):
+    """ Stores 'results' in 'path' as this interpreter's figures """
+    try:
+        with open(path) as f:
+            baselines = json.load(f)
+    except EnvironmentError:
+        baselines = {}
+
+    baselines[interpreter()] = results
+
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, separators=(",", ": "), sort_keys=True)
+        f.write("\n")
@@ -0,0 +1,84 @@
+"""
+Canned responses for tests that mustn't go out to the network, served
+through 'api.transport' with a test API key set.
+"""
+
+import unittest
+import contextlib
+import io
+import json
+import threading
+from steam import api
+
+try:
+    from http.client import responses
+except ImportError:
+    from httplib import responses
+
+
+class canned_transport(object):
+    """ Serves what 'respond' returns for the URL of each request, a
+    status code and a body. Bodies other than bytes are sent as JSON.
+    'headers' go along with every response. The URLs requested are
+    kept in 'urls'. """
+
+    def __init__(self, respond, headers=None):
+        self.respond = respond
+        self.headers = headers or {}
+        self.urls = []
+        self._lock = threading.Lock()
+
+    @property
+    def requests(self):
+        return len(self.urls)
+
+    def open(self, url, headers, timeout):
+        with self._lock:
+            self.urls.append(url)
+
+        code, body = self.respond(url)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+
+        return api.http_response(code, responses.get(code, ''), dict(self.headers),
+                                 io.BytesIO(body))
+
+
+@contextlib.contextmanager
+def serving(transport):
+    """ Sends requests through 'transport' with a test API key set,
+    putting back the old transport and key afterwards """
+    old = api.transport.get()
+    # Not key.get, that falls back on the environment
+    key = api.key._key__api_key
+    api.transport.set(transport)
+    api.key.set("TESTKEY")
+
+    try:
+        yield transport
+    finally:
+        api.transport.set(old)
+        api.key._key__api_key = key
+
+
+class CannedTestCase(unittest.TestCase):
+    """ Tests served by their 'respond' method, see 'canned_transport'.
+    The transport is kept in 'server'. """
+
+    headers = None
+
+    def respond(self, url):
+        return 404, b''
+
+    def serve(self, respond):
+        """ Serves further requests from 'respond' instead """
+        self.server = canned_transport(respond, self.headers)
+        api.transport.set(self.server)
+        return self.server
+
+    def setUp(self):
+        self._serving = serving(canned_transport(self.respond, self.headers))
+        self.server = self._serving.__enter__()
+
+    def tearDown(self):
+        self._serving.__exit__(None, None, None)
@@ -0,0 +1,68 @@
+"""
+Item attributes as they were resolved before the attribute overlay, kept
+as the reference testitemsbench compares against. Every attribute of
+every item gets a copy of the schema's definition, made when the item is.
+"""
+
+from steam import items
+
+
+def _attribute_definition(schema, attrid):
+    """ Returns the attribute definition dict of a given attribute
+    ID, can be the name or the integer ID """
+    attrs = schema._schema["attributes"]
+
+    try:
+        # Make a new dict to avoid side effects
+        return dict(attrs[attrid])
+    except KeyError:
+        attr_names = schema._schema["attribute_names"]
+        attrdef = attrs.get(attr_names.get(str(attrid).lower()))
+
+        if not attrdef:
+            return None
+        else:
+            return dict(attrdef)
+
+
+class item(items.item):
+    """ 'items.item' with its attributes copied from the schema up front """
+
+    def __init__(self, item, schema=None):
+        items.item.__init__(self, item, schema)
+        self._attribute_values = self._resolve_attributes()
+
+    def _resolve_attributes(self):
+        schema = self._schema
+        attributes = {}
+
+        for attr in self._schema_item.get("attributes", []):
+            index = attr.get("defindex", attr.get("name"))
+            attrdef = None
+
+            if schema:
+                attrdef = _attribute_definition(schema, index)
+                if attrdef:
+                    index = attrdef["defindex"]
+
+            attributes.setdefault(index, {})
+
+            if attrdef:
+                attributes[index].update(attrdef)
+
+            attributes[index].update(attr)
+
+        if self._item != self._schema_item:
+            for attr in self._item.get("attributes", []):
+                index = attr["defindex"]
+
+                if schema and index not in attributes:
+                    attrdef = _attribute_definition(schema, index)
+
+                    if attrdef:
+                        attributes[index] = attrdef
+
+                attributes.setdefault(index, {})
+                attributes[index].update(attr)
+
+        return attributes
@@ -0,0 +1,626 @@
+import unittest
+import os
+import sys
+import socket
+import threading
+import time
+import shutil
+import tempfile
+import zlib
+import gzip
+import io
+import json
+from steam import api
+
+try:
+    from urllib.request import install_opener
+except ImportError:
+    from urllib2 import install_opener
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # Proxied requests carry the whole URL
+        path = self.path.split('?')[0].split("//", 1)[-1]
+        if path != self.path.split('?')[0]:
+            path = '/' + path.split('/', 1)[-1]
+        route = self.server.routes.get(path, (404, b'', {}))
+
+        # Lists are served in sequence, repeating the last one
+        if isinstance(route, list):
+            route = route.pop(0) if len(route) > 1 else route[0]
+
+        status, body, head = route[:3]
+
+        if len(route) > 3:
+            time.sleep(route[3])
+
+        self.server.hits.append(self.path)
+        self.server.last_headers = self.headers
+
+        etag = head.get("ETag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b''
+
+        self.send_response(status)
+        for k, v in head.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """ Runs a local HTTP/1.1 server so the core can be tested offline """
+
+    ROUTES = {
+            "/json": (200, b'{"result": {"status": 1}}', {"Last-Modified": "Sat, 01 Jan 2000 00:00:00 GMT"}),
+            "/etag": (200, b'{"result": {"status": 2}}', {"ETag": '"v1"'}),
+            "/moved": (302, b'', {"Location": "/json"}),
+            "/error": (500, b'oops', {}),
+            "/slow": (200, b'{"result": {"status": 3}}', {}, 0.2),
+            "/flaky": [(503, b'', {"Retry-After": "0"}), (429, b'', {}), (200, b'{}', {})]
+            }
+
+    def setUp(self):
+        self._server = _server(("127.0.0.1", 0), _handler)
+        self._server.routes = dict([(k, list(v) if isinstance(v, list) else v)
+                                     for k, v in self.ROUTES.items()])
+        self._server.hits = []
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        self.base = "http://127.0.0.1:{0}".format(self._server.server_address[1])
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ConnectionPoolTestCase(LocalServerTestCase):
+    def setUp(self):
+        super(ConnectionPoolTestCase, self).setUp()
+        self.pool = api.connection_pool(max_connections=2, idle_timeout=30)
+
+    def tearDown(self):
+        self.pool.clear()
+        super(ConnectionPoolTestCase, self).tearDown()
+
+    def test_keepalive_reuse(self):
+        for i in range(5):
+            res = api.method_result(self.base + "/json", transport=self.pool)
+            self.assertEqual(res["result"]["status"], 1)
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 4)
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["busy"], 0)
+
+    def test_redirect(self):
+        dl = api.http_downloader(self.base + "/moved", transport=self.pool)
+        self.assertEqual(dl.download(), b'{"result": {"status": 1}}')
+        self.assertEqual(dl.last_modified, "Sat, 01 Jan 2000 00:00:00 GMT")
+
+    def test_error_mapping(self):
+        self.assertRaises(api.HTTPFileNotFoundError,
+                          api.http_downloader(self.base + "/missing", transport=self.pool).download)
+        self.assertRaises(api.HTTPError,
+                          api.http_downloader(self.base + "/error", transport=self.pool).download)
+        self.assertEqual(self.pool.stats()["created"], 1)
+
+    def test_idle_timeout(self):
+        pool = api.connection_pool(idle_timeout=0)
+        api.http_downloader(self.base + "/json", transport=pool).download()
+        api.http_downloader(self.base + "/json", transport=pool).download()
+
+        stats = pool.stats()
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(stats["reused"], 0)
+        pool.clear()
+
+    def test_max_connections(self):
+        def fetch(i):
+            api.http_downloader(self.base + "/json?i=" + str(i), transport=self.pool).download()
+
+        threads = [threading.Thread(target=fetch, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["requests"], 8)
+        self.assertLessEqual(stats["created"], 2)
+
+    def test_wait_timeout(self):
+        pool = api.connection_pool(max_connections=1)
+        hostkey = ("http", "127.0.0.1", self._server.server_address[1])
+        conn = pool._acquire(hostkey, 1)[0]
+
+        start = time.time()
+        self.assertRaises(api.HTTPTimeoutError, pool._acquire, hostkey, 0.1)
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual(pool.stats()["waits"], 1)
+
+        # The slot is free again
+        pool._release(hostkey, conn, False)
+        dl = api.http_downloader(self.base + "/json", transport=pool)
+        self.assertEqual(dl.download(), b'{"result": {"status": 1}}')
+        self.assertEqual(pool.stats()["busy"], 0)
+        pool.clear()
+
+    def test_connection_refused(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = "http://127.0.0.1:{0}/json".format(sock.getsockname()[1])
+        sock.close()
+
+        for transport in (self.pool, api.urllib_transport()):
+            self.assertRaises(api.HTTPTimeoutError,
+                              api.http_downloader(url, transport=transport).download)
+        self.assertEqual(self.pool.stats()["busy"], 0)
+
+    def test_bad_url(self):
+        pool = api.connection_pool(max_connections=1)
+
+        for url in ("http:///x", "http://127.0.0.1:port/x"):
+            self.assertRaises(api.HTTPError, api.http_downloader(url, transport=pool).download)
+
+        # Opening the connection fails after the slot is taken
+        self.assertRaises(api.HTTPError, pool._acquire, ("http", None, 80), 1)
+
+        dl = api.http_downloader(self.base + "/json", transport=pool)
+        self.assertEqual(dl.download(), b'{"result": {"status": 1}}')
+        self.assertEqual(pool.stats()["busy"], 0)
+        pool.clear()
+
+    def test_proxy(self):
+        env = dict([(k, os.environ.get(k)) for k in ("http_proxy", "no_proxy")])
+        os.environ["http_proxy"] = self.base
+        os.environ["no_proxy"] = ""
+        # urllib reads the proxies once, when it builds its opener
+        install_opener(None)
+        try:
+            dl = api.http_downloader("http://steamodd.invalid/json", transport=self.pool)
+            self.assertEqual(dl.download(), b'{"result": {"status": 1}}')
+        finally:
+            for k, v in env.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            install_opener(None)
+
+        self.assertEqual(self._server.hits, ["http://steamodd.invalid/json"])
+        self.assertEqual(self.pool.stats()["requests"], 0)
+
+    def test_urllib_transport(self):
+        dl = api.http_downloader(self.base + "/moved", transport=api.urllib_transport())
+        self.assertEqual(dl.download(), b'{"result": {"status": 1}}')
+        self.assertRaises(api.HTTPFileNotFoundError,
+                          api.http_downloader(self.base + "/missing", transport=api.urllib_transport()).download)
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb")
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+class CompressionTestCase(LocalServerTestCase):
+    BODY = b'{"result": {"items": [' + b','.join([b'{"defindex": 5021}'] * 2000) + b']}}'
+    ROUTES = {
+            "/gzip": (200, _gzip(BODY), {"Content-Encoding": "gzip"}),
+            "/deflate": (200, zlib.compress(BODY), {"Content-Encoding": "deflate"}),
+            "/rawdeflate": (200, zlib.compress(BODY)[2:-4], {"Content-Encoding": "deflate"}),
+            "/plain": (200, BODY, {})
+            }
+
+    def tearDown(self):
+        api.compression.set(True)
+        super(CompressionTestCase, self).tearDown()
+
+    def test_accept_encoding(self):
+        api.http_downloader(self.base + "/plain").download()
+        self.assertEqual(self._server.last_headers.get("Accept-Encoding"), "gzip, deflate")
+
+        api.compression.set(False)
+        api.http_downloader(self.base + "/plain").download()
+        self.assertIn(self._server.last_headers.get("Accept-Encoding"), (None, "identity"))
+
+    def test_decode(self):
+        for path in ("/gzip", "/deflate", "/rawdeflate", "/plain"):
+            self.assertEqual(api.http_downloader(self.base + path).download(), self.BODY)
+            self.assertEqual(len(api.method_result(self.base + path)["result"]["items"]), 2000)
+
+    def test_streamed_decode(self):
+        res = api.transport.get().open(self.base + "/gzip", {}, 5)
+        chunks = []
+        while True:
+            chunk = res.read(1000)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 1000)
+            chunks.append(chunk)
+        self.assertEqual(b''.join(chunks), self.BODY)
+
+
+class JSONStreamTestCase(LocalServerTestCase):
+    DOC = {"result": {"status": 1,
+                      "skip": [{"a": "}]\\\"[{"}, [1, 2, [3]], "x"],
+                      "empty": {},
+                      "items": [{"defindex": i, "name": u"\u00e9t\u00e9 \"{%d}\"" % i,
+                                 "attributes": [{"value": 1.5e3}, None, True]} for i in range(50)]}}
+    ROUTES = {
+            "/doc": (200, json.dumps(DOC).encode("utf-8"), {}),
+            "/gzipdoc": (200, _gzip(json.dumps(DOC).encode("utf-8")), {"Content-Encoding": "gzip"})
+            }
+
+    def test_chunk_boundaries(self):
+        raw = json.dumps(self.DOC, ensure_ascii=False, indent=1).encode("utf-8")
+
+        for chunk_size in (1, 2, 3, 7, 64, 4096):
+            entries = list(api._json_stream(io.BytesIO(raw), chunk_size).iter_array(("result", "items")))
+            self.assertEqual(entries, self.DOC["result"]["items"])
+
+        self.assertEqual(list(api._json_stream(io.BytesIO(raw), 5).iter_array(("result", "skip"))),
+                         self.DOC["result"]["skip"])
+
+        for chunk_size in (1, 3, 4096):
+            siblings = {}
+            api._json_stream(io.BytesIO(raw), chunk_size).iter_array(("result", "items"),
+                                                                     siblings=siblings)
+            self.assertEqual(siblings, {})
+            list(api._json_stream(io.BytesIO(raw), chunk_size).iter_array(("result", "items"),
+                                                                          siblings=siblings))
+            self.assertEqual(siblings, {"status": 1})
+
+    def test_missing_path(self):
+        raw = json.dumps(self.DOC).encode("utf-8")
+        self.assertRaises(KeyError, list, api._json_stream(io.BytesIO(raw)).iter_array(("result", "nope")))
+        self.assertRaises(ValueError, list, api._json_stream(io.BytesIO(raw[:200])).iter_array(("result", "items")))
+
+    def test_stream(self):
+        for path in ("/doc", "/gzipdoc"):
+            res = api.method_result(self.base + path)
+            self.assertEqual(list(res.stream("result", "items")), self.DOC["result"]["items"])
+            self.assertFalse(res._fetched)
+
+    def test_interning(self):
+        api.interning.set(True)
+        try:
+            entries = list(api.method_result(self.base + "/doc").stream("result", "items"))
+            res = api.method_result(self.base + "/doc", aggressive=True)
+        finally:
+            api.interning.set(False)
+
+        self.assertEqual(entries, self.DOC["result"]["items"])
+        self.assertEqual(res, self.DOC)
+
+        keys = [[k for k in entry if k == "defindex"][0] for entry in entries]
+        self.assertTrue(all([k is keys[0] for k in keys]))
+
+
+class HooksTestCase(LocalServerTestCase):
+    def setUp(self):
+        super(HooksTestCase, self).setUp()
+        self.events = []
+        self.metrics = api.metrics()
+        self._hook = lambda event, info: self.events.append((event, dict(info)))
+        api.hooks.add(self._hook)
+        api.hooks.add(self.metrics)
+
+    def tearDown(self):
+        api.hooks.remove(self._hook)
+        api.hooks.remove(self.metrics)
+        super(HooksTestCase, self).tearDown()
+
+    def test_endpoint(self):
+        self.assertEqual(api.endpoint("http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v2?key=1"),
+                         "ISteamUser.GetPlayerSummaries")
+        self.assertEqual(api.endpoint("http://steamcommunity.com/profiles/1/inventory/"), "steamcommunity.com")
+
+    def test_events(self):
+        api.method_result(self.base + "/json").call()
+        self.assertRaises(api.HTTPFileNotFoundError, api.http_downloader(self.base + "/missing").download)
+
+        names = [event for event, info in self.events]
+        self.assertEqual(names, ["request_start", "request_end", "decode", "request_start", "request_end"])
+
+        end = self.events[1][1]
+        self.assertEqual(end["status"], 200)
+        self.assertEqual(end["bytes"], len(self.ROUTES["/json"][1]))
+        self.assertEqual(end["error"], None)
+        self.assertTrue("ttfb" in end["timings"] and "body" in end["timings"])
+        self.assertTrue(isinstance(self.events[4][1]["error"], api.HTTPFileNotFoundError))
+
+    def test_cache_events(self):
+        cache = api.response_cache(ttl=60)
+        api.http_downloader(self.base + "/json", cache=cache).download()
+        api.http_downloader(self.base + "/json", cache=cache).download()
+        results = [info["result"] for event, info in self.events if event == "cache"]
+        self.assertEqual(results, ["miss", "hit"])
+
+    def test_broken_hook(self):
+        def broken(event, info):
+            raise RuntimeError
+        api.hooks.add(broken)
+        try:
+            api.http_downloader(self.base + "/json").download()
+        finally:
+            api.hooks.remove(broken)
+
+    def test_metrics(self):
+        for i in range(3):
+            api.method_result(self.base + "/json").call()
+        self.assertRaises(api.HTTPError, api.http_downloader(self.base + "/error").download)
+
+        stats = self.metrics.snapshot()["127.0.0.1"]
+        self.assertEqual(stats["requests"], 4)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["status"], {200: 3, 500: 1})
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["latency"]["count"], 4)
+        self.assertEqual(stats["latency"]["buckets"][-1], ("+Inf", 4))
+        self.assertEqual(stats["decode"]["count"], 3)
+
+    def test_histogram(self):
+        hist = api.latency_histogram((1, 0.1))
+        for value in (0.05, 0.1, 0.5, 3):
+            hist.observe(value)
+        self.assertEqual(hist.snapshot()["buckets"], [(0.1, 2), (1, 3), ("+Inf", 4)])
+
+
+class CoalescingTestCase(LocalServerTestCase):
+    def tearDown(self):
+        api.coalescing.set(True)
+        super(CoalescingTestCase, self).tearDown()
+
+    def _fetch_concurrently(self, path, count=5, distinct_keys=False):
+        results = [None] * count
+
+        def fetch(i):
+            key = str(i) if distinct_keys else "TESTKEY"
+            try:
+                results[i] = api.method_result(self.base + path + "?key=" + key)["result"]["status"]
+            except api.APIError as E:
+                results[i] = E
+
+        threads = [threading.Thread(target=fetch, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_shared_fetch(self):
+        self.assertEqual(self._fetch_concurrently("/slow"), [3] * 5)
+        self.assertEqual(len(self._server.hits), 1)
+
+    def test_shared_error(self):
+        self._server.routes["/slow"] = (500, b'', {}, 0.2)
+        results = self._fetch_concurrently("/slow")
+        self.assertEqual(len(self._server.hits), 1)
+        self.assertTrue(all([res is results[0] for res in results]))
+        self.assertTrue(isinstance(results[0], api.HTTPError))
+
+    def test_distinct_keys(self):
+        self.assertEqual(self._fetch_concurrently("/slow", distinct_keys=True), [3] * 5)
+        self.assertEqual(len(self._server.hits), 5)
+
+    def test_disabled(self):
+        api.coalescing.set(False)
+        self._fetch_concurrently("/slow")
+        self.assertEqual(len(self._server.hits), 5)
+
+
+class ResponseCacheTestCase(LocalServerTestCase):
+    def setUp(self):
+        super(ResponseCacheTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(ResponseCacheTestCase, self).tearDown()
+
+    def _fetch(self, cache, path="/etag", **kwargs):
+        return api.method_result(self.base + path, cache=cache, **kwargs)["result"]["status"]
+
+    def test_canonical_url(self):
+        self.assertEqual(api.response_cache.canonical_url("http://HOST/a?key=1&b=2&a=1"),
+                         api.response_cache.canonical_url("http://host/a?a=1&key=2&b=2"))
+
+    def test_fresh_hit(self):
+        cache = api.response_cache(ttl=60)
+        self.assertEqual(self._fetch(cache), 2)
+        self.assertEqual(self._fetch(cache), 2)
+        self.assertEqual(len(self._server.hits), 1)
+
+    def test_revalidate(self):
+        cache = api.response_cache(ttl=0)
+        self.assertEqual(self._fetch(cache), 2)
+        self.assertEqual(self._fetch(cache), 2)
+        self.assertEqual(len(self._server.hits), 2)
+
+    def test_disk_tier(self):
+        self._fetch(api.response_cache(self.path, ttl=60), "/json")
+        self.assertEqual(self._fetch(api.response_cache(self.path, ttl=60), "/json"), 1)
+        self.assertEqual(len(self._server.hits), 1)
+
+    def test_touch(self):
+        self._fetch(api.response_cache(self.path, ttl=60))
+        filename = os.path.join(self.path, os.listdir(self.path)[0])
+        os.utime(filename, (1000000000, 1000000000))
+        inode = os.stat(filename).st_ino
+
+        # Stale after a restart, the 304 only moves its stored time
+        self.assertEqual(self._fetch(api.response_cache(self.path, ttl=60)), 2)
+        self.assertEqual(os.stat(filename).st_ino, inode)
+        self.assertGreater(os.stat(filename).st_mtime, 1000000000)
+
+        self.assertEqual(self._fetch(api.response_cache(self.path, ttl=60)), 2)
+        self.assertEqual(len(self._server.hits), 2)
+
+    def test_touch_evicted(self):
+        cache = api.response_cache(self.path, ttl=0)
+        self._fetch(cache)
+        cache.clear()
+        cache.touch(self.base + "/etag", api._cache_entry(b'{}', etag='"v1"'))
+        self.assertEqual(api.response_cache(self.path).get(self.base + "/etag").body, b'{}')
+
+    def test_memory_eviction(self):
+        cache = api.response_cache(max_memory=30, ttl=60)
+        self._fetch(cache, "/json")
+        self._fetch(cache, "/etag")
+        self._fetch(cache, "/json")
+        self.assertEqual(len(self._server.hits), 3)
+
+    def test_disk_eviction(self):
+        cache = api.response_cache(self.path, ttl=60, max_disk=20000)
+        scans = []
+        evict = cache._evict_disk
+        cache._evict_disk = lambda: scans.append(evict())
+
+        for i in range(150):
+            cache.set("http://host/a?i=" + str(i), b'x' * 200)
+
+        total = sum([os.path.getsize(os.path.join(self.path, name))
+                     for name in os.listdir(self.path)])
+        self.assertLessEqual(total, 20000)
+        self.assertEqual(cache._disk_size, total)
+        self.assertLess(len(scans), 20)
+
+    def test_foreign_files(self):
+        foreign = os.path.join(self.path, "notes.txt")
+        with open(foreign, "wb") as f:
+            f.write(b'x' * 20000)
+
+        cache = api.response_cache(self.path, ttl=60, max_disk=20000)
+        cache.set("http://host/a", b'x' * 200)
+        self.assertTrue(os.path.exists(foreign))
+        self.assertTrue(cache.get("http://host/a"))
+
+        leftover = cache._filename("http://host/b") + ".1.2.tmp"
+        open(leftover, "wb").close()
+        cache.clear()
+        self.assertEqual(os.listdir(self.path), ["notes.txt"])
+
+    def test_explicit_since(self):
+        cache = api.response_cache(ttl=60)
+        self._fetch(cache, "/json")
+        self.assertRaises(api.HTTPFileNotFoundError, self._fetch, cache, "/missing",
+                          last_modified="Sat, 01 Jan 2000 00:00:00 GMT")
+        self._fetch(cache, "/json", last_modified="Sat, 01 Jan 2000 00:00:00 GMT")
+        self.assertEqual(len(self._server.hits), 3)
+
+
+class RetryTestCase(LocalServerTestCase):
+    def tearDown(self):
+        api.retry.set(None)
+        api.rate_limit.set(None)
+        super(RetryTestCase, self).tearDown()
+
+    def test_no_retry(self):
+        try:
+            api.http_downloader(self.base + "/flaky").download()
+        except api.HTTPError as E:
+            self.assertEqual(E.code, 503)
+            self.assertEqual(E.retry_after, 0)
+        else:
+            self.fail("HTTPError not raised")
+
+    def test_retry(self):
+        api.retry.set(api.retry_policy(attempts=2, backoff=0.01))
+        self.assertEqual(api.http_downloader(self.base + "/flaky").download(), b'{}')
+        self.assertEqual(len(self._server.hits), 3)
+
+    def test_retry_exhausted(self):
+        api.retry.set(api.retry_policy(attempts=1, backoff=0.01))
+        self.assertRaises(api.HTTPError, api.http_downloader(self.base + "/flaky").download)
+        self.assertRaises(api.HTTPFileNotFoundError, api.http_downloader(self.base + "/missing").download)
+        self.assertEqual(len(self._server.hits), 3)
+
+    def test_policy_delay(self):
+        policy = api.retry_policy(attempts=3, backoff=1, max_backoff=3)
+        self.assertTrue(0.5 <= policy.delay(0, api.HTTPError('', 503)) <= 1)
+        self.assertTrue(1.5 <= policy.delay(2, api.HTTPError('', 503)) <= 3)
+        self.assertEqual(policy.delay(0, api.HTTPError('', 503, retry_after=10)), 10)
+        self.assertTrue(policy.delay(0, api.HTTPTimeoutError('')) is not None)
+        self.assertEqual(policy.delay(3, api.HTTPError('', 503)), None)
+        self.assertEqual(policy.delay(0, api.HTTPFileNotFoundError('', 404)), None)
+
+    def test_rate_limiter(self):
+        limiter = api.rate_limiter(rate=10, burst=2, overrides={"IEconItems_440": (1, 1)})
+        url = "http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v2"
+        self.assertEqual(limiter.reserve(url), 0)
+        self.assertEqual(limiter.reserve(url), 0)
+        self.assertAlmostEqual(limiter.reserve(url), 0.1, places=2)
+
+        items_url = "http://api.steampowered.com/IEconItems_440/GetSchema/v1"
+        self.assertEqual(limiter.reserve(items_url), 0)
+        self.assertAlmostEqual(limiter.reserve(items_url), 1, places=2)
+
+        limiter.throttle(url, 5)
+        self.assertAlmostEqual(limiter.reserve(url), 5.1, places=1)
+
+
+class AtomicWriteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_write(self):
+        filename = os.path.join(self.path, "file")
+        api._atomic_write(filename, lambda f: f.write(b"one"))
+        api._atomic_write(filename, lambda f: f.write(b"two"))
+
+        def fail(f):
+            f.write(b"three")
+            raise ValueError("oops")
+
+        self.assertRaises(ValueError, api._atomic_write, filename, fail)
+        self.assertEqual(["file"], os.listdir(self.path))
+        with open(filename, "rb") as f:
+            self.assertEqual(b"two", f.read())
+
+
+@unittest.skipIf(sys.version_info >= (3, 7), "Awaitables are supported")
+class AsyncUnsupportedTestCase(unittest.TestCase):
+    def test_unsupported(self):
+        self.assertRaises(RuntimeError, api.async_interface, "ISteamUser")
+        self.assertRaises(RuntimeError, api.http_downloader("http://127.0.0.1/").download_async)
+
+
+def load_tests(loader, tests, pattern):
+    # Coroutines don't parse on python 2 and aio needs 3.7 or newer
+    if sys.version_info >= (3, 7):
+        try:
+            from . import aiotests
+        except (ImportError, ValueError):
+            import aiotests
+        tests.addTests(loader.loadTestsFromModule(aiotests))
+
+    return tests
@@ -1,8 +1,19 @@
 import unittest
+import operator
 import re
+import json
+import os
+import shutil
+import tempfile
+from steam import api
 from steam import items
 from steam import sim
 
+try:
+    from .canned import CannedTestCase
+except (ImportError, ValueError):
+    from canned import CannedTestCase
+
 class BaseTestCase(unittest.TestCase):
     TEST_APP = (440, 'en_US')     # TF2 English catalog
     ITEM_IN_CATALOG = 344         # Crocleather Slouch
@@ -126,3 +137,304 @@ class ItemTestCase(InventoryBaseTestCase):
 class InventoryTestCase(InventoryBaseTestCase):
     def test_cell_count(self):
         self.assertLessEqual(len(list(self._inv)), self._inv.cells_total)
+
+
+class SimSectionTestCase(CannedTestCase):
+    """ Against canned SIM inventory sections, section 3 is broken """
+
+    CONTEXT = {"appid": 753, "rgContexts": {
+        "1": {"id": "1", "name": "Gifts", "asset_count": 1},
+        "2": {"id": "2", "name": "Coupons", "asset_count": 1},
+        "3": {"id": "3", "name": "Broken", "asset_count": 1},
+        "6": {"id": "6", "name": "Cards", "asset_count": 1}
+        }}
+
+    def respond(self, url):
+        sec = url.rstrip('/').split('/')[-1]
+        if sec == "3":
+            return 500, b''
+
+        return 200, {
+            "rgInventory": {sec + "1": {"id": sec + "1", "classid": "1", "instanceid": "0", "amount": "1", "pos": 1}},
+            "rgDescriptions": {"1_0": {"name": "Section " + sec}}
+            }
+
+    def test_concurrent_sections(self):
+        inv = sim.inventory(self.CONTEXT, BaseTestCase.TEST_ID64, workers=4)
+        self.assertEqual([item.id for item in inv], [11, 21, 61])
+        self.assertEqual(list(inv.section_errors.keys()), ["3"])
+        self.assertTrue(isinstance(inv.section_errors["3"], api.HTTPError))
+
+    def test_sequential_sections(self):
+        inv = sim.inventory(self.CONTEXT, BaseTestCase.TEST_ID64)
+        self.assertRaises(api.HTTPError, len, inv)
+
+        inv = sim.inventory(self.CONTEXT, BaseTestCase.TEST_ID64, section=6)
+        self.assertEqual([item.name for item in inv], ["Section 6"])
+
+
+class InventoryStatusTestCase(CannedTestCase):
+    def respond(self, url):
+        return 200, {"result": {"status": self.status}}
+
+    def _check(self, status, error):
+        self.status = status
+        inv = items.inventory(440, BaseTestCase.TEST_ID64)
+
+        self.assertRaises(error, len, inv)
+        self.assertRaises(error, list, inv.stream())
+
+    def test_bad_id64(self):
+        self._check(8, items.BadID64Error)
+
+    def test_private(self):
+        self._check(15, items.ProfilePrivateError)
+
+    def test_incomplete(self):
+        self._check(1, items.InventoryError)
+
+
+class SchemaBaseTestCase(CannedTestCase):
+    """ Against a tiny canned schema, and 'inventory' if it's set """
+
+    SCHEMA = {"result": {
+        "status": 1,
+        "items_game_url": "http://example.com/items_game.txt",
+        "qualities": {"normal": 0, "unique": 6, "strange": 11},
+        "qualityNames": {"normal": "Normal", "unique": "Unique", "strange": "Strange"},
+        "originNames": [{"origin": 0, "name": "Timed Drop"}],
+        "attributes": [{"defindex": 142, "name": "set item tint RGB", "effect_type": "positive",
+                        "description_format": "value_is_additive", "stored_as_integer": False}],
+        "attribute_controlled_attached_particles": [{"id": 4, "name": "Community Sparkle"}],
+        "item_levels": [{"name": "KillEaterRank", "levels": [{"level": 0, "required_score": 0,
+                                                              "name": "Strange"}]}],
+        "kill_eater_score_types": [{"type": 0, "type_name": "Kills"}],
+        "items": [{"defindex": 344, "item_name": "Crocleather Slouch", "item_quality": 6,
+                   "used_by_classes": ["Sniper"],
+                   "attributes": [{"name": "set item tint RGB", "value": 1}]}]
+        }}
+
+    headers = {"last-modified": "Tue, 01 Jan 2013 00:00:00 GMT"}
+
+    def respond(self, url):
+        if self.inventory is not None and "GetPlayerItems" in url:
+            return 200, self.inventory
+
+        schema = json.loads(json.dumps(self.SCHEMA))
+        schema["result"]["items"][0]["item_name"] = self.item_name
+        return 200, schema
+
+    def setUp(self):
+        super(SchemaBaseTestCase, self).setUp()
+        self.item_name = "Crocleather Slouch"
+        self.inventory = None
+        self._schema = items.schema(440, "en_US")
+
+
+class SchemaSnapshotTestCase(SchemaBaseTestCase):
+    def setUp(self):
+        super(SchemaSnapshotTestCase, self).setUp()
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "schema.snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+        super(SchemaSnapshotTestCase, self).tearDown()
+
+    def test_round_trip(self):
+        fetched = items.schema(440, "en_US")
+        fetched.save(self._path)
+        self.assertEqual(1, self.server.requests)
+
+        loaded = items.schema(440, "en_US")
+        loaded.load(self._path)
+        self.assertEqual([344], list(loaded._schema["items"]))
+        self.assertEqual({}, loaded._schema["items"]._values)
+        self.assertEqual(fetched._schema, loaded._schema)
+        self.assertEqual("Tue, 01 Jan 2013 00:00:00 GMT", loaded.last_modified)
+        self.assertEqual((6, "unique", "Unique"), loaded._quality_definition(6))
+        self.assertEqual("Crocleather Slouch", loaded[344].name)
+        self.assertEqual(1, self.server.requests)
+
+    def test_mismatch(self):
+        items.schema(440, "en_US").save(self._path)
+
+        self.assertRaises(items.SchemaError, items.schema(570, "en_US").load, self._path)
+        self.assertRaises(items.SchemaError, items.schema(440, "de_DE").load, self._path)
+
+        with open(self._path, "r+b") as f:
+            f.truncate(20)
+        self.assertRaises(items.SchemaError, items.schema(440, "en_US").load, self._path)
+
+        with open(self._path, "wb") as f:
+            f.write(b"VDFC\x01 not a schema")
+        self.assertRaises(items.SchemaError, items.schema(440, "en_US").load, self._path)
+
+    def test_stale(self):
+        items.schema(440, "en_US").save(self._path)
+
+        # Written by another minor version of python, then another marshal
+        for offset in (6, 7):
+            with open(self._path, "r+b") as f:
+                f.seek(offset)
+                f.write(b"\x00")
+
+            with open(self._path, "rb") as f:
+                written = f.read()
+
+            requests = self.server.requests
+            loaded = items.schema(440, "en_US")
+            self.assertRaises(items.SchemaError, loaded.load, self._path)
+            self.assertRaises(items.SchemaError, loaded.attach, self._path)
+
+            # Neither downloaded nor written again
+            self.assertEqual(requests, self.server.requests)
+            with open(self._path, "rb") as f:
+                self.assertEqual(written, f.read())
+
+    def test_attach(self):
+        items.schema(440, "en_US").save(self._path)
+
+        worker = items.schema(440, "en_US")
+        worker.attach(self._path, interval=0)
+        self.assertEqual("Crocleather Slouch", worker[344].name)
+        self.assertEqual((6, "unique", "Unique"), worker._quality_definition("Unique"))
+        self.assertEqual({}, worker._schema["items"]._values)
+        self.assertEqual({}, worker._schema["qualities"]._values)
+
+        # The parent swaps in an update
+        self.item_name = "Crocleather Slouch 2"
+        items.schema(440, "en_US").save(self._path)
+        self.assertEqual("Crocleather Slouch 2", worker[344].name)
+
+        # A broken replacement is ignored
+        with open(self._path + ".tmp", "wb") as f:
+            f.write(b"SOSC\x01 broken")
+        getattr(os, "replace", os.rename)(self._path + ".tmp", self._path)
+        self.assertEqual("Crocleather Slouch 2", worker[344].name)
+        self.assertEqual(2, self.server.requests)
+
+
+class ItemAttributeLayerTestCase(SchemaBaseTestCase):
+    def test_layers(self):
+        definition = dict(self._schema._attribute_definition(142))
+        item = items.item({"id": 1, "defindex": 344, "quality": 6,
+                           "attributes": [{"defindex": 142, "value": 5, "float_value": 0.5}]},
+                          self._schema)
+        attr = item[142]
+
+        self.assertEqual(5, attr.value_int)
+        self.assertEqual("set item tint RGB", attr.name)
+        self.assertEqual("positive", attr.type)
+        self.assertEqual(0.5, item._attributes[142]["float_value"])
+        self.assertEqual(set(definition) | set(["value", "float_value"]),
+                         set(item._attributes[142]))
+        self.assertEqual(definition, self._schema._attribute_definition(142))
+        self.assertEqual(1, self._schema[344][142].value)
+
+    def test_index(self):
+        item = items.item({"id": 1, "defindex": 344, "quality": 6,
+                           "attributes": [{"defindex": 142, "value": 5},
+                                          {"defindex": 153, "value": 1}]},
+                          self._schema)
+        self.assertEqual(None, item._attribute_values)
+
+        self.assertTrue(142 in item)
+        self.assertTrue("set item tint RGB" in item)
+        self.assertTrue(153 in item)
+        self.assertFalse(154 in item)
+        self.assertFalse([142] in item)
+        self.assertTrue(item[142] is item["set item tint RGB"])
+        self.assertRaises(KeyError, item.__getitem__, "nope")
+        self.assertFalse(item.tradable)
+
+        attrs = item.attributes
+        attrs.pop()
+        self.assertEqual(2, len(item.attributes))
+        self.assertEqual([a.id for a in item.attributes], [a.id for a in item])
+
+
+class CompactItemTestCase(SchemaBaseTestCase):
+    PROPERTIES = ["attributes", "quality", "inventory_token", "position", "equipped",
+                  "equipable_classes", "schema_id", "name", "type", "icon", "image", "id",
+                  "original_id", "level", "slot_name", "cvar_class", "craft_class",
+                  "craft_material_type", "custom_name", "custom_description", "quantity",
+                  "description", "min_level", "max_level", "tradable", "craftable",
+                  "full_name", "kill_eaters", "rank", "available_styles", "style",
+                  "capabilities", "tool_metadata", "origin"]
+
+    ITEMS = [{"id": 1, "original_id": 1, "defindex": 344, "level": 10, "quality": 6,
+              "inventory": 0x80000005, "quantity": 1, "origin": 0,
+              "attributes": [{"defindex": 142, "value": 5, "float_value": 7e-45},
+                             {"defindex": 153, "value": 1}]},
+             {"id": 2, "defindex": 344, "quality": 11, "custom_name": "Hat",
+              "custom_desc": "A hat", "flag_cannot_craft": True, "style": 0,
+              "equipped": [{"class": 8, "slot": 7}],
+              "contained_item": {"id": 3, "defindex": 344}},
+             {"id": 4, "defindex": 5000}]
+
+    def _properties(self, item):
+        values = {}
+        for name in self.PROPERTIES:
+            value = getattr(item, name)
+            if name == "attributes":
+                value = [(attr.id, attr.name, attr.value) for attr in value]
+            values[name] = value
+        return values
+
+    def test_properties(self):
+        for schema in (self._schema, None):
+            for data in self.ITEMS:
+                full = items.item(data, schema)
+                compact = items.compact_item(data, schema)
+                self.assertEqual(self._properties(full), self._properties(compact))
+                self.assertEqual(str(full), str(compact))
+                self.assertEqual(142 in full, 142 in compact)
+                self.assertFalse(hasattr(compact, "__dict__"))
+                self.assertFalse(hasattr(compact, "__weakref__"))
+                self.assertEqual(full._rank, compact._rank)
+
+        compact = items.compact_item(self.ITEMS[0], self._schema)
+        self.assertEqual(((142, 5, 7e-45), {"defindex": 153, "value": 1}),
+                         compact._attribute_data)
+        self.assertEqual(None, compact._extra)
+
+        # What stands in for the missing dict is shared, so it can't take fields
+        self.assertEqual({}, dict(compact._item))
+        self.assertRaises(TypeError, operator.setitem, compact._item, "custom_name", "x")
+        self.assertFalse(hasattr(compact._item, "update"))
+
+        contents = items.compact_item(self.ITEMS[1], self._schema).contents
+        self.assertTrue(isinstance(contents, items.compact_item))
+        self.assertEqual(3, contents.id)
+
+    def test_raw_dict_dropped(self):
+        data = dict(self.ITEMS[0], defindex=5000, item_name="Unknown")
+
+        for schema in (self._schema, None):
+            compact = items.compact_item(data, schema)
+            self.assertFalse(compact._schema_item is data)
+            self.assertEqual({"item_name": "Unknown"}, compact._schema_item)
+            self.assertEqual(2, len(compact._attribute_data))
+            self.assertEqual(self._properties(items.item(data, schema)),
+                             self._properties(compact))
+
+    def test_inventory(self):
+        self.inventory = {"result": {"status": 1, "num_backpack_slots": 300,
+                                       "items": self.ITEMS}}
+        full = items.inventory(440, 76561198014028523, self._schema)
+        compact = items.inventory(440, 76561198014028523, self._schema, compact=True)
+
+        self.assertEqual([self._properties(item) for item in full],
+                         [self._properties(item) for item in compact])
+        self.assertEqual(300, compact.cells_total)
+        self.assertTrue(isinstance(compact["2"], items.compact_item))
+
+        # Built once, nothing of the download is kept next to them
+        self.assertTrue(list(compact)[0] is list(compact)[0])
+        self.assertEqual(0, len(compact._api))
+
+    def test_schema_item(self):
+        full = self._schema[344]
+        compact = items.compact_item(self._schema._find_item_by_id(344), self._schema)
+        self.assertEqual(self._properties(full), self._properties(compact))
@@ -0,0 +1,416 @@
+"""
+Benchmarks of building and using inventory items against a synthetic
+TF2-sized schema and backpack, served by a fake transport.
+
+Memory figures come from tracemalloc and barely change between runs, so
+they're gated against itemsbench.json, and compact items and interned
+streams have to take less of it than plain ones. Items are also compared
+with the attributes they copied before ('itemsreference'), without
+tracemalloc or a baseline so it runs on any CPython. Times depend on the
+machine, they're only gated against the reference and with
+STEAMODD_BENCHMARKS set. Run it as "python -m tests.testitemsbench" for a
+report, or with --update-baseline to store the figures after an
+intended change.
+"""
+
+import unittest
+import gc
+import json
+import os
+import sys
+import types
+from timeit import default_timer
+from steam import api, items
+
+try:
+    from . import baseline, itemsreference
+    from .canned import canned_transport, serving
+except (ImportError, ValueError):
+    import baseline
+    import itemsreference
+    from canned import canned_transport, serving
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "itemsbench.json")
+
+# How far memory may grow past the baseline before the gate fails
+MEMORY_TOLERANCE = 1.1
+
+# Nothing may be slower than the copying attributes it replaced
+MIN_SPEEDUP = 1.0
+
+REPEAT = 3
+
+ATTRIBUTES = 2500
+SCHEMA_ITEMS = 12000
+BACKPACK = 3000
+
+
+def schema_json():
+    """ Something shaped like the TF2 GetSchema result """
+    attributes = [{"defindex": i, "name": "attr {0}".format(i),
+                   "attribute_class": "attr_class_{0}".format(i),
+                   "description_string": "+%s1 stat {0}".format(i),
+                   "description_format": "value_is_additive",
+                   "effect_type": ("positive", "negative", "neutral")[i % 3],
+                   "hidden": i % 5 == 0, "stored_as_integer": i % 2 == 0}
+                  for i in range(ATTRIBUTES)]
+
+    schema_items = [{"defindex": i, "item_name": "Item {0}".format(i), "item_type_name": "Hat",
+                     "item_class": "tf_wearable", "item_slot": "head", "item_quality": 6,
+                     "proper_name": i % 2 == 0, "min_ilevel": 1, "max_ilevel": 100,
+                     "image_url": "http://example.com/{0}.png".format(i),
+                     "capabilities": {"nameable": True, "paintable": True},
+                     "used_by_classes": ["Scout", "Soldier"],
+                     "attributes": [{"name": "attr {0}".format(i % ATTRIBUTES), "class": "c",
+                                     "value": 1},
+                                    {"name": "attr {0}".format((i * 7) % ATTRIBUTES),
+                                     "class": "d", "value": 2.5}]}
+                    for i in range(SCHEMA_ITEMS)]
+
+    return {"result": {
+        "status": 1,
+        "items_game_url": "http://example.com/items_game.txt",
+        "qualities": {"normal": 0, "genuine": 1, "unique": 6, "strange": 11},
+        "qualityNames": {"normal": "Normal", "genuine": "Genuine", "unique": "Unique",
+                         "strange": "Strange"},
+        "originNames": [{"origin": i, "name": "Origin {0}".format(i)} for i in range(20)],
+        "attributes": attributes,
+        "item_levels": [{"name": "KillEaterRank",
+                         "levels": [{"level": n, "required_score": n * 10,
+                                     "name": "Rank {0}".format(n)} for n in range(20)]}],
+        "kill_eater_score_types": [{"type": 0, "type_name": "Kills"}],
+        "items": schema_items}}
+
+
+def backpack_json():
+    """ Something shaped like a full GetPlayerItems result """
+    backpack = []
+    for i in range(BACKPACK):
+        attributes = [{"defindex": (i * 13 + n) % ATTRIBUTES, "value": n, "float_value": n * 0.5}
+                      for n in range(i % 4)]
+        backpack.append({"id": 1000000 + i, "original_id": 900000 + i,
+                         "defindex": (i * 31) % SCHEMA_ITEMS, "level": i % 100 + 1,
+                         "quality": (0, 1, 6, 11)[i % 4], "inventory": 0x80000000 | (i + 1),
+                         "quantity": 1, "origin": i % 20, "attributes": attributes})
+
+    return {"result": {"status": 1, "num_backpack_slots": BACKPACK, "items": backpack}}
+
+
+def _transport():
+    """ Serves the synthetic schema and backpack """
+    bodies = {"GetSchema": json.dumps(schema_json()).encode("utf-8"),
+              "GetPlayerItems": json.dumps(backpack_json()).encode("utf-8")}
+
+    def respond(url):
+        for name, body in bodies.items():
+            if name in url:
+                return 200, body
+
+        return 404, b''
+
+    return canned_transport(respond)
+
+
+def _fetch(schema=None, compact=False, transport=None):
+    """ Returns a fetched schema, or backpack if given the 'schema' """
+    with serving(transport or _transport()):
+        if schema is None:
+            schema = items.schema(440, "en_US")
+            schema._schema
+            return schema
+
+        inv = items.inventory(440, 76561198014028523, schema, compact=compact)
+        len(inv)
+        return inv
+
+
+def fixtures():
+    """ Returns a fetched schema and backpack """
+    schema = _fetch()
+    return schema, _fetch(schema)
+
+
+def _ids(inv):
+    for item in inv:
+        item.id, item.schema_id, item.quality
+
+
+def _attributes(inv):
+    for item in inv:
+        for attr in item:
+            attr.value
+
+
+def _lookups(inv):
+    for item in inv:
+        item[142] if 142 in item else None
+        item.tradable, item.craftable
+
+
+def _repeated(inv):
+    for item in inv:
+        for key in (142, 153, "attr 7", "custom employee number"):
+            key in item
+        item.tradable, item.kill_eaters, list(item)
+
+
+def _full_names(inv):
+    for item in inv:
+        item.full_name
+
+
+WORKLOADS = {
+    "ids": _ids,
+    "attributes": _attributes,
+    "lookups": _lookups,
+    "repeated": _repeated,
+    "full_names": _full_names
+}
+
+
+def _time(func, inv):
+    best = None
+    for i in range(REPEAT):
+        start = default_timer()
+        func(inv)
+        took = default_timer() - start
+        if best is None or took < best:
+            best = took
+    return best
+
+
+def _compare(func, backpacks):
+    """ Best times of 'func' over each of 'backpacks', a few runs of one in a
+    row and then the other, which goes first swapping every round, so load
+    changes hit both alike. The garbage collector is kept out of it. """
+    best = [None, None]
+    for run in range(REPEAT * 2):
+        for n in ((0, 1) if run % 2 == 0 else (1, 0)):
+            for i in range(REPEAT):
+                gc.collect()
+                gc.disable()
+                try:
+                    start = default_timer()
+                    func(backpacks[n])
+                    took = default_timer() - start
+                finally:
+                    gc.enable()
+                if best[n] is None or took < best[n]:
+                    best[n] = took
+    return best
+
+
+def _sizes():
+    """ Whether sys.getsizeof works, it doesn't on pypy """
+    try:
+        sys.getsizeof(object())
+        return True
+    except TypeError:
+        return False
+
+
+def _owned_bytes(roots, shared):
+    """ sys.getsizeof of everything reachable from 'roots' that isn't from
+    'shared', classes and modules aside. What objects hold of their own,
+    counted without tracemalloc. """
+    def reach(objects, skip):
+        found = {}
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            key = id(obj)
+            if key in found or key in skip or isinstance(obj, (type, types.ModuleType)):
+                continue
+            found[key] = obj
+            stack.extend(gc.get_referents(obj))
+        return found
+
+    return sum(map(sys.getsizeof, reach(roots, reach(shared, {})).values()))
+
+
+class _backpack(object):
+    """ Builds items of 'cls' over again on every iteration, the way an
+    inventory that isn't compact does """
+
+    def __init__(self, cls, entries, schema):
+        self._cls = cls
+        self._entries = entries
+        self._schema = schema
+
+    def __iter__(self):
+        cls, schema = self._cls, self._schema
+        for data in self._entries:
+            yield cls(data, schema)
+
+
+def compare_speed(schema):
+    """ How many times as fast as over items copying their attributes
+    ('itemsreference') each workload runs, as a dict of figures """
+    entries = backpack_json()["result"]["items"]
+    backpacks = [_backpack(cls, entries, schema) for cls in (items.item, itemsreference.item)]
+    figures = {}
+
+    for name, func in WORKLOADS.items():
+        took, reference = _compare(func, backpacks)
+        figures[name + "_speedup"] = round(reference / took, 2)
+
+    return figures
+
+
+def compare_memory(schema):
+    """ What items hold of their own once their attributes are resolved,
+    as bytes per item, and the same for items copying their attributes.
+    Needs sys.getsizeof, not tracemalloc. """
+    entries = backpack_json()["result"]["items"]
+    figures = {}
+
+    for prefix, cls in (("", items.item), ("reference_", itemsreference.item)):
+        built = list(_backpack(cls, entries, schema))
+        for item in built:
+            item._attributes
+        held = _owned_bytes(built, [schema, entries])
+        figures[prefix + "attribute_bytes_per_item"] = int(held / BACKPACK)
+
+    return figures
+
+
+def _traced(func):
+    """ Returns the bytes still held and the peak while running 'func' """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # Keep what func returns alive while measuring
+        held = func()
+        current, peak = tracemalloc.get_traced_memory()
+        del held
+        return current, peak
+    finally:
+        tracemalloc.stop()
+
+
+def _standalone(cls, body, schema):
+    return [cls(data, schema) for data in json.loads(body)["result"]["items"]]
+
+
+def _streamed(transport, interned):
+    """ The backpack's entries as 'method_result.stream' yields them """
+    api.interning.set(interned)
+    try:
+        with serving(transport):
+            res = api.method_result("https://api.steampowered.com/IEconItems_440/GetPlayerItems/v0001/")
+            return list(res.stream("result", "items"))
+    finally:
+        api.interning.set(False)
+
+
+def measure():
+    """ Runs the workloads over the backpack, returning a dict of figures """
+    schema, inv = fixtures()
+    figures = {}
+
+    for name, func in WORKLOADS.items():
+        figures[name + "_us_per_item"] = round(_time(func, inv) / BACKPACK * 1e6, 2)
+
+        if tracemalloc:
+            figures[name + "_peak_kb"] = round(_traced(lambda: func(inv))[1] / 1e3, 1)
+
+    if tracemalloc:
+        # What a backpack costs when all of it is kept around
+        held = _traced(lambda: [item for item in inv])[0]
+        figures["held_bytes_per_item"] = int(held / BACKPACK)
+
+        held = _traced(lambda: [(item, item.attributes) for item in inv])[0]
+        figures["held_with_attributes_bytes_per_item"] = int(held / BACKPACK)
+
+        # A whole backpack kept, its JSON included unless compact items replace it
+        transport = _transport()
+        for prefix, compact in (("", False), ("compact_", True)):
+            held = _traced(lambda: list(_fetch(schema, compact, transport)))[0]
+            figures[prefix + "inventory_bytes_per_item"] = int(held / BACKPACK)
+
+        # What it costs once the backpack's JSON is dropped, for keeping a lot of items
+        body = json.dumps(backpack_json())
+        for prefix, cls in (("", items.item), ("compact_", items.compact_item)):
+            held = _traced(lambda: _standalone(cls, body, schema))[0]
+            figures[prefix + "standalone_bytes_per_item"] = int(held / BACKPACK)
+
+            held = _traced(lambda: _standalone(cls, body, None))[0]
+            figures[prefix + "standalone_no_schema_bytes_per_item"] = int(held / BACKPACK)
+
+        # Streamed entries are decoded one by one and only share keys if interned
+        for prefix, interned in (("", False), ("interned_", True)):
+            held = _traced(lambda: _streamed(transport, interned))[0]
+            figures[prefix + "streamed_bytes_per_item"] = int(held / BACKPACK)
+
+    return figures
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    @unittest.skipIf(tracemalloc is None, "Needs tracemalloc")
+    def test_memory(self):
+        stored = baseline.load(BASELINE)
+        if not stored:
+            self.skipTest("No baseline for " + baseline.interpreter())
+
+        figures = measure()
+        failed = ["{0}: {1} (baseline {2})".format(key, figures[key], stored[key])
+                  for key in sorted(figures)
+                  if not key.endswith("_us_per_item") and key in stored and
+                  figures[key] > stored[key] * MEMORY_TOLERANCE]
+
+        self.assertFalse(failed, "Regressed: " + "; ".join(failed))
+
+        for key in ("inventory_bytes_per_item", "standalone_bytes_per_item",
+                    "standalone_no_schema_bytes_per_item"):
+            self.assertLess(figures["compact_" + key], figures[key], key)
+
+        self.assertLess(figures["interned_streamed_bytes_per_item"],
+                        figures["streamed_bytes_per_item"])
+
+
+class ReferenceTestCase(unittest.TestCase):
+    """ Against items copying their attributes, which runs on interpreters
+    without tracemalloc or a baseline too """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.schema = _fetch()
+
+    @unittest.skipUnless(_sizes(), "Needs sys.getsizeof")
+    def test_memory(self):
+        figures = compare_memory(self.schema)
+        self.assertLess(figures["attribute_bytes_per_item"],
+                        figures["reference_attribute_bytes_per_item"])
+
+    @unittest.skipUnless(os.environ.get("STEAMODD_BENCHMARKS"),
+                         "Timing gates only run with STEAMODD_BENCHMARKS set")
+    def test_speed(self):
+        # Reading attributes through the overlay costs back about what
+        # copying them did, only iterating without reading them is gated
+        speedup = compare_speed(self.schema)["ids_speedup"]
+        if speedup < MIN_SPEEDUP:
+            speedup = max(speedup, compare_speed(self.schema)["ids_speedup"])
+
+        self.assertGreaterEqual(speedup, MIN_SPEEDUP)
+
+
+def report():
+    figures = measure()
+    schema = _fetch()
+    figures.update(compare_speed(schema))
+    if _sizes():
+        figures.update(compare_memory(schema))
+    for key in sorted(figures):
+        print("{0:45} {1}".format(key, figures[key]))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--update-baseline"]:
+        baseline.update(BASELINE, measure())
+    else:
+        report()
@@ -1,7 +1,18 @@
 import unittest
+import threading
 from steam import user
 from steam import api
 
+try:
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from urlparse import urlsplit, parse_qs
+
+try:
+    from .canned import CannedTestCase
+except (ImportError, ValueError):
+    from canned import CannedTestCase
+
 class ProfileTestCase(unittest.TestCase):
     VALID_ID64 = 76561198014028523
     VALID_ID32 = 53762795
@@ -77,3 +88,57 @@ class ProfileBatchTestCase(ProfileTestCase):
 
         self.assertEqual(resolvedids, set(map(lambda x: str(x.id64), user.profile_batch(userlist))))
         self.assertEqual(resolvedids, set(map(lambda x: str(x.id64), user.bans_batch(userlist))))
+
+
+class ProfileBatchExecutorTestCase(CannedTestCase):
+    SIDS = [str(ProfileTestCase.VALID_ID64 + i) for i in range(250)]
+
+    def _summaries(self, fail_first=False):
+        """ Serves canned player summaries, failing each chunk's first
+        attempt if 'fail_first' """
+        seen = set()
+        lock = threading.Lock()
+
+        def respond(url):
+            sids = parse_qs(urlsplit(url).query)["steamids"][0]
+
+            with lock:
+                fail = fail_first and sids not in seen
+                seen.add(sids)
+
+            if fail:
+                return 503, b''
+
+            return 200, {"response": {"players": [{"steamid": sid, "personaname": sid}
+                                                  for sid in sids.split(',')]}}
+
+        self.serve(respond)
+
+    def test_concurrent(self):
+        self._summaries()
+        results = user.profile_batch(self.SIDS, workers=3)
+        self.assertEqual(set(self.SIDS), set([str(p.id64) for p in results]))
+
+    def test_ordered(self):
+        self._summaries()
+        results = [p.id64 for p in user.profile_batch(self.SIDS, workers=3, ordered=True)]
+        self.assertEqual(sorted(results[:100]), sorted(map(int, self.SIDS[:100])))
+        self.assertEqual(sorted(results[200:]), sorted(map(int, self.SIDS[200:])))
+
+    def test_retry(self):
+        self._summaries(fail_first=True)
+        self.assertRaises(api.HTTPError, list, user.profile_batch(self.SIDS, workers=3))
+
+        self._summaries(fail_first=True)
+        results = user.profile_batch(self.SIDS, workers=3, retries=1)
+        self.assertEqual(len(list(results)), len(self.SIDS))
+
+    def test_retry_policy(self):
+        self._summaries(fail_first=True)
+        policy = api.retry_policy(attempts=1, backoff=0, statuses=(500,))
+        self.assertRaises(api.HTTPError, list, user.profile_batch(self.SIDS, retries=policy))
+
+        self._summaries(fail_first=True)
+        policy = api.retry_policy(attempts=1, backoff=0)
+        results = user.profile_batch(self.SIDS, retries=policy)
+        self.assertEqual(len(list(results)), len(self.SIDS))
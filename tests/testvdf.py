@@ -1,6 +1,19 @@
 import unittest
+import io
+import os
+import shutil
+import tempfile
+import threading
 from steam import vdf
 
+
+def _text_stream(text):
+    """ io.StringIO only takes unicode on python 2 """
+    if not isinstance(text, type(u"")):
+        text = text.decode("utf-8")
+    return io.StringIO(text)
+
+
 class SyntaxTestCase(unittest.TestCase):
     # Deserialization
     UNQUOTED_VDF = """
@@ -293,6 +306,187 @@ class DeserializeTestCase(SyntaxTestCase):
         self.maxDiff = 80*80
         self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.loads(self.MULTIKEY_KNODE))
 
+    def test_conditional_duplicate(self):
+        self.assertEqual({u"node": {u"key": u"win"}},
+                         vdf.loads(u'"node"\n{\n"key" "win" [$WIN32]\n"key" "osx" [$OSX]\n}\n'))
+
+    def test_crlf_and_trailing_comment(self):
+        self.assertEqual(self.EXPECTED_DICT,
+                         vdf.loads(self.QUOTED_VDF.replace("\n", "\r\n") + "// no newline"))
+
+    def test_escaped_quote(self):
+        self.assertEqual({u"key": u'say \\"hi\\"'}, vdf.loads(u'"key" "say \\"hi\\""'))
+
+    def test_deep_nesting(self):
+        depth = 5000
+        tree = vdf.loads(u'"n" {' * depth + u'"key" "value"' + u'}' * depth)
+
+        for i in range(depth):
+            tree = tree[u"n"]
+        self.assertEqual({u"key": u"value"}, tree)
+
+    def test_buffers(self):
+        data = self.MIXED_VDF.encode("utf-8")
+        for buf in (data, bytearray(data), memoryview(data)):
+            self.assertEqual(self.EXPECTED_MIXED_DICT, vdf.loads(buf))
+
+    def test_encodings(self):
+        text = u'"node" { "key" "caf\xe9" }'
+        expected = {u"node": {u"key": u"caf\xe9"}}
+
+        for encoding in ("utf-8", "utf-8-sig", "utf-16", "utf-16-le", "utf-16-be"):
+            data = text.encode(encoding)
+            if encoding != "utf-16-be":
+                self.assertEqual(expected, vdf.loads(data))
+                self.assertEqual(expected, vdf.load(io.BytesIO(data)))
+            self.assertEqual(expected, vdf.loads(data, encoding=encoding))
+            self.assertEqual(expected, vdf.load(io.BytesIO(data), encoding=encoding))
+
+        self.assertEqual(expected, vdf.loads(text.encode("latin-1"), encoding="latin-1"))
+
+    def test_intern_keys(self):
+        text = u"".join([u'"%d" { "name" "n%d" "used_by_classes" { "scout" "1" } }' % (i, i)
+                         for i in range(10)])
+        tree = vdf.loads(text.encode("utf-8"), intern_keys=True)
+        self.assertEqual(vdf.loads(text), tree)
+
+        keys = [[k for k in node if k == u"name"][0] for node in tree.values()]
+        self.assertTrue(all([k is keys[0] for k in keys]))
+
+        tree = vdf.binary_loads(vdf.binary_dumps(tree), intern_keys=True)
+        keys = [[k for k in node if k == u"used_by_classes"][0] for node in tree.values()]
+        self.assertTrue(all([k is keys[0] for k in keys]))
+
+
+class IterparseTestCase(SyntaxTestCase):
+    def test_events(self):
+        self.assertEqual([(vdf.START, u"node", None),
+                          (vdf.START, u"subnode", None),
+                          (vdf.PAIR, u"key", u"value"),
+                          (vdf.END, u"subnode", None),
+                          (vdf.END, u"node", None)],
+                         list(vdf.iterparse(_text_stream(self.SUBNODE_QUOTED_VDF))))
+
+    def test_small_chunks(self):
+        self.assertEqual(self.EXPECTED_MIXED_DICT, vdf.load(_text_stream(self.MIXED_VDF)))
+
+        for size in (1, 2, 3, 7):
+            stream = _text_stream(self.MIXED_VDF)
+            self.assertEqual(self.EXPECTED_MIXED_DICT, vdf._build(vdf.iterparse(stream, size)))
+
+    def test_byte_streams(self):
+        for encoding in ("utf-8", "utf-16", "utf-16-le"):
+            stream = io.BytesIO(self.MULTIKEY_KNODE.encode(encoding))
+            self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf._build(vdf.iterparse(stream, 5)))
+
+    def test_section(self):
+        names = []
+        for event, key, value in vdf.iterparse(_text_stream(self.MULTIKEY_KNODE)):
+            if event == vdf.PAIR and key == u"name":
+                names.append(value)
+        self.assertEqual([u"k1v1", u"k1v2", u"k1v3", u"k2v1", u"k3v1", u"k3v2"], names)
+
+
+class SelectTestCase(SyntaxTestCase):
+    def _sorted(self, values):
+        # Trees are plain dicts, their order isn't the document's everywhere
+        return sorted(map(repr, values))
+
+    def test_wildcard(self):
+        self.assertEqual([u"k1v1", u"k1v2", u"k1v3", u"k2v1", u"k3v1", u"k3v2"],
+                         sorted(vdf.select(self.EXPECTED_MULTIKEY_KNODE, "node/*/name")))
+
+    def test_patterns(self):
+        self.assertEqual(self._sorted([u"I'm lonely", {u"smiley": u":O", u"comment": u"Wow!"},
+                                       {u"smiley": u":Z", u"comment": u"BZZ!"}]),
+                         self._sorted(vdf.select(self.EXPECTED_MULTIKEY_KNODE, "/node/key?/extra/")))
+        self.assertEqual([u":O", u":Z"],
+                         vdf.select(self.EXPECTED_MULTIKEY_KNODE, "node/key3/extra/smiley"))
+        self.assertEqual([], vdf.select(self.EXPECTED_MULTIKEY_KNODE, "node/key2/name/none"))
+        self.assertEqual([], vdf.select(self.EXPECTED_MULTIKEY_KNODE, "missing/*"))
+
+    def test_compiled(self):
+        names = vdf.query("node/*/name")
+        self.assertEqual(names.select(self.EXPECTED_MULTIKEY_KNODE),
+                         vdf.select(self.EXPECTED_MULTIKEY_KNODE, names))
+        self.assertEqual([u"value"], names.select({u"node": {u"x": {u"name": u"value"}}}))
+
+    def test_iterselect(self):
+        for path in ("node/*/name", "node/key3/extra", "node/key", "*", "node/*/*/comment"):
+            self.assertEqual(self._sorted(vdf.select(vdf.loads(self.MULTIKEY_KNODE), path)),
+                             self._sorted(vdf.iterselect(_text_stream(self.MULTIKEY_KNODE), path, 3)))
+
+    def test_iterselect_order(self):
+        text = u'"a" { "x" "1" } "b" { "x" "2" } "a" { "x" "3" }'
+        self.assertEqual([u"1", u"2", u"3"], sorted(vdf.select(vdf.loads(text), "*/x")))
+        self.assertEqual([u"1", u"2", u"3"], list(vdf.iterselect(_text_stream(text), "*/x")))
+
+    def test_mmap_document(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as stream:
+                stream.write(self.MULTIKEY_KNODE.encode("utf-8"))
+
+            with vdf.mmap_document(path) as doc:
+                self.assertEqual([u"k2v1"], vdf.select(doc, "node/key2/name"))
+                self.assertEqual(None, doc[u"node"][u"key3"][0]._tree)
+        finally:
+            os.remove(path)
+
+
+class MmapDocumentTestCase(SyntaxTestCase):
+    TRICKY_VDF = u"""
+    "node"
+    {
+        "brace" "{ not a node }"
+        // } neither is this {
+        "cond" "a" [$X&&!{}]
+        "cond" "b" [$Y]
+        "list" { "n" "1" }
+        "list" { "n" "2" }
+        "caf\xe9" "cr\xe8me"
+    }
+    """
+
+    def setUp(self):
+        self._files = []
+
+    def tearDown(self):
+        for path in self._files:
+            os.remove(path)
+
+    def _document(self, data):
+        fd, path = tempfile.mkstemp()
+        self._files.append(path)
+        with os.fdopen(fd, "wb") as stream:
+            stream.write(data)
+        return vdf.mmap_document(path)
+
+    def test_equivalent(self):
+        for text in (self.MIXED_VDF, self.MULTIKEY_KNODE, self.TRICKY_VDF):
+            with self._document(text.encode("utf-8")) as doc:
+                self.assertEqual(vdf.loads(text), doc.to_dict())
+                self.assertEqual(vdf.loads(text), doc)
+
+    def test_lazy(self):
+        with self._document(self.MULTIKEY_KNODE.encode("utf-8")) as doc:
+            node = doc[u"node"]
+            key3 = node[u"key3"]
+            self.assertTrue(isinstance(key3[1], vdf.lazy_node))
+            self.assertEqual(None, key3[1]._tree)
+            self.assertEqual(u"BZZ!", key3[1][u"extra"][u"comment"])
+            self.assertEqual(None, key3[0]._tree)
+            self.assertEqual(None, node[u"key2"]._tree)
+
+    def test_bom_and_empty(self):
+        with self._document(b"\xef\xbb\xbf" + self.QUOTED_VDF.encode("utf-8")) as doc:
+            self.assertEqual(self.EXPECTED_DICT, doc)
+
+        with self._document(b"") as doc:
+            self.assertEqual({}, doc)
+
+        self.assertRaises(ValueError, self._document, self.QUOTED_VDF.encode("utf-16"))
+
 
 class SerializeTestCase(SyntaxTestCase):
     def test_simple_dict(self):
@@ -309,3 +503,179 @@ class SerializeTestCase(SyntaxTestCase):
 
     def test_combination_dict(self):
         self.assertEqual(self.EXPECTED_COMBINATION_DICT, vdf.loads(vdf.dumps(self.COMBINATION_DICT)))
+
+    def test_escaped_quotes(self):
+        tree = {u"node": {u"say": u'\\"hi\\" \\"there\\"', u"path": u"C:\\Games\\game.exe"}}
+        self.assertEqual(tree, vdf.loads(vdf.dumps(tree)))
+        self.assertEqual({u"say": u'\\"hi\\"'}, vdf.loads(vdf.dumps({u"say": u'"hi"'})))
+
+    def test_node_lists(self):
+        self.assertEqual(self.EXPECTED_MULTIKEY_KNODE,
+                         vdf.loads(vdf.dumps(self.EXPECTED_MULTIKEY_KNODE)))
+
+    def test_big_nodes(self):
+        # Short values are written in one go, long ones piece by piece
+        for length in (4, 1000):
+            for quote in (u"", u'\\"'):
+                node = dict([(u"key" + str(i), u"v" * length + quote + str(i)) for i in range(40)])
+                tree = {u"node": node, u"list": [u"x" * length + quote, u"y"]}
+                expected = {u"node": node, u"list": {u"x" * length + quote: u"1", u"y": u"1"}}
+
+                for compact in (False, True):
+                    self.assertEqual(expected, vdf.loads(vdf.dumps(tree, compact=compact)))
+
+    def test_encodings(self):
+        for encoding in ("utf-8", "utf-16"):
+            data = vdf.dumps(self.COMBINATION_DICT, encoding)
+            self.assertEqual(self.EXPECTED_COMBINATION_DICT, vdf.loads(data))
+            self.assertEqual(data.decode(encoding), vdf.dumps(self.COMBINATION_DICT, None))
+
+    def test_compact(self):
+        text = vdf.dumps(self.EXPECTED_MULTIKEY_KNODE, None, compact=True)
+        self.assertFalse(u"\n" in text)
+        self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.loads(text))
+
+    def test_stream(self):
+        stream = io.BytesIO()
+        vdf.dump(self.COMBINATION_DICT, stream, "utf-8")
+        self.assertEqual(vdf.dumps(self.COMBINATION_DICT, "utf-8"), stream.getvalue())
+
+    def test_concurrent(self):
+        tree = {u"node": dict([(str(i), {u"sub": {u"key": str(i)}}) for i in range(200)])}
+        expected = vdf.dumps(tree, None)
+        results = []
+
+        def run():
+            results.append(vdf.dumps(tree, None))
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([expected] * 8, results)
+
+class BinaryTestCase(unittest.TestCase):
+    SHORTCUTS = {
+        u"shortcuts": {
+            u"0": {
+                u"AppName": u"Game",
+                u"Exe": u"\"C:\\Game\\game.exe\"",
+                u"LastPlayTime": 1380000000,
+                u"tags": {u"0": u"favorite"}
+                },
+            u"1": {
+                u"AppName": u"M\xf6tley",
+                u"appid": -1,
+                u"gameid": 0xfffffffe00000000,
+                u"scale": 0.5
+                }
+            }
+        }
+
+    def test_layout(self):
+        self.assertEqual(b'\x00root\x00\x01key\x00value\x00\x02n\x00\x07\x00\x00\x00\x08\x08',
+                         vdf.binary_dumps({u"root": {u"key": u"value", u"n": 7}}))
+
+    def test_round_trip(self):
+        data = vdf.binary_dumps(self.SHORTCUTS)
+        self.assertEqual(self.SHORTCUTS, vdf.binary_loads(data))
+        self.assertEqual(self.SHORTCUTS, vdf.binary_loads(memoryview(data)))
+        self.assertEqual(self.SHORTCUTS, vdf.binary_load(io.BytesIO(data)))
+
+    def test_duplicate_keys(self):
+        tree = {u"node": {u"key": [u"a", u"b", {u"sub": u"c"}]}}
+        self.assertEqual(tree, vdf.binary_loads(vdf.binary_dumps(tree)))
+
+    def test_mapped_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as stream:
+                vdf.binary_dump(self.SHORTCUTS, stream)
+            with open(path, "rb") as stream:
+                self.assertEqual(self.SHORTCUTS, vdf.binary_load(stream))
+        finally:
+            os.remove(path)
+
+    def test_malformed(self):
+        data = vdf.binary_dumps(self.SHORTCUTS)
+        self.assertRaises(ValueError, vdf.binary_loads, data[:data.index(b"\x02LastPlayTime") + 16])
+        self.assertRaises(ValueError, vdf.binary_loads, b"\x0fkey\x00\x08")
+
+
+class LoadCachedTestCase(SyntaxTestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._cache = os.path.join(self._dir, "cache")
+        self._path = os.path.join(self._dir, "items_game.txt")
+        self._write(self.MULTIKEY_KNODE)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, text, mtime=1380000000):
+        with open(self._path, "wb") as f:
+            f.write(text.encode("utf-16"))
+        os.utime(self._path, (mtime, mtime))
+
+    def test_snapshot(self):
+        self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.load_cached(self._path, self._cache))
+        self.assertEqual(1, len(os.listdir(self._cache)))
+
+        # Same size and mtime, so the snapshot is trusted without reading the file
+        self._write(self.MULTIKEY_KNODE.replace("k1v1", "k9v9"))
+        self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.load_cached(self._path, self._cache))
+
+    def test_loaded_differently(self):
+        vdf.load_cached(self._path, self._cache)
+
+        # Same size and mtime again, the file is only parsed if the snapshot is stale
+        self._write(self.MULTIKEY_KNODE.replace("k1v1", "k9v9"))
+        tree = vdf.load_cached(self._path, self._cache, encoding="utf-16")
+        self.assertEqual(u"k9v9", tree[u"node"][u"key"][0][u"name"])
+
+        # Aliases of the encoding it was snapshotted with are the same
+        self._write(self.MULTIKEY_KNODE.replace("k1v1", "k8v8"))
+        tree = vdf.load_cached(self._path, self._cache, encoding="UTF16")
+        self.assertEqual(u"k9v9", tree[u"node"][u"key"][0][u"name"])
+
+        tree = vdf.load_cached(self._path, self._cache, encoding="utf-16", intern_keys=True)
+        self.assertEqual(u"k8v8", tree[u"node"][u"key"][0][u"name"])
+        self.assertEqual(1, len(os.listdir(self._cache)))
+
+    def test_touched(self):
+        vdf.load_cached(self._path, self._cache)
+        self._write(self.MULTIKEY_KNODE, 1390000000)
+        self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.load_cached(self._path, self._cache))
+
+        self._write(self.MULTIKEY_KNODE.replace("k1v1", "k9v9"), 1400000000)
+        tree = vdf.load_cached(self._path, self._cache)
+        self.assertEqual(u"k9v9", tree[u"node"][u"key"][0][u"name"])
+        self.assertEqual(tree, vdf.load_cached(self._path, self._cache))
+
+    def test_corrupt_snapshot(self):
+        vdf.load_cached(self._path, self._cache)
+        snapshot = os.path.join(self._cache, os.listdir(self._cache)[0])
+        with open(snapshot, "r+b") as f:
+            f.truncate(40)
+        self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.load_cached(self._path, self._cache))
+
+    @unittest.skipIf(not hasattr(os, "getuid"), "Needs POSIX users")
+    def test_default_dir(self):
+        old = tempfile.tempdir
+        tempfile.tempdir = self._dir
+        try:
+            self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.load_cached(self._path))
+            cache = os.path.join(self._dir, "steamodd-vdf-{0}".format(os.getuid()))
+            self.assertEqual(0o700, os.stat(cache).st_mode & 0o777)
+            self.assertEqual(1, len(os.listdir(cache)))
+
+            # A directory others can write to isn't trusted or written to
+            shutil.rmtree(cache)
+            os.mkdir(cache)
+            os.chmod(cache, 0o777)
+            self.assertEqual(self.EXPECTED_MULTIKEY_KNODE, vdf.load_cached(self._path))
+            self.assertEqual([], os.listdir(cache))
+        finally:
+            tempfile.tempdir = old
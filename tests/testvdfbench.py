@@ -0,0 +1,560 @@
+"""
+VDF benchmarks and differential fuzzing against the old parser.
+
+Throughput is measured against 'vdfreference' on the same input and
+gated, along with memory, against the figures in vdfbench.json for this
+interpreter. Whatever the baseline says, nothing may be slower than the
+code it replaced. The tokenizer was asked to parse items_game 10x as
+fast, it gets there on python 2 but only reaches about 3x on CPython
+3, which runs the reference's char by char loop a lot faster.
+
+Memory figures barely change between runs and are always gated. Times
+depend on the machine and its load, so those gates only run with
+STEAMODD_BENCHMARKS set, against a baseline stored on the same machine.
+Run it as "python -m tests.testvdfbench" for a report, or with
+--update-baseline to store the figures after an intended change.
+"""
+
+import unittest
+import gc
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+from steam import vdf
+
+try:
+    from . import baseline, vdfreference
+except (ImportError, ValueError):
+    import baseline
+    import vdfreference
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vdfbench.json")
+
+# How far speed may fall below the baseline before the gate fails,
+# timings are noisy even when nothing else runs
+SPEED_TOLERANCE = 0.85
+
+# Nothing may be slower than what it replaced
+MIN_SPEEDUP = 1.0
+
+# How far memory may grow past the baseline. Figures under a megabyte
+# move by more than that from a few stray allocations or pages, hence
+# the slack on top.
+MEMORY_TOLERANCE = 1.1
+MEMORY_SLACK_MB = 0.25
+
+# Measurements of a workload before a gate gives up on it
+ATTEMPTS = 3
+
+SPEED_FIGURES = frozenset(["parse_mb_s", "dump_mb_s", "parse_speedup", "dump_speedup"])
+MEMORY_FIGURES = frozenset(["parse_peak_rss_mb", "tree_mb", "parse_overhead_mb",
+                            "interned_tree_mb"])
+
+REPEAT = 3
+
+# Runs in a row of each side within a round of a comparison
+BLOCK = 5
+
+# Short workloads are repeated until they've taken this long, a few runs
+# of a millisecond are mostly noise
+MIN_SECONDS = 0.25
+
+
+# Generators, all deterministic so figures are comparable between runs
+
+def items_game(count=6000):
+    """ Something shaped like the TF2 item schema """
+    parts = ['"items_game"\n{\n\t"items"\n\t{\n']
+    for n in range(count):
+        parts.append('\t\t"{0}"\n\t\t{{\n'
+                     '\t\t\t"name"\t\t"Item {0}"\n'
+                     '\t\t\t"prefab"\t\t"weapon_{1}" [$WIN32]\n'
+                     '\t\t\t"item_quality"\t\t"unique"\n'
+                     '\t\t\t"used_by_classes"\n\t\t\t{{\n'
+                     '\t\t\t\t"scout"\t\t"1"\n\t\t\t\t"heavy"\t\t"1"\n\t\t\t}}\n'
+                     '\t\t\t"attributes"\n\t\t\t{{\n'
+                     '\t\t\t\t"damage bonus"\n\t\t\t\t{{\n'
+                     '\t\t\t\t\t"attribute_class"\t"mult_dmg"\n'
+                     '\t\t\t\t\t"value"\t"1.{2}"\n\t\t\t\t}}\n\t\t\t}}\n'
+                     '\t\t}}\n'.format(n, n % 40, n % 10))
+    parts.append('\t}\n}\n')
+    return ''.join(parts)
+
+
+def deep_nesting(depth=300, count=120):
+    """ Chains of nodes 'depth' levels deep, shallow enough for the
+    recursive reference parser """
+    chain = ''.join(['"level{0}"\n{{\n"depth" "{0}"\n'.format(n) for n in range(depth)])
+    chain += '}\n' * depth
+    return ''.join(['"chain{0}"\n{{\n{1}}}\n'.format(n, chain) for n in range(count)])
+
+
+def long_strings(count=120, length=8000):
+    """ Few keys with long values, mostly spent scanning for quotes """
+    rnd = random.Random(0)
+    alphabet = "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789\t.,:;()"
+    parts = ['"strings"\n{\n']
+    for n in range(count):
+        value = ''.join([rnd.choice(alphabet) for i in range(length)])
+        parts.append('\t"string{0}"\t"{1}"\n'.format(n, value))
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+def long_values(count=400, length=2000):
+    """ Long values in repeated nodes and lists, the shapes the dumper
+    writes in one go when they're short """
+    rnd = random.Random(1)
+    alphabet = "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789.,"
+    parts = ['"descriptions"\n{\n']
+    for n in range(count):
+        value = ''.join([rnd.choice(alphabet) for i in range(length)])
+        parts.append('\t"item"\n\t{{\n\t\t"text"\t"{0}"\n\t}}\n'.format(value))
+        parts.append('\t"note"\t"{0}"\n'.format(value[::-1]))
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+def duplicate_keys(count=20000):
+    """ The same keys over and over, which load as lists """
+    parts = ['"dupes"\n{\n']
+    for n in range(count):
+        parts.append('\t"key"\t"value{0}"\n'.format(n))
+        if n % 4 == 0:
+            parts.append('\t"node"\n\t{{\n\t\t"id"\t"{0}"\n\t}}\n'.format(n))
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+def comment_heavy(count=8000):
+    """ More comment than data, with comments after values and braces """
+    parts = ['// Generated file, do not edit\n"commented"\n{ // open\n']
+    for n in range(count):
+        parts.append('\t// The next pair is number {0} of {1}\n'
+                     '\t//\n'
+                     '\t"key{0}"\t"value"\t// trailing comment\n'.format(n, count))
+    parts.append('} // close\n')
+    return ''.join(parts)
+
+
+WORKLOADS = {
+    "items_game": items_game,
+    "deep_nesting": deep_nesting,
+    "long_strings": long_strings,
+    "long_values": long_values,
+    "duplicate_keys": duplicate_keys,
+    "comment_heavy": comment_heavy
+}
+
+
+def _compare(func, reference, arg):
+    """ Best times in seconds of 'func' and 'reference' over at least
+    REPEAT rounds, so load changes hit both alike. Returns them along with
+    the results of the last runs. Each round runs one a few times in a row
+    and then the other, which goes first swapping every round: interleaving
+    single runs has each start on the heap the other left behind, and big
+    allocations then cost page faults that aren't its own. Like timeit, the
+    garbage collector is kept out of the timings, what it would cost
+    depends on whatever ran before. """
+    best = [None, None]
+    results = [None, None]
+    runs = 0
+    spent = 0
+    while runs < REPEAT or spent < MIN_SECONDS:
+        order = (0, 1) if runs % 2 == 0 else (1, 0)
+        for n in order:
+            f = (func, reference)[n]
+            for i in range(BLOCK):
+                # Freeing the last result isn't part of the run either
+                results[n] = None
+                gc.collect()
+                gc.disable()
+                try:
+                    start = default_timer()
+                    results[n] = f(arg)
+                    took = default_timer() - start
+                finally:
+                    gc.enable()
+                spent += took
+                if best[n] is None or took < best[n]:
+                    best[n] = took
+        runs += 1
+    return best + results
+
+
+def _parse_rss(text):
+    """ How far RSS peaks in bytes over what it was before parsing 'text',
+    measured in a fresh interpreter so earlier work doesn't hide it """
+    if not resource:
+        return None
+
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([root] + [p for p in [env.get("PYTHONPATH")] if p])
+    fd, path = tempfile.mkstemp(suffix=".vdf")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(text.encode("utf-8"))
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                          "--rss", path], env=env)
+    finally:
+        os.remove(path)
+
+    return int(output.decode("ascii").strip())
+
+
+def _rss():
+    """ Current and peak RSS in bytes """
+    # Linux carries ru_maxrss over from the parent through fork and exec
+    try:
+        with open("/proc/self/status") as f:
+            status = dict([line.split(":", 1) for line in f if ":" in line])
+        return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+    except (EnvironmentError, KeyError, ValueError):
+        pass
+
+    # kB everywhere but on OS X, and no current figure at all
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return peak, peak
+
+
+def _reset_peak():
+    """ Brings the peak RSS down to the current one where Linux allows it,
+    so what starting up took isn't counted as the parse's """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except EnvironmentError:
+        pass
+
+
+def _rss_child(path):
+    with open(path, "rb") as f:
+        text = f.read().decode("utf-8")
+    # A first parse settles whatever the parser sets up lazily, which
+    # otherwise lands on the figure in amounts depending on the heap layout
+    vdf.loads(u'"a" { "b" "c" }')
+    gc.collect()
+    _reset_peak()
+    before = _rss()[0]
+    vdf.loads(text)
+    print(_rss()[1] - before)
+
+
+def _parse_memory(text, intern_keys=False):
+    """ Bytes held by the tree of 'text' and the most held at any point
+    while parsing it, according to tracemalloc """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tree = vdf.loads(text, intern_keys=intern_keys)
+        held, peak = tracemalloc.get_traced_memory()
+        del tree
+        return held, peak
+    finally:
+        tracemalloc.stop()
+
+
+def measure_speed(name):
+    """ Runs workload 'name' through the parser and dumper and their
+    reference versions, returning a dict of throughput figures """
+    text = WORKLOADS[name]()
+    size = len(text.encode("utf-8")) / 1e6
+
+    parse, ref_parse, tree = _compare(vdf.loads, vdfreference.loads, text)[:3]
+    dump, ref_dump = _compare(vdf.dumps, vdfreference.dumps, tree)[:2]
+
+    return {
+        "size_mb": round(size, 3),
+        "parse_mb_s": round(size / parse, 2),
+        "dump_mb_s": round(size / dump, 2),
+        "parse_speedup": round(ref_parse / parse, 2),
+        "dump_speedup": round(ref_dump / dump, 2)
+    }
+
+
+def measure_memory(name):
+    """ Parses workload 'name', returning a dict of memory figures """
+    text = WORKLOADS[name]()
+    figures = {}
+
+    rss = _parse_rss(text)
+    if rss is not None:
+        figures["parse_peak_rss_mb"] = round(rss / 1e6, 2)
+
+    if tracemalloc:
+        held, peak = _parse_memory(text)
+        figures["tree_mb"] = round(held / 1e6, 2)
+        # What parsing needs on top of the tree, copies of the text show up here
+        figures["parse_overhead_mb"] = round((peak - held) / 1e6, 2)
+
+        if name == "items_game":
+            figures["interned_tree_mb"] = round(_parse_memory(text, True)[0] / 1e6, 2)
+
+    return figures
+
+
+def measure(name):
+    """ All figures of workload 'name' """
+    figures = measure_speed(name)
+    figures.update(measure_memory(name))
+    return figures
+
+
+def typical(name):
+    """ The median of each figure of workload 'name' over ATTEMPTS
+    measurements, what baselines are stored as. Gates keep the best of up
+    to as many, so a single lucky run doesn't set a bar they can't reach. """
+    runs = [measure(name) for attempt in range(ATTEMPTS)]
+    return dict([(key, sorted([figures[key] for figures in runs])[len(runs) // 2])
+                 for key in runs[0]])
+
+
+def regressions(name, figures, stored):
+    """ What 'figures' of workload 'name' miss, compared with the 'stored'
+    baseline of all workloads """
+    stored = stored.get(name, {})
+    failed = []
+
+    for key in sorted(figures):
+        value = figures[key]
+
+        if key in SPEED_FIGURES:
+            # Speedups hold against the old code, throughput against the baseline
+            if key.endswith("_speedup"):
+                if value < MIN_SPEEDUP:
+                    failed.append((key, MIN_SPEEDUP))
+            elif key in stored and value < stored[key] * SPEED_TOLERANCE:
+                failed.append((key, stored[key]))
+        elif key in MEMORY_FIGURES and key in stored:
+            if value > stored[key] * MEMORY_TOLERANCE + MEMORY_SLACK_MB:
+                failed.append((key, stored[key]))
+
+    if "interned_tree_mb" in figures and figures["interned_tree_mb"] >= figures["tree_mb"]:
+        failed.append(("interned_tree_mb", figures["tree_mb"]))
+
+    return ["{0} {1}: {2} (baseline {3})".format(name, key, figures[key], expected)
+            for key, expected in failed]
+
+
+def _best(figures, others):
+    """ The better of each of two sets of figures of the same workload """
+    best = dict(figures)
+    for key, value in others.items():
+        if key not in best:
+            best[key] = value
+        elif key in SPEED_FIGURES:
+            best[key] = max(best[key], value)
+        elif key in MEMORY_FIGURES:
+            best[key] = min(best[key], value)
+    return best
+
+
+class _Workloads(object):
+    """ A gate per workload, 'measure' returns the figures checked """
+
+    def setUp(self):
+        self.stored = baseline.load(BASELINE)
+
+    def _check(self, name):
+        figures = self.measure(name)
+        failed = regressions(name, figures, self.stored)
+
+        # Give a busy machine more chances before calling it a miss, keeping
+        # the best of each figure as timeit keeps the best of its runs
+        for attempt in range(1, ATTEMPTS):
+            if not failed:
+                break
+            figures = _best(figures, self.measure(name))
+            failed = regressions(name, figures, self.stored)
+
+        self.assertFalse(failed, "Regressed: " + "; ".join(failed))
+
+    def test_items_game(self):
+        self._check("items_game")
+
+    def test_deep_nesting(self):
+        self._check("deep_nesting")
+
+    def test_long_strings(self):
+        self._check("long_strings")
+
+    def test_long_values(self):
+        self._check("long_values")
+
+    def test_duplicate_keys(self):
+        self._check("duplicate_keys")
+
+    def test_comment_heavy(self):
+        self._check("comment_heavy")
+
+
+class MemoryTestCase(_Workloads, unittest.TestCase):
+    measure = staticmethod(measure_memory)
+
+
+@unittest.skipUnless(os.environ.get("STEAMODD_BENCHMARKS"),
+                     "Timing gates only run with STEAMODD_BENCHMARKS set")
+class SpeedTestCase(_Workloads, unittest.TestCase):
+    measure = staticmethod(measure_speed)
+
+
+class FuzzTestCase(unittest.TestCase):
+    """ Random documents through every parser path, compared with the
+    reference. STEAMODD_FUZZ_ITERATIONS and STEAMODD_FUZZ_SEED change how
+    long it runs and what it generates. """
+
+    PIECES = ['"a"', '"b"', '"k"', '"x y"', 'key', 'val', '{', '}', '[$X]', '[$!Y]',
+              ' ', ' ', '\t', '\n', '\r\n', '\r', '"esc\\"q"', '//c\n', '/', '"',
+              '[', ']', 'a}', 'b{', '"\\\\"', '""', '  ', '\n\n   ', u'"\u00e9\u2603"']
+
+    def setUp(self):
+        self.iterations = int(os.environ.get("STEAMODD_FUZZ_ITERATIONS", 1500))
+        self.seed = int(os.environ.get("STEAMODD_FUZZ_SEED", 0))
+        self.rnd = random.Random(self.seed)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _soup(self):
+        # Always unicode, io.StringIO won't take anything else on python 2
+        text = u''.join([self.rnd.choice(self.PIECES) for i in range(self.rnd.randint(0, 30))])
+
+        # The reference never returns from a comment on the last line
+        if "//" in text[text.rfind('\n') + 1:]:
+            text += u'\n'
+
+        return text
+
+    def _string(self):
+        alphabet = u"abc xyz\t\u00e9{}[]/"
+        value = u''.join([self.rnd.choice(alphabet) for i in range(self.rnd.randint(0, 8))])
+        # Escaped quotes survive a round trip, a trailing backslash can't
+        return value.replace('/', '\\"')
+
+    def _tree(self, depth=0):
+        tree = {}
+        for i in range(self.rnd.randint(0, 5)):
+            key = self._string()
+            if depth < 4 and self.rnd.random() < 0.3:
+                value = self._tree(depth + 1)
+            else:
+                value = self._string()
+            if key in tree and isinstance(value, dict):
+                # Lists of strings are dumped as a node of them, only
+                # repeated nodes come back as lists
+                vdf._merge(tree, key, value)
+            else:
+                tree[key] = value
+        return tree
+
+    def _parsers(self, text):
+        path = os.path.join(self.tmpdir, "fuzz.vdf")
+        with open(path, "wb") as f:
+            f.write(text.encode("utf-8"))
+
+        chunk_size = self.rnd.randint(1, 8)
+
+        yield "loads", vdf.loads(text)
+        yield "loads utf-8", vdf.loads(text.encode("utf-8"))
+        yield "loads utf-16", vdf.loads(text.encode("utf-16"))
+        yield "iterparse", vdf._build(vdf.iterparse(io.StringIO(text), chunk_size))
+        yield "iterparse utf-16", vdf._build(vdf.iterparse(io.BytesIO(text.encode("utf-16")),
+                                                           chunk_size))
+        with open(path, "rb") as f:
+            yield "load", vdf.load(f)
+        with vdf.mmap_document(path) as document:
+            yield "mmap_document", document.to_dict()
+
+        # A path of its own, rewrites within the mtime's resolution would
+        # be taken for the same file. Nodes missing their key load with a
+        # None one, which snapshots have to keep as well.
+        fd, cached = tempfile.mkstemp(".vdf", dir=self.tmpdir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(text.encode("utf-8"))
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        yield "load_cached", vdf.load_cached(cached, cache_dir)
+        yield "load_cached snapshot", vdf.load_cached(cached, cache_dir)
+
+        # Windows small enough for tokens to straddle them
+        window = vdf._WINDOW
+        vdf._WINDOW = self.rnd.randint(1, 16)
+        try:
+            yield "small windows", vdf.loads(text)
+        finally:
+            vdf._WINDOW = window
+
+    def test_parsers(self):
+        for i in range(self.iterations):
+            text = self._soup()
+            expected = vdfreference.loads(text)
+
+            for name, tree in self._parsers(text):
+                self.assertEqual(tree, expected, "{0} differs on {1!r} (seed {2})".format(
+                    name, text, self.seed))
+
+    def test_select(self):
+        steps = ["*", "a", "b", "k", "key", "?", "[ab]", "x y"]
+
+        for i in range(self.iterations):
+            text = self._soup()
+            path = '/'.join([self.rnd.choice(steps) for n in range(self.rnd.randint(1, 3))])
+            expected = vdf.select(vdfreference.loads(text), path)
+            streamed = list(vdf.iterselect(io.StringIO(text), path, self.rnd.randint(1, 8)))
+
+            # Streaming goes in document order, the tree groups duplicate keys
+            self.assertEqual(sorted(map(repr, streamed)), sorted(map(repr, expected)),
+                             "iterselect {0!r} differs on {1!r} (seed {2})".format(
+                                 path, text, self.seed))
+
+    def test_round_trip(self):
+        cache_dir = os.path.join(self.tmpdir, "cache")
+
+        for i in range(self.iterations // 5):
+            tree = self._tree()
+            msg = "{0!r} (seed {1})".format(tree, self.seed)
+
+            self.assertEqual(vdf.loads(vdf.dumps(tree)), tree, msg)
+            self.assertEqual(vdf.loads(vdf.dumps(tree, compact=True)), tree, msg)
+            self.assertEqual(vdf.binary_loads(vdf.binary_dumps(tree)), tree, msg)
+
+            path = os.path.join(self.tmpdir, "tree{0}.vdf".format(i))
+            with open(path, "wb") as f:
+                vdf.dump(tree, f)
+            self.assertEqual(vdf.load_cached(path, cache_dir), tree, msg)
+            # Now from the snapshot
+            self.assertEqual(vdf.load_cached(path, cache_dir), tree, msg)
+
+
+def report():
+    for name in sorted(WORKLOADS):
+        figures = measure(name)
+        print("{0:16} {1}".format(name, ", ".join(["{0} {1}".format(k, v)
+                                                     for k, v in sorted(figures.items())])))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--rss"]:
+        _rss_child(sys.argv[2])
+    elif sys.argv[1:2] == ["--update-baseline"]:
+        baseline.update(BASELINE, dict([(name, typical(name)) for name in WORKLOADS]))
+    else:
+        report()